@@ -3,20 +3,19 @@
 ###############################################
 import logging
 import os
-from typing import List, Dict
+from typing import Callable, List, Dict
 from dotenv import load_dotenv
 import uuid
 
 # LangChain core
 from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain_openai import ChatOpenAI
 
 # Importaciones locales
-from agent.retriever import QdrantRetriever
+from agent.registry import get_chat_llm, get_retriever
 from agent.memory import ChatHistory
 from agent.memory import SimpleMemory
 from agent.prompt_templates import SchemaPromptTemplates
-from agent.tools import search_and_generate_sql
+from agent.tools import search_and_generate_sql, stream_sql_tokens
 from agent.utils.logging_config import setup_logging
 
 load_dotenv()
@@ -40,7 +39,8 @@ class Agent:
         self.llm = self._load_llm()
 
         # RAG
-        self.retriever = QdrantRetriever()
+        # Compartido por todo el proceso (mismo retriever que usa la tool), ver registry.py
+        self.retriever = get_retriever()
 
         # Memoria
         self.chat_history = ChatHistory()
@@ -64,20 +64,35 @@ class Agent:
     def _load_llm(self):
         """
         Devuelve la instancia de LLM según el proveedor.
+        La instancia se comparte entre agentes con la misma configuración (ver registry.py).
         """
-        if self.llm_provider == "OPENAI":
-            return ChatOpenAI(model=self.llm_model, temperature=self.llm_temperature)
-        # Añadir futuros proveedores de LLM elif
-        else:
-            raise ValueError(f"Proveedor LLM todavía no soportado: {self.llm_provider}")
+        return get_chat_llm(self.llm_provider, self.llm_model, self.llm_temperature)
 
     #  Chat
-    def chat(self, message: str) -> str:
-        """Envía un mensaje al agente y devuelve la respuesta."""
+    def chat(self, message: str, on_token: Callable[[str], None] | None = None) -> str:
+        """
+        Envía un mensaje al agente y devuelve la respuesta.
+        Si se indica `on_token`, recibe en streaming los fragmentos del script SQL según los genera la tool
+        (la respuesta completa se sigue devolviendo al final).
+        """
         try:
+            # La tool se ejecuta en este mismo hilo, y hereda el receptor de tokens.
+            with stream_sql_tokens(on_token):
+                resp = self.executor.invoke({"input": message})["output"]
             
-            resp = self.executor.invoke({"input": message})["output"]
-            
+            return resp
+        except Exception as exc:
+            logger.error(f"Fallo al procesar mensaje: {exc}")
+            return str(exc)
+
+    async def achat(self, message: str, on_token: Callable[[str], None] | None = None) -> str:
+        """
+        Variante asíncrona de `chat`: la tool usa los clientes asíncronos de OpenAI y Qdrant,
+        así un mismo proceso puede atender muchas sesiones concurrentes sin un hilo por llamada.
+        """
+        try:
+            with stream_sql_tokens(on_token):
+                resp = (await self.executor.ainvoke({"input": message}))["output"]
             return resp
         except Exception as exc:
             logger.error(f"Fallo al procesar mensaje: {exc}")
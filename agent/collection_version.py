@@ -0,0 +1,72 @@
+###############################################
+# collection_version.py
+###############################################
+# Notas:
+# Marca de versión de una colección de conocimiento en Qdrant.
+# El loader la reescribe cada vez que la colección cambia, y el retriever la consulta
+# para invalidar sus cachés. Se guarda como único punto de una colección auxiliar
+# `<colección>__meta`, para no mezclarla con los vectores de las tablas ni con su recuento.
+
+import logging
+from datetime import datetime
+from typing import Any, Dict
+from uuid import NAMESPACE_URL, uuid4, uuid5
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+logger = logging.getLogger(__name__)
+
+META_SUFFIX = "__meta"
+
+def _meta_point_id(collection: str) -> str:
+    return str(uuid5(NAMESPACE_URL, f"{collection}{META_SUFFIX}"))
+
+def write_collection_version(client: QdrantClient, collection: str) -> str:
+    """
+    Genera una versión nueva para la colección y la guarda en Qdrant.
+    Devuelve la versión escrita.
+    """
+    meta_collection = f"{collection}{META_SUFFIX}"
+    if not client.collection_exists(meta_collection):
+        client.create_collection(
+            collection_name=meta_collection,
+            vectors_config=models.VectorParams(size=1, distance=models.Distance.COSINE),
+        )
+
+    version = str(uuid4())
+    client.upsert(meta_collection, [
+        models.PointStruct(
+            id=_meta_point_id(collection),
+            vector=[1.0],
+            payload={
+                "collection": collection,
+                "version": version,
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+            },
+        )
+    ])
+    logger.info(f"Versión de la colección {collection} actualizada: {version}")
+    return version
+
+def read_collection_version(client: QdrantClient, collection: str) -> Dict[str, Any]:
+    """
+    Devuelve la versión actual de la colección: {"version": str | None, "points_count": int | None}
+    El número de puntos también forma parte de la versión, por si la colección
+    se ha modificado sin pasar por el loader.
+    """
+    version = None
+    points_count = None
+    try:
+        points_count = client.get_collection(collection).points_count
+    except Exception as e:
+        logger.warning(f"No se pudo leer el número de puntos de {collection}: {e}")
+
+    try:
+        records = client.retrieve(f"{collection}{META_SUFFIX}", ids=[_meta_point_id(collection)], with_payload=True)
+        if records:
+            version = records[0].payload.get("version")
+    except Exception:
+        # Colecciones cargadas antes de existir la marca de versión
+        pass
+
+    return {"version": version, "points_count": points_count}
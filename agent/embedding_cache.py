@@ -0,0 +1,308 @@
+###############################################
+# embedding_cache.py
+###############################################
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+from agent.embeddings import BaseEmbedder
+from agent.utils.logging_config import setup_logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo de ficheros entre procesos (ver EmbeddingCache)
+    fcntl = None
+
+load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """
+    Caché local y persistente de embeddings, compartida por loader, retriever y evaluator.
+
+    Hay un directorio por (modelo, tamaño de vector), y dentro:
+    - vectors.f32: matriz float32 (max_entries x vector_size) mapeada en memoria (np.memmap).
+    - keys.u8: matriz uint8 (max_entries x 32) con el hash del texto guardado en cada fila (ceros si está libre).
+    - ticks.i64: último uso de cada fila, para reutilizar las filas usadas hace más tiempo (LRU) cuando se llena.
+    - index.json: solo el tamaño de la caché ({"max_entries": ...}), se escribe al crearla.
+    El índice {hash del texto: fila} se reconstruye a partir de keys.u8, así guardar vectores no reescribe ningún índice.
+
+    Varios procesos pueden usar la misma caché: put_many toma un bloqueo de fichero (`.lock`, fcntl),
+    vuelve a leer de keys.u8 qué filas están ocupadas y escribe vector y clave dentro del bloqueo,
+    así dos procesos nunca escriben en la misma fila. La clave se borra antes de escribir el vector y se
+    escribe después; al leer, se comprueba la clave antes y después de copiar el vector, y si no coincide
+    (otro proceso ha reutilizado la fila) es un fallo de caché.
+    Sin fcntl (Windows) no hay bloqueo entre procesos: en ese caso solo un proceso debería usar la caché.
+
+    Variables de entorno opcionales:
+    - EMBEDDING_CACHE_DIR: directorio de la caché (por defecto `cache/embeddings` en la raíz del proyecto).
+    - EMBEDDING_CACHE_MAX_ENTRIES: número máximo de vectores por modelo (por defecto 20000).
+    """
+
+    def __init__(self, model_name: str, vector_size: int, cache_dir: Path | str | None = None, max_entries: int | None = None) -> None:
+        self.model_name = model_name
+        self.vector_size = vector_size
+        self.max_entries = max_entries or int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 20000))
+
+        base_dir = Path(cache_dir or os.getenv("EMBEDDING_CACHE_DIR", Path(__file__).parent.parent / "cache" / "embeddings"))
+        self.cache_dir = base_dir / f"{re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)}_{vector_size}"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._vectors_path = self.cache_dir / "vectors.f32"
+        self._keys_path = self.cache_dir / "keys.u8"
+        self._ticks_path = self.cache_dir / "ticks.i64"
+        self._index_path = self.cache_dir / "index.json"
+        self._lock_path = self.cache_dir / ".lock"
+
+        # Contadores de aciertos y fallos de la caché (desde que se abrió en este proceso)
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        with self._file_lock():
+            self._open()
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Bloqueo entre procesos (y entre hilos de este proceso) para abrir la caché y escribir en ella.
+        """
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open(self) -> None:
+        """
+        Abre (o crea) las matrices de vectores, claves y último uso.
+        Si el tamaño máximo ha cambiado respecto al guardado, se empieza de cero. Si index.json está dañado,
+        se reutilizan las matrices cuando su tamaño en disco coincide (no se pierde la caché).
+        """
+        saved_max_entries = None
+        if self._index_path.exists():
+            try:
+                saved_max_entries = json.loads(self._index_path.read_text("utf-8")).get("max_entries")
+            except Exception as e:
+                logger.warning(f"Índice de la caché de embeddings ilegible, se comprueba el tamaño de las matrices: {e}")
+
+        sizes_match = (
+            self._vectors_path.exists()
+            and self._keys_path.exists()
+            and self._vectors_path.stat().st_size == self.max_entries * self.vector_size * 4
+            and self._keys_path.stat().st_size == self.max_entries * 32
+        )
+        reuse = sizes_match and saved_max_entries in (None, self.max_entries)
+        mode = "r+" if reuse else "w+"
+
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode, shape=(self.max_entries, self.vector_size))
+        self._keys = np.memmap(self._keys_path, dtype=np.uint8, mode=mode, shape=(self.max_entries, 32))
+        ticks_reuse = reuse and self._ticks_path.exists() and self._ticks_path.stat().st_size == self.max_entries * 8
+        self._ticks = np.memmap(self._ticks_path, dtype=np.int64, mode="r+" if ticks_reuse else "w+", shape=(self.max_entries,))
+
+        if saved_max_entries != self.max_entries:
+            # Escritura atómica con un temporal propio de este proceso
+            tmp_path = self._index_path.with_name(f"{self._index_path.name}.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps({"max_entries": self.max_entries}), encoding="utf-8")
+            os.replace(tmp_path, self._index_path)
+
+        self._refresh()
+        logger.info(f"Caché de embeddings abierta: {self.cache_dir} ({len(self._entries)}/{self.max_entries} vectores)")
+
+    def _refresh(self) -> None:
+        """
+        Reconstruye el índice {hash: fila} desde keys.u8, con lo que hayan escrito también otros procesos.
+        """
+        used_rows = np.flatnonzero(self._keys.any(axis=1))
+        self._entries: Dict[str, int] = {self._keys[row].tobytes().hex(): int(row) for row in used_rows}
+        self._tick = int(self._ticks.max(initial=0))
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def get_many(self, texts: List[str]) -> List[List[float] | None]:
+        """
+        Devuelve el vector de cada texto, o None si no está en caché.
+        """
+        results: List[List[float] | None] = []
+        with self._lock:
+            for text in texts:
+                key = self._key(text)
+                row = self._entries.get(key.hex())
+                vector = None
+                # Se comprueba que la fila guarda este texto antes y después de copiar el vector (ver nota de la clase)
+                if row is not None and self._keys[row].tobytes() == key:
+                    vector = self._vectors[row].tolist()
+                    if self._keys[row].tobytes() != key:
+                        vector = None
+                if vector is not None:
+                    self._tick += 1
+                    self._ticks[row] = self._tick
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                results.append(vector)
+        return results
+
+    def _take_rows(self, count: int) -> List[int]:
+        """
+        Devuelve `count` filas libres, desalojando las entradas menos usadas si hace falta.
+        """
+        used = np.zeros(self.max_entries, dtype=bool)
+        used[list(self._entries.values())] = True
+        rows = np.flatnonzero(~used)[:count].tolist()
+        missing = count - len(rows)
+        if missing > 0:
+            used_rows = np.flatnonzero(used)
+            lru = used_rows[np.argsort(self._ticks[used_rows], kind="stable")[:missing]].tolist()
+            for row in lru:
+                del self._entries[self._keys[row].tobytes().hex()]
+            rows.extend(lru)
+        return rows
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """
+        Guarda los vectores de los textos, con el bloqueo entre procesos tomado, y los vuelca a disco.
+        """
+        with self._file_lock():
+            self._refresh()
+            pending = {}
+            for text, vector in zip(texts, vectors):
+                key = self._key(text)
+                if key.hex() not in self._entries:
+                    pending[key] = vector
+            # Nunca se guardan más vectores de los que caben
+            pending = list(pending.items())[-self.max_entries:]
+            if not pending:
+                return
+
+            rows = self._take_rows(len(pending))
+            for row, (key, vector) in zip(rows, pending):
+                # Primero se libera la fila, así nadie lee el vector nuevo con la clave anterior
+                self._keys[row] = 0
+                self._vectors[row] = np.asarray(vector, dtype=np.float32)
+                self._keys[row] = np.frombuffer(key, dtype=np.uint8)
+                self._tick += 1
+                self._ticks[row] = self._tick
+                self._entries[key.hex()] = row
+
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Vuelca las matrices a disco.
+        """
+        with self._lock:
+            self._vectors.flush()
+            self._keys.flush()
+            self._ticks.flush()
+
+    def stats(self) -> Dict[str, int | float]:
+        """
+        Devuelve los contadores de la caché.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
+
+class CachedEmbedder(BaseEmbedder):
+    """
+    Envuelve cualquier embedder: primero busca en la caché y solo envía al
+    embedder interno los textos que no estaban (sin repetir textos duplicados).
+    Los tokens devueltos son únicamente los de los textos que se han tenido que generar.
+    """
+
+    def __init__(self, embedder: BaseEmbedder, cache: EmbeddingCache) -> None:
+        self.embedder = embedder
+        self.cache = cache
+        self.model_name = embedder.model_name
+        self.vector_size = embedder.vector_size
+
+    def embed(self, texts: List[str]) -> Tuple[List[List[float]], int, str]:
+        vectors = self.cache.get_many(texts)
+
+        # Textos que faltan, sin duplicados y manteniendo el orden
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if not missing:
+            return vectors, 0, self.model_name
+
+        new_vectors, tokens, model_name = self.embedder.embed(missing)
+        return self._merge(texts, vectors, missing, new_vectors), tokens, model_name
+
+    async def aembed(self, texts: List[str]) -> Tuple[List[List[float]], int, str]:
+        # La caché es local (memmap), solo la llamada al proveedor es asíncrona
+        vectors = self.cache.get_many(texts)
+
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if not missing:
+            return vectors, 0, self.model_name
+
+        new_vectors, tokens, model_name = await self.embedder.aembed(missing)
+        return self._merge(texts, vectors, missing, new_vectors), tokens, model_name
+
+    def _merge(self, texts: List[str], vectors: List[List[float] | None], missing: List[str], new_vectors: List[List[float]]) -> List[List[float]]:
+        """
+        Guarda en caché los vectores generados y completa la lista de salida.
+        """
+        self.cache.put_many(missing, new_vectors)
+        generated = dict(zip(missing, new_vectors))
+        return [vector if vector is not None else generated[text] for text, vector in zip(texts, vectors)]
+
+# Cachés abiertas en este proceso, una por (modelo, tamaño de vector)
+_caches: Dict[Tuple[str, int], EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+def is_embedding_cache_enabled() -> bool:
+    """
+    Se verifica desde variable de entorno si se debe usar la caché de embeddings.
+    """
+    return os.getenv("EMBEDDING_CACHE", "YES").upper() == "YES"
+
+def get_embedding_cache(model_name: str, vector_size: int) -> EmbeddingCache:
+    """
+    Devuelve la caché compartida del proceso para (modelo, tamaño de vector).
+    """
+    with _caches_lock:
+        key = (model_name, vector_size)
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(model_name, vector_size)
+        return _caches[key]
+
+def embedding_cache_stats() -> Dict[str, Dict[str, int | float]]:
+    """
+    Devuelve los contadores de todas las cachés abiertas en este proceso.
+    """
+    with _caches_lock:
+        return {f"{model_name}_{vector_size}": cache.stats() for (model_name, vector_size), cache in _caches.items()}
+
+def with_embedding_cache(embedder: BaseEmbedder) -> BaseEmbedder:
+    """
+    Envuelve el embedder con la caché compartida si está activada (EMBEDDING_CACHE=YES).
+    Si la caché no se puede abrir, se sigue sin caché.
+    """
+    if not is_embedding_cache_enabled():
+        return embedder
+    try:
+        return CachedEmbedder(embedder, get_embedding_cache(embedder.model_name, embedder.vector_size))
+    except Exception as e:
+        logger.warning(f"No se pudo abrir la caché de embeddings, se continúa sin caché: {e}")
+        return embedder
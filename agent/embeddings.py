@@ -0,0 +1,207 @@
+###############################################
+# embeddings.py
+###############################################
+
+import asyncio
+import logging
+import os
+import time
+from typing import List, Tuple
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+from agent.utils.logging_config import setup_logging
+from agent.utils.tokens import count_tokens
+
+load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
+
+class BaseEmbedder:
+    """
+    Interfaz mínima de un proveedor de embeddings.
+
+    Cualquier proveedor nuevo (HuggingFace, Azure, etc.) solo tiene que implementar `embed`,
+    que recibe una lista de textos y devuelve una tupla con:
+    - vectors: (list) lista de vectores, en el mismo orden que los textos.
+    - tokens: (int) tokens consumidos en la llamada.
+    - model: (str) nombre real del modelo que devolvió el proveedor.
+
+    `aembed` es la variante asíncrona, con el mismo contrato. Por defecto ejecuta `embed`
+    en un hilo aparte, los proveedores con cliente asíncrono propio la sobrescriben.
+    """
+
+    model_name: str
+    vector_size: int
+
+    def embed(self, texts: List[str]) -> Tuple[List[List[float]], int, str]:
+        raise NotImplementedError
+
+    async def aembed(self, texts: List[str]) -> Tuple[List[List[float]], int, str]:
+        return await asyncio.to_thread(self.embed, texts)
+
+class OpenAIEmbedder(BaseEmbedder):
+    """
+    Proveedor de embeddings de OpenAI.
+    Una sola llamada a la API por lista de textos (la API admite `input` como lista).
+    """
+
+    def __init__(self, model_name: str, vector_size: int, api_key: str | None = None) -> None:
+        self.model_name = model_name
+        self.vector_size = vector_size
+        self._client = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+        self._async_client = AsyncOpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+
+    def embed(self, texts: List[str]) -> Tuple[List[List[float]], int, str]:
+        response = self._client.embeddings.create(
+            model=self.model_name,
+            input=texts
+        )
+        return self._parse_response(response)
+
+    async def aembed(self, texts: List[str]) -> Tuple[List[List[float]], int, str]:
+        response = await self._async_client.embeddings.create(
+            model=self.model_name,
+            input=texts
+        )
+        return self._parse_response(response)
+
+    def _parse_response(self, response) -> Tuple[List[List[float]], int, str]:
+        # OpenAI devuelve un `index` por elemento, ordenamos por seguridad.
+        vectors = [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+        # Comprobación de tamaño de los vectores de embedding
+        for vector in vectors:
+            if len(vector) != self.vector_size:
+                logger.error(f"Tamaño del vector de embedding inesperado: esperado={self.vector_size}, recibido={len(vector)}")
+                raise RuntimeError("Tamaño del vector de embedding inesperado")
+
+        return vectors, response.usage.total_tokens, response.model
+
+class EmbeddingBatcher(BaseEmbedder):
+    """
+    Agrupa los textos en lotes acotados por número de elementos y por tokens,
+    y los envía al proveedor de embeddings lote a lote.
+
+    Si un lote falla, se reintenta únicamente ese lote (con espera exponencial),
+    sin repetir los lotes que ya se habían completado.
+
+    Variables de entorno opcionales:
+    - EMBEDDING_BATCH_SIZE: número máximo de textos por llamada (por defecto 256, OpenAI admite 2048).
+    - EMBEDDING_BATCH_MAX_TOKENS: número máximo de tokens por llamada (por defecto 100000, OpenAI admite 300000).
+    - EMBEDDING_BATCH_MAX_RETRIES: reintentos por lote antes de dar el error por bueno (por defecto 3).
+    """
+
+    def __init__(
+        self,
+        embedder: BaseEmbedder,
+        max_batch_size: int | None = None,
+        max_batch_tokens: int | None = None,
+        max_retries: int | None = None,
+        retry_backoff: float = 1.0,
+    ) -> None:
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", 256))
+        self.max_batch_tokens = max_batch_tokens or int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", 100000))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("EMBEDDING_BATCH_MAX_RETRIES", 3))
+        self.retry_backoff = retry_backoff
+        self.model_name = embedder.model_name
+        self.vector_size = embedder.vector_size
+
+    def _make_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Devuelve los lotes como listas de índices sobre `texts`.
+        Un texto que por sí solo supera el límite de tokens va en un lote propio,
+        será el proveedor quien decida si lo acepta.
+        """
+        batches = []
+        current = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = count_tokens(text, self.embedder.model_name)
+            if current and (len(current) >= self.max_batch_size or current_tokens + tokens > self.max_batch_tokens):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_batch_with_retry(self, texts: List[str]) -> Tuple[List[List[float]], int, str]:
+        """
+        Lanza un lote contra el proveedor, reintentando si falla.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self.embedder.embed(texts)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"Lote de embeddings fallido tras {self.max_retries} reintentos: {e}")
+                    raise
+                wait = self.retry_backoff * (2 ** (attempt - 1))
+                logger.warning(f"Fallo en lote de embeddings ({len(texts)} textos), reintento {attempt}/{self.max_retries} en {wait:.1f}s: {e}")
+                time.sleep(wait)
+
+    async def _aembed_batch_with_retry(self, texts: List[str]) -> Tuple[List[List[float]], int, str]:
+        """
+        Variante asíncrona de `_embed_batch_with_retry` (la espera no bloquea el bucle de eventos).
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self.embedder.aembed(texts)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"Lote de embeddings fallido tras {self.max_retries} reintentos: {e}")
+                    raise
+                wait = self.retry_backoff * (2 ** (attempt - 1))
+                logger.warning(f"Fallo en lote de embeddings ({len(texts)} textos), reintento {attempt}/{self.max_retries} en {wait:.1f}s: {e}")
+                await asyncio.sleep(wait)
+
+    def embed(self, texts: List[str]) -> Tuple[List[List[float]], int, str]:
+        """
+        Genera los embeddings de todos los textos respetando el orden de entrada.
+
+        Devuelve una tupla con:
+        - vectors: (list) lista de vectores en el mismo orden que `texts`.
+        - tokens: (int) suma de tokens de todos los lotes.
+        - model: (str) modelo real devuelto por el proveedor.
+        """
+        vectors: List[List[float] | None] = [None] * len(texts)
+        total_tokens = 0
+        model_name = self.embedder.model_name
+
+        batches = self._make_batches(texts)
+        logger.info(f"Generando embeddings: {len(texts)} textos en {len(batches)} lotes")
+
+        for batch in batches:
+            batch_vectors, tokens, model_name = self._embed_batch_with_retry([texts[i] for i in batch])
+            for i, vector in zip(batch, batch_vectors):
+                vectors[i] = vector
+            total_tokens += tokens
+
+        return vectors, total_tokens, model_name
+
+    async def aembed(self, texts: List[str]) -> Tuple[List[List[float]], int, str]:
+        """
+        Variante asíncrona de `embed`, con los mismos lotes y el mismo orden de salida.
+        """
+        vectors: List[List[float] | None] = [None] * len(texts)
+        total_tokens = 0
+        model_name = self.embedder.model_name
+
+        batches = self._make_batches(texts)
+        logger.info(f"Generando embeddings: {len(texts)} textos en {len(batches)} lotes")
+
+        for batch in batches:
+            batch_vectors, tokens, model_name = await self._aembed_batch_with_retry([texts[i] for i in batch])
+            for i, vector in zip(batch, batch_vectors):
+                vectors[i] = vector
+            total_tokens += tokens
+
+        return vectors, total_tokens, model_name
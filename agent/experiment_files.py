@@ -0,0 +1,55 @@
+###############################################
+# experiment_files.py
+###############################################
+# Notas:
+# Lectura y escritura de los ficheros de experimento TestToolAgent_<uuid>.json, o .json.gz si van comprimidos.
+# Los usan el escritor (experiment_writer.py), el almacén (experiment_store.py) y los lectores (ui, results).
+
+import gzip
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+def experiment_file_id(path: Path | str) -> str:
+    """
+    Nombre del experimento a partir de su fichero (sin .json ni .json.gz).
+    """
+    name = Path(path).name
+    for suffix in (".json.gz", ".json"):
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+def iter_experiment_files(directory: Path | str, prefix: str = "TestToolAgent_") -> Iterator[Path]:
+    """
+    Ficheros de experimento de un directorio, comprimidos o no.
+    """
+    directory = Path(directory)
+    yield from directory.glob(f"{prefix}*.json")
+    yield from directory.glob(f"{prefix}*.json.gz")
+
+def read_experiment_file(path: Path | str) -> Dict[str, Any]:
+    """
+    Lee un fichero de experimento (.json o .json.gz).
+    """
+    path = Path(path)
+    opener = gzip.open if path.name.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_experiment_file(output_dir: Path, name: str, data: Dict[str, Any], compress: bool) -> Path:
+    """
+    Escribe un fichero de experimento. Se escribe en un temporal y se renombra,
+    para que los lectores nunca vean un fichero a medias.
+    """
+    path = output_dir / (f"{name}.json.gz" if compress else f"{name}.json")
+    tmp_path = path.with_name(path.name + ".tmp")
+    if compress:
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(data, f, ensure_ascii=False)
+    else:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
@@ -11,6 +11,8 @@ from pathlib import Path
 import logging
 from typing import List, Dict, Any
 
+from agent.experiment_writer import save_experiment
+
 # Configuración de logging
 logger = logging.getLogger(__name__)
 
@@ -36,6 +38,51 @@ class Experiment:
         self.datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         self.start_time = time.perf_counter()
         self.user_needs = user_needs
+
+        # Tokens del contexto de esquema (ver add_schema_context)
+        self.schema_context_tokens_raw = None
+        self.schema_context_tokens = None
+        self.schema_context_format = None
+
+        # Contexto de la 2a generación (ver add_sql_enhance_context) y tokens servidos desde la caché de prompts
+        self.sql_enhance_mode = "FULL"
+        self.schema_context_enhanced_tokens = None
+        self.schema_context_enhanced_tokens_saved = 0
+        self.sql_script_cached_tokens = 0
+        self.sql_script_enhanced_cached_tokens = 0
+
+        # Valores por defecto de cada etapa, para poder cerrar el experimento aunque alguna no se ejecute
+        # (2a generación omitida tras la validación local o error a mitad de la tool).
+        self.start_time_retriever = self.finish_time_retriever = None
+        self.start_time_sql_generator = self.finish_time_sql_generator = None
+        self.start_time_sql_generator_enhanced = self.finish_time_sql_generator_enhanced = None
+        self.retriever_score_count_pass = 0
+        self.retriever_result_search_pass = []
+        self.retriever_result_search_raw = []
+        self.retriever_score_limit = None
+        self.retriever_embedding_model = ""
+        self.retriever_embedding_tokens = 0
+        self.retriever_embedding_price_1M_tokens = 0
+        self.retriever_cache_info = {}
+        self.prompt_sql_generator = self.sql_script = ""
+        self.prompt_sql_generator_enhanced = self.sql_script_enhanced = ""
+        for stage in ("sql_script", "sql_script_enhanced"):
+            setattr(self, f"{stage}_model_name", "")
+            for field in ("total_tokens", "prompt_tokens", "completion_tokens", "price_1M_tokens_input", "price_1M_tokens_output"):
+                setattr(self, f"{stage}_{field}", 0)
+
+        # Validación local del primer script (ver add_sql_validation)
+        self.sql_validation_valid = None
+        self.sql_validation_errors = []
+        self.sql_enhance_action = "ENHANCE"
+        self.sql_validation_time = 0.0
+        self.sql_enhanced_saved_time = 0.0
+        self.sql_enhanced_skip_rate = 0.0
+
+        # Caché semántica de respuestas (ver add_response_cache)
+        self.response_cache_hit = False
+        self.response_cache_similarity = None
+        self.response_cache_hit_rate = 0.0
         
         # Crear directorio output si no existe
         # Como va a invocarse desde streamlit chatbot.py hay que hacer 2 parents.
@@ -58,7 +105,8 @@ class Experiment:
             result_raw: List[Dict[str, Any]],
             score_limit: float,
             embedding_model: str,
-            embedding_tokens: int
+            embedding_tokens: int,
+            cache_info: Dict[str, Any] | None = None
         ) -> None:
         """
         Registra el fin de la búsqueda del retriever y sus resultados.
@@ -68,6 +116,7 @@ class Experiment:
         - Resultado de la búsqueda.
         - Scores de todas las tablas. (haya pasado el corte o no)
         - Score límite que marca el corte `> score_limit`
+        - Aciertos de la caché del retriever y latencia estimada ahorrada (si se recibe `cache_info`)
         """
         # Se precualcula el número de resultados que pasan el filtro de score de relevancia.
         count_pass = len(result_pass)
@@ -109,7 +158,60 @@ class Experiment:
         # Precapturamos el precio por millón de tokens del modelo de embedding.
         # Valor de Input, ya que embedding no tiene output.
         self.retriever_embedding_price_1M_tokens = price_1M_tokens_openai(self.retriever_embedding_model)[0]
+        # Caché del retriever (ver QdrantRetriever.last_cache_info)
+        self.retriever_cache_info = cache_info or {}
     
+    def add_schema_context(self, tokens_raw: int, tokens: int, format: str) -> None:
+        """
+        Captura los tokens del contexto de esquema antes y después de compilarlo (ver schema_context.py).
+        """
+        self.schema_context_tokens_raw = tokens_raw
+        self.schema_context_tokens = tokens
+        self.schema_context_format = format
+
+    def add_sql_enhance_context(self, mode: str, tokens_full: int, tokens: int) -> None:
+        """
+        Captura el modo de la 2a generación (FULL o DIFF) y los tokens de contexto de esquema
+        que se han dejado de enviar respecto al contexto completo.
+        """
+        self.sql_enhance_mode = mode
+        self.schema_context_enhanced_tokens = tokens
+        self.schema_context_enhanced_tokens_saved = tokens_full - tokens
+
+    def add_sql_validation(
+            self,
+            valid: bool | None,
+            errors: List[str],
+            action: str,
+            seconds: float,
+            saved_seconds: float,
+            skip_rate: float
+        ) -> None:
+        """
+        Captura la validación local del primer script (ver sql_validator.py):
+        - Si es válido (None si la validación está desactivada) y los problemas encontrados.
+        - Acción de la 2a generación: ENHANCE (revisión completa), FORMAT (formateo barato) o SKIP (omitida).
+        - Tiempo de la validación, tiempo estimado ahorrado y tasa de omisión de la revisión en el proceso.
+        """
+        self.sql_validation_valid = valid
+        self.sql_validation_errors = errors
+        self.sql_enhance_action = action
+        self.sql_validation_time = seconds
+        self.sql_enhanced_saved_time = saved_seconds
+        self.sql_enhanced_skip_rate = skip_rate
+
+    def add_response_cache(self, hit: bool, similarity: float | None, hit_rate: float) -> None:
+        """
+        Captura la consulta a la caché semántica de respuestas (ver response_cache.py):
+        si la respuesta se ha servido desde la caché, su similitud y la tasa de acierto del proceso.
+        En un acierto no hay generaciones SQL, la acción de la 2a generación queda como CACHE.
+        """
+        self.response_cache_hit = hit
+        self.response_cache_similarity = similarity
+        self.response_cache_hit_rate = hit_rate
+        if hit:
+            self.sql_enhance_action = "CACHE"
+
     def add_sql_generator_start(self) -> None:
         """
         Marca de tiempo de inicio de la generación del primer SQL.
@@ -138,6 +240,7 @@ class Experiment:
             self.sql_script_total_tokens = metadata_llm.get("token_usage", {}).get("total_tokens", 0)
             self.sql_script_prompt_tokens = metadata_llm.get("token_usage", {}).get("prompt_tokens", 0)
             self.sql_script_completion_tokens = metadata_llm.get("token_usage", {}).get("completion_tokens", 0)
+            self.sql_script_cached_tokens = (metadata_llm.get("token_usage", {}).get("prompt_tokens_details") or {}).get("cached_tokens") or 0
             price_1M_tokens = price_1M_tokens_openai(self.sql_script_model_name)
             self.sql_script_price_1M_tokens_input = price_1M_tokens[0]
             self.sql_script_price_1M_tokens_output = price_1M_tokens[1]
@@ -148,6 +251,14 @@ class Experiment:
         """
         self.start_time_sql_generator_enhanced = time.perf_counter()
 
+    def add_sql_enhanced_first_token(self) -> None:
+        """
+        Captura la marca de tiempo del primer token del SQL mejorado (solo en streaming),
+        es el momento en que el usuario empieza a ver la respuesta.
+        """
+        if getattr(self, "first_token_time", None) is None:
+            self.first_token_time = time.perf_counter()
+
     def add_sql_enhanced_finish(
             self, 
             prompt: str, 
@@ -172,6 +283,7 @@ class Experiment:
             self.sql_script_enhanced_total_tokens = metadata_llm.get("token_usage", {}).get("total_tokens", 0)
             self.sql_script_enhanced_prompt_tokens = metadata_llm.get("token_usage", {}).get("prompt_tokens", 0)
             self.sql_script_enhanced_completion_tokens = metadata_llm.get("token_usage", {}).get("completion_tokens", 0)
+            self.sql_script_enhanced_cached_tokens = (metadata_llm.get("token_usage", {}).get("prompt_tokens_details") or {}).get("cached_tokens") or 0
             price_1M_tokens = price_1M_tokens_openai(self.sql_script_enhanced_model_name)
             self.sql_script_enhanced_price_1M_tokens_input = price_1M_tokens[0]
             self.sql_script_enhanced_price_1M_tokens_output = price_1M_tokens[1]
@@ -196,13 +308,19 @@ class Experiment:
         self.total_time = round(self.finish_time - self.start_time, 6)
         
         # Tiempo de búsqueda del retriever.
-        self.retriever_time = round(self.finish_time_retriever - self.start_time_retriever, 6)
+        self.retriever_time = _elapsed(self.start_time_retriever, self.finish_time_retriever)
         
         # Tiempo de generación del primer SQL.
-        self.sql_generation_time = round(self.finish_time_sql_generator - self.start_time_sql_generator, 6)
+        self.sql_generation_time = _elapsed(self.start_time_sql_generator, self.finish_time_sql_generator)
         
         # Tiempo de generación del SQL mejorado.
-        self.sql_enhanced_time = round(self.finish_time_sql_generator_enhanced - self.start_time_sql_generator_enhanced, 6)
+        self.sql_enhanced_time = _elapsed(self.start_time_sql_generator_enhanced, self.finish_time_sql_generator_enhanced)
+
+        # Tiempo hasta el primer token que ve el usuario (desde el inicio de la tool).
+        # Sin streaming la respuesta llega de una vez, al terminar el SQL mejorado.
+        first_token_time = getattr(self, "first_token_time", None)
+        self.sql_enhanced_streamed = first_token_time is not None
+        self.first_token_time_total = _elapsed(self.start_time, first_token_time or self.finish_time_sql_generator_enhanced or self.finish_time)
         
         # Definimos coste total 0 por defecto por si alguno no se puede calcular.
         self.total_cost = 0
@@ -239,6 +357,8 @@ class Experiment:
             "time_in_seconds_retriever": self.retriever_time,
             "time_in_seconds_sql_generation": self.sql_generation_time,
             "time_in_seconds_sql_generation_enhanced": self.sql_enhanced_time,
+            "time_in_seconds_first_token": self.first_token_time_total,
+            "sql_generation_enhanced_streamed": self.sql_enhanced_streamed,
 
             # Medidas token de la herramienta
             "tokens_total_retriever_embedding": self.retriever_embedding_tokens,
@@ -249,6 +369,31 @@ class Experiment:
             "tokens_prompt_sql_generation_enhanced": self.sql_script_enhanced_prompt_tokens,
             "tokens_completion_sql_generation_enhanced": self.sql_script_enhanced_completion_tokens,
             "tokens_total_tool": self.retriever_embedding_tokens + self.sql_script_total_tokens + self.sql_script_enhanced_total_tokens,
+            # Contexto de esquema: tokens sin compilar y compilado (estimados con tiktoken)
+            "tokens_schema_context_raw": self.schema_context_tokens_raw,
+            "tokens_schema_context": self.schema_context_tokens,
+            "schema_context_format": self.schema_context_format,
+            # Ahorro por etapa: tokens del prompt servidos desde la caché del proveedor
+            # y, en la 2a generación en modo DIFF, tokens de contexto no enviados.
+            "tokens_cached_sql_generation": self.sql_script_cached_tokens,
+            "tokens_cached_sql_generation_enhanced": self.sql_script_enhanced_cached_tokens,
+            "sql_enhance_mode": self.sql_enhance_mode,
+            "tokens_schema_context_enhanced": self.schema_context_enhanced_tokens,
+            "tokens_saved_sql_generation_enhanced": self.schema_context_enhanced_tokens_saved,
+
+            # Caché semántica de respuestas.
+            "response_cache_hit": self.response_cache_hit,
+            "response_cache_similarity": self.response_cache_similarity,
+            "response_cache_hit_rate": self.response_cache_hit_rate,
+
+            # Validación local del primer script y decisión sobre la 2a generación.
+            "sql_validation_valid": self.sql_validation_valid,
+            "sql_validation_errors": self.sql_validation_errors,
+            "sql_enhance_action": self.sql_enhance_action,
+            "sql_enhanced_skipped": self.sql_enhance_action != "ENHANCE",
+            "sql_enhanced_skip_rate": self.sql_enhanced_skip_rate,
+            "time_in_seconds_sql_validation": round(self.sql_validation_time, 6),
+            "time_in_seconds_sql_enhanced_saved": round(self.sql_enhanced_saved_time, 6),
 
             # Coste de Tokens de la Tool en dólares.
             "total_cost_retriever_embedding_in_dollars": self.retriever_embedding_cost,
@@ -265,6 +410,13 @@ class Experiment:
             "retriever_pass_summary": self.retriever_result_search_pass,
             "retriever_raw_summary": self.retriever_result_search_raw,
 
+            # Caché del retriever: aciertos en esta búsqueda, tasas de acierto del proceso y tiempo ahorrado.
+            "retriever_cache_embedding_hit": self.retriever_cache_info.get("embedding_hit", False),
+            "retriever_cache_search_hit": self.retriever_cache_info.get("search_hit", False),
+            "retriever_cache_embedding_hit_rate": self.retriever_cache_info.get("embedding_hit_rate", 0.0),
+            "retriever_cache_search_hit_rate": self.retriever_cache_info.get("search_hit_rate", 0.0),
+            "time_in_seconds_retriever_cache_saved": round(self.retriever_cache_info.get("saved_seconds", 0.0), 6),
+
             # Prompt para generar el primer SQL y script SQL generado.
             "prompt_sql_generator": self.prompt_sql_generator,
             "sql_script": self.sql_script,
@@ -273,14 +425,10 @@ class Experiment:
             "prompt_sql_generator_enhanced": self.prompt_sql_generator_enhanced,
             "sql_script_enhanced": self.sql_script_enhanced,
         }
-        # Preparamos la estructura para la exportación de los datos.
-        filename = f"{self.id}.json"
-        filepath = self.output_dir / filename
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        # Se encola para escribirse en segundo plano, la tool no espera al disco (ver experiment_writer.py).
+        save_experiment(self.output_dir, self.id, self.data)
         
-        logger.info(f"Experimento finalizado y guardado: {filename}")
+        logger.info(f"Experimento finalizado y enviado a guardar: {self.id}")
 
 class Experiment_LoadKnowledge:
 
@@ -390,6 +538,14 @@ class Experiment_LoadKnowledge:
         
         logger.info(f"Monitorización de carga de conocimiento finalizada y guardada: {filename}")
 
+def _elapsed(start: float | None, finish: float | None) -> float:
+    """
+    Segundos entre dos marcas de tiempo, 0 si alguna etapa no llegó a ejecutarse.
+    """
+    if start is None or finish is None:
+        return 0.0
+    return round(finish - start, 6)
+
 def is_experiment_enabled() -> bool:
     """
     Se verifica desde variable de entorno si se debe monitorizar el experimento.
@@ -0,0 +1,319 @@
+###############################################
+# experiment_store.py
+###############################################
+# Notas:
+# Almacén SQLite de los experimentos de la tool, complementario a los ficheros TestToolAgent_<uuid>.json(.gz).
+# Los paneles (métricas y logs SQL) solo necesitan unos pocos campos numéricos, y leer todos los ficheros
+# en cada recarga de Streamlit (prompts incluidos) hacía que el tiempo de carga creciera con el histórico.
+#
+# Tablas (por defecto en output/experiments.sqlite, EXPERIMENT_STORE_PATH):
+# - metrics: una fila por experimento con los campos escalares (números, booleanos y textos cortos).
+#   Una columna por campo; si aparece un campo nuevo se añade la columna. Índices por id y datetime.
+# - blobs: (id, field, value) con los textos largos (prompts, scripts, necesidades del usuario)
+#   y las listas y diccionarios en JSON. Solo se leen bajo demanda.
+# - generations: índice ligero de las generaciones SQL (id, datetime, inicio de las necesidades del usuario
+#   y fichero), para paginar en la página de logs SQL sin leer los scripts. La búsqueda por texto
+#   mira las necesidades del usuario completas en `blobs` (solo ese campo, por clave primaria).
+#
+# Escribe el escritor de experimentos (ver experiment_writer.py) en el mismo lote que los ficheros.
+# `sync_from_files` importa los ficheros que todavía no están en el almacén (histórico anterior).
+# La base de datos está en modo WAL: los paneles leen mientras el escritor inserta.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from agent.experiment_files import experiment_file_id, iter_experiment_files, read_experiment_file
+
+logger = logging.getLogger(__name__)
+
+# Campos de texto que siempre van a la tabla de blobs, aunque sean cortos.
+BLOB_FIELDS = {
+    "prompt_user_needs",
+    "prompt_sql_generator",
+    "prompt_sql_generator_enhanced",
+    "sql_script",
+    "sql_script_enhanced",
+}
+# Textos más largos que esto también van a la tabla de blobs.
+MAX_SCALAR_TEXT = 512
+# Caracteres de las necesidades del usuario que se guardan en el índice de generaciones.
+PREVIEW_CHARS = 300
+
+def store_path_for(output_dir: Path | str) -> Path:
+    """
+    Ruta del almacén de un directorio de experimentos: EXPERIMENT_STORE_PATH o `<output_dir>/experiments.sqlite`.
+    """
+    return Path(os.getenv("EXPERIMENT_STORE_PATH") or Path(output_dir) / "experiments.sqlite")
+
+def default_store_path() -> Path:
+    """
+    Ruta del almacén del directorio `output` de la raíz del proyecto.
+    """
+    return store_path_for(Path(__file__).parent.parent / "output")
+
+def _is_scalar(field: str, value: Any) -> bool:
+    if field in BLOB_FIELDS or isinstance(value, (list, dict)):
+        return False
+    return not (isinstance(value, str) and len(value) > MAX_SCALAR_TEXT)
+
+def _quote(column: str) -> str:
+    if '"' in column:
+        raise ValueError(f"Nombre de campo no válido: {column}")
+    return f'"{column}"'
+
+class ExperimentStore:
+    """
+    Almacén de experimentos en SQLite (ver notas del módulo).
+    """
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        self.path = Path(path) if path else default_store_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._columns: set[str] = set()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS metrics (id TEXT PRIMARY KEY, datetime TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_datetime ON metrics (datetime)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "id TEXT NOT NULL, field TEXT NOT NULL, value TEXT, is_json INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (id, field))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                "id TEXT PRIMARY KEY, datetime TEXT, user_needs_preview TEXT, path TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_datetime ON generations (datetime)")
+            # Experimentos guardados antes de existir el índice
+            conn.execute(
+                "INSERT OR IGNORE INTO generations (id, datetime, user_needs_preview) "
+                "SELECT m.id, m.datetime, substr(u.value, 1, ?) FROM metrics m "
+                "JOIN blobs u ON u.id = m.id AND u.field = 'prompt_user_needs' "
+                "JOIN blobs s ON s.id = m.id AND s.field = 'sql_script_enhanced' "
+                "WHERE m.id NOT IN (SELECT id FROM generations)",
+                (PREVIEW_CHARS,),
+            )
+            self._columns = self._read_columns(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una conexión por operación: se usa desde el hilo del escritor y desde los de Streamlit.
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _read_columns(conn: sqlite3.Connection) -> set[str]:
+        return {row["name"] for row in conn.execute("PRAGMA table_info(metrics)")}
+
+    def _ensure_columns(self, conn: sqlite3.Connection, fields: Iterable[str]) -> None:
+        missing = [f for f in fields if f not in self._columns]
+        if not missing:
+            return
+        # Otro proceso puede haber añadido columnas
+        self._columns = self._read_columns(conn)
+        for field in missing:
+            if field not in self._columns:
+                conn.execute(f"ALTER TABLE metrics ADD COLUMN {_quote(field)}")
+                self._columns.add(field)
+
+    def append_many(self, records: List[Dict[str, Any]], files: List[Path | None] | None = None) -> int:
+        """
+        Inserta (o sustituye) varios experimentos en una sola transacción. Devuelve cuántos se han guardado.
+        `files` son los ficheros de cada experimento (opcional), se guardan en el índice de generaciones.
+        """
+        pairs = [(r, f) for r, f in zip(records, files or [None] * len(records)) if r.get("id")]
+        if not pairs:
+            return 0
+        with self._lock, closing(self._connect()) as conn, conn:
+            for record, file in pairs:
+                scalars = {k: v for k, v in record.items() if _is_scalar(k, v)}
+                blobs = {k: v for k, v in record.items() if not _is_scalar(k, v)}
+                self._ensure_columns(conn, scalars)
+                columns = ", ".join(_quote(c) for c in scalars)
+                placeholders = ", ".join("?" for _ in scalars)
+                conn.execute(f"INSERT OR REPLACE INTO metrics ({columns}) VALUES ({placeholders})", list(scalars.values()))
+                conn.execute("DELETE FROM blobs WHERE id = ?", (record["id"],))
+                conn.executemany(
+                    "INSERT INTO blobs (id, field, value, is_json) VALUES (?, ?, ?, ?)",
+                    [
+                        (record["id"], field, value, 0) if isinstance(value, str)
+                        else (record["id"], field, json.dumps(value, ensure_ascii=False), 1)
+                        for field, value in blobs.items()
+                    ],
+                )
+                if isinstance(record.get("prompt_user_needs"), str) and isinstance(record.get("sql_script_enhanced"), str):
+                    conn.execute(
+                        "INSERT OR REPLACE INTO generations (id, datetime, user_needs_preview, path) VALUES (?, ?, ?, ?)",
+                        (record["id"], record.get("datetime"), record["prompt_user_needs"][:PREVIEW_CHARS], str(file) if file else None),
+                    )
+        return len(pairs)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self.append_many([record])
+
+    def ids(self) -> set[str]:
+        with closing(self._connect()) as conn:
+            return {row["id"] for row in conn.execute("SELECT id FROM metrics")}
+
+    def read_metrics(
+        self,
+        columns: List[str] | None = None,
+        order_by: str = "datetime",
+        descending: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Filas de la tabla de métricas, solo con las columnas pedidas (las que no existan vienen a None).
+        """
+        with closing(self._connect()) as conn:
+            existing = self._read_columns(conn)
+            wanted = columns or sorted(existing)
+            selected = [c for c in wanted if c in existing]
+            if not selected:
+                return []
+            query = f"SELECT {', '.join(_quote(c) for c in selected)} FROM metrics ORDER BY {_quote(order_by)}{' DESC' if descending else ''}"
+            rows = [dict(row) for row in conn.execute(query)]
+        for row in rows:
+            for column in wanted:
+                row.setdefault(column, None)
+        return rows
+
+    def read_new_metrics(self, columns: List[str], after_rowid: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Filas insertadas (o sustituidas) después de `after_rowid`, para lecturas incrementales.
+        Devuelve (filas, último rowid leído).
+        """
+        with closing(self._connect()) as conn:
+            existing = self._read_columns(conn)
+            selected = [c for c in columns if c in existing]
+            query = f"SELECT rowid AS _rowid{''.join(', ' + _quote(c) for c in selected)} FROM metrics WHERE rowid > ? ORDER BY rowid"
+            rows = [dict(row) for row in conn.execute(query, (after_rowid,))]
+        last_rowid = rows[-1]["_rowid"] if rows else after_rowid
+        for row in rows:
+            del row["_rowid"]
+            for column in columns:
+                row.setdefault(column, None)
+        return rows, last_rowid
+
+    def read_blobs(self, ids: List[str], fields: List[str] | None = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Campos largos de los experimentos pedidos: {id: {campo: valor}}.
+        Los textos se devuelven tal cual y las listas y diccionarios decodificados.
+        """
+        if not ids:
+            return {}
+        query = f"SELECT id, field, value, is_json FROM blobs WHERE id IN ({', '.join('?' for _ in ids)})"
+        params: List[Any] = list(ids)
+        if fields:
+            query += f" AND field IN ({', '.join('?' for _ in fields)})"
+            params.extend(fields)
+        result: Dict[str, Dict[str, Any]] = {}
+        with closing(self._connect()) as conn:
+            for row in conn.execute(query, params):
+                value = json.loads(row["value"]) if row["is_json"] else row["value"]
+                result.setdefault(row["id"], {})[row["field"]] = value
+        return result
+
+    @staticmethod
+    def _generations_filter(search: str | None, date_from: str | None, date_to: str | None) -> Tuple[str, List[Any]]:
+        """
+        Filtro del índice de generaciones. El texto se busca en el id y en las necesidades del usuario completas
+        (blob `prompt_user_needs`, no solo en el inicio que guarda el índice), igual que sin almacén.
+        """
+        clauses, params = [], []
+        if search:
+            # `%` y `_` del texto buscado se buscan literalmente
+            pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            clauses.append(
+                "(id LIKE ? ESCAPE '\\' OR EXISTS (SELECT 1 FROM blobs b WHERE b.id = generations.id "
+                "AND b.field = 'prompt_user_needs' AND b.value LIKE ? ESCAPE '\\'))"
+            )
+            params.extend([pattern] * 2)
+        if date_from:
+            clauses.append("datetime >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("datetime <= ?")
+            params.append(date_to)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def list_generations(
+        self,
+        search: str | None = None,
+        date_from: str | None = None,
+        date_to: str | None = None,
+        limit: int = 25,
+        offset: int = 0,
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Página del índice de generaciones (más recientes primero), filtrada por texto y fechas
+        ("YYYY-MM-DD HH:MM:SS"). Devuelve (total de generaciones que cumplen el filtro, filas de la página).
+        """
+        where, params = self._generations_filter(search, date_from, date_to)
+        with closing(self._connect()) as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM generations{where}", params).fetchone()[0]
+            rows = [
+                dict(row)
+                for row in conn.execute(
+                    f"SELECT id, datetime, user_needs_preview, path FROM generations{where} "
+                    "ORDER BY datetime DESC LIMIT ? OFFSET ?",
+                    params + [limit, offset],
+                )
+            ]
+        return total, rows
+
+    def read_generation(self, experiment_id: str) -> Dict[str, Any] | None:
+        """
+        Generación completa para mostrarla: fila del índice más las necesidades del usuario y el script SQL final.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT id, datetime, path FROM generations WHERE id = ?", (experiment_id,)).fetchone()
+        if row is None:
+            return None
+        texts = self.read_blobs([experiment_id], ["prompt_user_needs", "sql_script_enhanced"]).get(experiment_id, {})
+        return {**dict(row), **texts}
+
+    def sync_from_files(self, output_dir: Path | str, batch_size: int = 200) -> int:
+        """
+        Importa los ficheros de experimento del directorio que todavía no están en el almacén.
+        Solo se abren los ficheros nuevos (se compara el nombre con los ids guardados).
+        Devuelve el número de experimentos importados.
+        """
+        known = self.ids()
+        pending = [f for f in iter_experiment_files(output_dir) if experiment_file_id(f) not in known]
+        imported = 0
+        for start in range(0, len(pending), batch_size):
+            records, files = [], []
+            for file in pending[start:start + batch_size]:
+                try:
+                    records.append(read_experiment_file(file))
+                    files.append(file)
+                except Exception as e:
+                    logger.warning(f"No se pudo importar el experimento {file}: {e}")
+            imported += self.append_many(records, files)
+        if imported:
+            logger.info(f"Almacén de experimentos: {imported} experimentos importados de {output_dir}")
+        return imported
+
+_stores: Dict[Path, ExperimentStore] = {}
+_stores_lock = threading.Lock()
+
+def is_store_enabled() -> bool:
+    return os.getenv("EXPERIMENT_STORE", "YES").upper() == "YES"
+
+def get_experiment_store(path: Path | str | None = None) -> ExperimentStore:
+    """
+    Devuelve el almacén de la ruta (por defecto `default_store_path()`), uno por proceso.
+    """
+    path = Path(path) if path else default_store_path()
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ExperimentStore(path)
+    return store
@@ -0,0 +1,186 @@
+###############################################
+# experiment_writer.py
+###############################################
+# Notas:
+# Escritura en segundo plano de los logs de experimento (TestToolAgent_<uuid>.json).
+# Cada log incluye los prompts completos (140-170 KB), y escribirlo con `json.dump` dentro de la tool
+# hacía que la latencia de cada petición dependiera del disco. Ahora `Experiment.finish` solo encola
+# el registro y un hilo dedicado los escribe por lotes.
+#
+# - Cola acotada (EXPERIMENT_LOG_QUEUE_SIZE): con el disco lento, por encima del 80% de ocupación
+#   solo se encola 1 de cada EXPERIMENT_LOG_SAMPLE_EVERY registros, y con la cola llena se descartan.
+#   Nunca se bloquea la petición del usuario.
+# - Lotes: el hilo espera el primer registro y recoge los que haya hasta EXPERIMENT_LOG_BATCH_SIZE.
+# - Compresión (EXPERIMENT_LOG_COMPRESS=YES por defecto): TestToolAgent_<uuid>.json.gz.
+#   Los lectores usan `iter_experiment_files` y `read_experiment_file` (experiment_files.py), que aceptan ambos formatos.
+# - Al salir del proceso (atexit) se vacía la cola.
+# - Cada lote también se añade al almacén SQLite de métricas (EXPERIMENT_STORE=YES, ver experiment_store.py).
+# - EXPERIMENT_LOG_ASYNC=NO escribe en el momento, como antes.
+
+import atexit
+import logging
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from agent.experiment_files import write_experiment_file
+from agent.experiment_store import get_experiment_store, is_store_enabled, store_path_for
+
+logger = logging.getLogger(__name__)
+
+_SENTINEL = None
+
+class ExperimentWriter:
+    """
+    Escritor de experimentos en un hilo dedicado con cola acotada (ver notas del módulo).
+    """
+
+    def __init__(
+        self,
+        max_queue: int = 256,
+        batch_size: int = 32,
+        sample_every: int = 10,
+        compress: bool = True,
+    ) -> None:
+        self.batch_size = batch_size
+        self.sample_every = max(sample_every, 1)
+        self.compress = compress
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._high_watermark = int(max_queue * 0.8)
+        self._lock = threading.Lock()
+        self._counters = {"submitted": 0, "written": 0, "sampled_out": 0, "dropped": 0, "errors": 0}
+        self._thread = threading.Thread(target=self._run, name="experiment-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, output_dir: Path, name: str, data: Dict[str, Any]) -> bool:
+        """
+        Encola un experimento sin bloquear. Devuelve False si se ha descartado.
+        """
+        if not self._thread.is_alive():
+            # Escritor ya cerrado (fin del proceso): se escribe en el momento
+            _store_batch([(write_experiment_file(Path(output_dir), name, data, self.compress), data)])
+            return True
+        with self._lock:
+            self._counters["submitted"] += 1
+            submitted = self._counters["submitted"]
+            # Disco lento: por encima de la marca de agua solo se conserva una muestra
+            if self._queue.qsize() >= self._high_watermark and submitted % self.sample_every:
+                self._counters["sampled_out"] += 1
+                logger.warning(f"Cola de experimentos casi llena, no se guarda (muestreo): {name}")
+                return False
+        try:
+            self._queue.put_nowait((Path(output_dir), name, data))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._counters["dropped"] += 1
+            logger.warning(f"Cola de experimentos llena, se descarta: {name}")
+            return False
+
+    def _next_batch(self) -> Tuple[List[Tuple[Path, str, Dict[str, Any]]], bool]:
+        """
+        Espera el primer registro y recoge los que ya estén en la cola. Devuelve (lote, fin).
+        """
+        item = self._queue.get()
+        if item is _SENTINEL:
+            return [], True
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _SENTINEL:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        finished = False
+        while not finished:
+            batch, finished = self._next_batch()
+            written = []
+            for output_dir, name, data in batch:
+                try:
+                    written.append((write_experiment_file(output_dir, name, data, self.compress), data))
+                    with self._lock:
+                        self._counters["written"] += 1
+                except Exception as e:
+                    with self._lock:
+                        self._counters["errors"] += 1
+                    logger.error(f"No se pudo guardar el experimento {name}: {e}")
+            if written:
+                _store_batch(written)
+                logger.info(f"Experimentos guardados: {len(written)}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Vacía la cola y termina el hilo (se llama al salir del proceso).
+        """
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_SENTINEL, timeout=timeout)
+        except queue.Full:
+            logger.warning("No se pudo cerrar la cola de experimentos a tiempo")
+            return
+        self._thread.join(timeout)
+        stats = self.stats()
+        if stats["sampled_out"] or stats["dropped"] or stats["errors"]:
+            logger.warning(f"Escritor de experimentos cerrado con pérdidas: {stats}")
+
+def _store_batch(written: List[Tuple[Path, Dict[str, Any]]]) -> None:
+    """
+    Añade los experimentos escritos (fichero, datos) al almacén SQLite de su directorio
+    (una transacción por almacén, ver experiment_store.py).
+    """
+    if not is_store_enabled():
+        return
+    by_store: Dict[Path, Tuple[List[Dict[str, Any]], List[Path]]] = {}
+    for file, data in written:
+        records, files = by_store.setdefault(store_path_for(file.parent), ([], []))
+        records.append(data)
+        files.append(file)
+    for path, (records, files) in by_store.items():
+        try:
+            get_experiment_store(path).append_many(records, files)
+        except Exception as e:
+            logger.error(f"No se pudieron guardar {len(records)} experimentos en el almacén {path}: {e}")
+
+_writer: ExperimentWriter | None = None
+_writer_lock = threading.Lock()
+
+def get_experiment_writer() -> ExperimentWriter:
+    """
+    Devuelve el escritor de experimentos del proceso (se crea la primera vez).
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ExperimentWriter(
+                    max_queue=int(os.getenv("EXPERIMENT_LOG_QUEUE_SIZE", 256)),
+                    batch_size=int(os.getenv("EXPERIMENT_LOG_BATCH_SIZE", 32)),
+                    sample_every=int(os.getenv("EXPERIMENT_LOG_SAMPLE_EVERY", 10)),
+                    compress=os.getenv("EXPERIMENT_LOG_COMPRESS", "YES").upper() == "YES",
+                )
+                atexit.register(_writer.close)
+    return _writer
+
+def save_experiment(output_dir: Path, name: str, data: Dict[str, Any]) -> None:
+    """
+    Guarda un experimento: en segundo plano (por defecto) o en el momento con EXPERIMENT_LOG_ASYNC=NO.
+    """
+    if os.getenv("EXPERIMENT_LOG_ASYNC", "YES").upper() == "YES":
+        get_experiment_writer().submit(output_dir, name, data)
+    else:
+        compress = os.getenv("EXPERIMENT_LOG_COMPRESS", "YES").upper() == "YES"
+        _store_batch([(write_experiment_file(Path(output_dir), name, data, compress), data)])
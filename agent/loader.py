@@ -2,16 +2,20 @@
 # loader.py
 ###############################################
 
+import hashlib
 import json
 import logging
 import os
 from pathlib import Path
 from typing import Any, Dict, List
-from uuid import uuid4
+from uuid import NAMESPACE_URL, uuid5
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from openai import OpenAI
+from agent.embeddings import EmbeddingBatcher, OpenAIEmbedder
+from agent.embedding_cache import with_embedding_cache
+from agent.collection_version import read_collection_version, write_collection_version
+from agent.vector_index import NumpyVectorIndex, snapshot_dir_for
 from agent.utils.logging_config import setup_logging
 from agent.experiment_log import Experiment_LoadKnowledge, is_experiment_enabled
 
@@ -38,6 +42,13 @@ class QdrantLoader:
     - LOAD_EMBEDDING_MODEL_OPENAI: Modelo de embeddings de OpenAI
     - OPENAI_EMBEDDING_VECTOR_SIZE: Tamaño del vector de embeddings
     - OPENAI_API_KEY: Clave API de OpenAI
+
+    Los embeddings de todas las tablas de un esquema se generan por lotes (ver `EmbeddingBatcher`
+    en embeddings.py), en lugar de una llamada a la API por tabla.
+
+    La carga es incremental: cada tabla tiene un id determinista (módulo + tabla) y guarda en el
+    payload el hash del texto de embedding y el hash del payload. Solo se vuelven a generar los
+    embeddings de las tablas cuyo texto ha cambiado, y se borran las tablas que han desaparecido.
     """
 
     def __init__(self, embedding_provider: str = "openai", reset_collection: bool = True) -> None:
@@ -53,9 +64,12 @@ class QdrantLoader:
 
         # Punto de interés:
         # Si reset_collection es True, se borra y recrea la colección al inicio.
-        # Si reset_collection es False, se insertan los vectores en la colección sin borrar la existente.
+        # Si reset_collection es False, se actualiza la colección existente de forma incremental
+        # (y se crea si todavía no existe), sin dejarla vacía durante la recarga.
         if reset_collection:
             self._reset_collection()
+        else:
+            self._ensure_collection()
 
         #########################################################
         # Punto de control 1 monitorización de carga de conocimiento
@@ -86,8 +100,8 @@ class QdrantLoader:
         if self.embedding_provider == "openai":
             self.model_name = os.getenv("LOAD_EMBEDDING_MODEL_OPENAI", "text-embedding-3-small")
             self.vector_size = int(os.getenv("OPENAI_EMBEDDING_VECTOR_SIZE", 1536))
-            self._model = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-            self._embed = self._embed_openai
+            self.embedder = OpenAIEmbedder(self.model_name, self.vector_size)
+            self._embed = self._embed_batch
             
             # Configuración del nombre de la colección
             base = os.getenv("BASE_COLLECTION_NAME", "test")
@@ -97,39 +111,32 @@ class QdrantLoader:
             logger.error(f"Proveedor de embeddings todavía no soportado: {self.embedding_provider}")
             raise ValueError(f"Proveedor de embeddings todavía no soportado: {self.embedding_provider}")
 
-    def _embed_openai(self, text: str) -> List[float]:
+        # Los lotes se acotan por tamaño y tokens, y se reintentan de forma independiente.
+        # Por delante va la caché local de embeddings (si EMBEDDING_CACHE=YES), solo se envían los textos nuevos.
+        self.batcher = with_embedding_cache(EmbeddingBatcher(self.embedder))
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
         """
-        Generación de embedding con proveedor OpenAI.
+        Generación de embeddings por lotes con el proveedor configurado.
         
         Argumentos:
-            text (str): Texto para generar embedding
+            texts (List[str]): Textos para generar embedding (uno por tabla)
         """
 
-        self.text_for_embedding = text
+        # Se guarda el último texto, como hasta ahora, para la monitorización.
+        self.text_for_embedding = texts[-1] if texts else ""
 
         try:
-            response = self._model.embeddings.create(
-                model=self.model_name,
-                input=self.text_for_embedding
-            )
-            # Se obtiene el vector de embedding
-            self.vector = response.data[0].embedding
-            
-            # Se obtiene el número de tokens, modelo real y tamaño del vector
-            self.embedding_tokens = response.usage.total_tokens
-            self.embedding_model_name = response.model
-            self.embedding_vector_size = len(self.vector)
-            
-            # Verificación de tamaño del vector
-            if self.embedding_vector_size != self.vector_size:
-                logger.error(
-                    f"Tamaño del vector incorrecto: esperado={self.vector_size}, recibido={self.embedding_vector_size}"
-                )
-                raise RuntimeError("Tamaño del vector de embedding inesperado")
-                
-            return self.vector
+            vectors, tokens, model_name = self.batcher.embed(texts)
+
+            # Se obtiene el número de tokens (de todos los lotes), modelo real y tamaño del vector
+            self.embedding_tokens = tokens
+            self.embedding_model_name = model_name
+            self.embedding_vector_size = len(vectors[0]) if vectors else self.vector_size
+
+            return vectors
         except Exception as e:
-            logger.error(f"Error generando embedding: {str(e)}")
+            logger.error(f"Error generando embeddings: {str(e)}")
             raise
 
     def _reset_collection(self) -> None:
@@ -153,11 +160,115 @@ class QdrantLoader:
             )
 
             logger.info(f"Colección creada exitosamente: {self.collection}")
+
+            # Nueva versión de la colección, invalida las cachés del retriever
+            write_collection_version(self.client, self.collection)
         except Exception as e:
             logger.error(f"Error creando colección en Qdrant: {str(e)}")
             raise
 
-    def load_schema(self, schema_path: Path | str) -> None:
+    def _ensure_collection(self) -> None:
+        """
+        Crea la colección en Qdrant solo si todavía no existe.
+        """
+        try:
+            if self.client.collection_exists(self.collection):
+                logger.info(f"Colección existente, se actualizará de forma incremental: {self.collection}")
+                return
+        except Exception as e:
+            logger.error(f"Error comprobando la colección en Qdrant: {str(e)}")
+            raise
+
+        self._reset_collection()
+
+    def export_snapshot(self, snapshot_dir: Path | str | None = None) -> Path:
+        """
+        Exporta la colección a un snapshot local (vectores + payloads) para el backend NumPy del retriever.
+        
+        Argumentos:
+            snapshot_dir (Path | str | None): Directorio de salida, por defecto <RETRIEVER_SNAPSHOT_DIR>/<colección>
+        """
+        version = read_collection_version(self.client, self.collection)["version"]
+        index = NumpyVectorIndex.from_qdrant(self.client, self.collection, version=version)
+        return index.save_snapshot(
+            snapshot_dir or snapshot_dir_for(self.collection),
+            collection=self.collection,
+            embedding_model=self.model_name,
+            vector_size=self.vector_size,
+        )
+
+    @staticmethod
+    def _point_id(module_id: str, table_name: str) -> str:
+        """
+        Id determinista de un punto a partir de (módulo, tabla).
+        Qdrant solo admite enteros o UUID, por eso se usa un UUID v5.
+        """
+        return str(uuid5(NAMESPACE_URL, f"{module_id}/{table_name}"))
+
+    def _content_hash(self, text: str) -> str:
+        """
+        Hash del texto de embedding. Incluye el modelo y el tamaño del vector,
+        para que un cambio de modelo obligue también a regenerar el embedding.
+        """
+        return hashlib.sha256(f"{self.model_name}:{self.vector_size}\n{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _payload_hash(payload: Dict[str, Any]) -> str:
+        """
+        Hash del payload de una tabla.
+        Hay información del payload que no forma parte del texto de embedding (claves, enlaces, etc.),
+        si solo cambia el payload se actualiza sin regenerar el embedding.
+        """
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _existing_points(self, module_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Devuelve los puntos de un módulo que ya existen en la colección: {id: {content_hash, payload_hash}}
+        """
+        existing = {}
+        module_filter = models.Filter(
+            must=[models.FieldCondition(key="module.id", match=models.MatchValue(value=module_id))]
+        )
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection,
+                scroll_filter=module_filter,
+                with_payload=["content_hash", "payload_hash"],
+                with_vectors=False,
+                limit=256,
+                offset=offset,
+            )
+            for record in records:
+                existing[str(record.id)] = record.payload or {}
+            if offset is None:
+                break
+        return existing
+
+    def delete_other_modules(self, module_ids: List[str]) -> None:
+        """
+        Borra de la colección los puntos de módulos que ya no tienen archivo `_schema.json`.
+        
+        Argumentos:
+            module_ids (List[str]): Ids de los módulos que se deben conservar.
+        """
+        other_modules = models.Filter(
+            must_not=[models.FieldCondition(key="module.id", match=models.MatchAny(any=module_ids))]
+        )
+        # Si no hay nada que borrar, no se toca la colección (ni su versión)
+        if self.client.count(self.collection, count_filter=other_modules, exact=True).count == 0:
+            return
+
+        self.client.delete(
+            collection_name=self.collection,
+            points_selector=models.FilterSelector(filter=other_modules),
+        )
+        logger.info(f"Eliminados de {self.collection} los puntos de módulos distintos de: {module_ids}")
+
+        # Nueva versión de la colección, invalida las cachés del retriever
+        write_collection_version(self.client, self.collection)
+
+    def load_schema(self, schema_path: Path | str) -> str:
         """
         Carga el esquema en Qdrant.
         Primero genera un texto amigable para convertirlo a vector (embedding)
@@ -165,16 +276,40 @@ class QdrantLoader:
 
         Aquí, lo que se intenta es crear un único vector por tabla, ya que
         un campo por sí solo no tiene sentido, y requiere de su cotnexto inmediato.
+
+        La carga es incremental respecto a lo que ya hay en la colección:
+        - Tablas nuevas o con el texto de embedding modificado: se genera embedding y se suben.
+        - Tablas con el mismo texto pero payload modificado: se actualiza solo el payload.
+        - Tablas sin cambios: no se hace nada.
+        - Tablas del módulo que ya no están en el esquema: se borran.
         
         Argumentos:
             schema_path (Path | str): Ruta al archivo schema.json
+
+        Devuelve:
+            (str) id del módulo cargado.
         """
         try:
             # Cargamos schema.json
             schema = json.loads(Path(schema_path).read_text("utf-8"))
             
-            # Definimos la lista de puntos a subir a qdrant vacía
-            points = []
+            module_id = schema["module"]["id"]
+
+            # Valores por defecto para la monitorización, por si no hay que generar ningún embedding.
+            self.text_for_embedding = ""
+            self.embedding_tokens = 0
+            self.embedding_model_name = self.model_name
+            self.embedding_vector_size = self.vector_size
+
+            # Puntos del módulo que ya están en la colección, con sus hashes.
+            existing = self._existing_points(module_id)
+
+            # Definimos las listas de textos y payloads vacías.
+            # Los embeddings se generan después, por lotes, solo para las tablas que han cambiado.
+            texts = []
+            payloads = []
+            ids = []
+            payload_updates = []
             for table in schema["module"]["tables"]:
                 # Generamos el texto para embedding de manera bilingüe
                 text = (
@@ -237,15 +372,39 @@ class QdrantLoader:
                     }
                 }
                 
-                # Se crea el punto para subir a qdrant
-                points.append({
-                    "id": str(uuid4()), # Se crea un id único para cada punto para no reptirse ni complicar la carga
-                    "vector": self._embed(text), # se genenera el vector
+                # Id determinista y hashes de contenido para la carga incremental.
+                point_id = self._point_id(module_id, table["name"])
+                payload["payload_hash"] = self._payload_hash(payload)
+                payload["content_hash"] = self._content_hash(text)
+                ids.append(point_id)
+
+                previous = existing.get(point_id, {})
+                if previous.get("content_hash") != payload["content_hash"]:
+                    # Tabla nueva o texto de embedding modificado.
+                    texts.append(text)
+                    payloads.append((point_id, payload))
+                elif previous.get("payload_hash") != payload["payload_hash"]:
+                    # Mismo texto, solo cambia el payload.
+                    payload_updates.append((point_id, payload))
+
+            # Tablas que estaban en la colección y ya no están en el esquema.
+            removed_ids = [point_id for point_id in existing if point_id not in ids]
+
+            # Se generan los vectores de las tablas modificadas en lotes (en lugar de una llamada por tabla)
+            vectors = self._embed(texts) if texts else []
+
+            # Se crean los puntos para subir a qdrant
+            points = [
+                {
+                    "id": point_id, # id determinista (módulo + tabla), la misma tabla siempre sobrescribe su punto
+                    "vector": vector, # vector generado por lotes
                     "payload": payload # se crea el payload con toda la información de la tabla
-                })
+                }
+                for vector, (point_id, payload) in zip(vectors, payloads)
+            ]
 
-                # Se almacenan el diccionario de puntos subidos a Qdrant
-                self.points = points
+            # Se almacenan el diccionario de puntos subidos a Qdrant
+            self.points = points
             
             ########################################################
             # Punto de control 2 Inicio de carga de conocimiento
@@ -258,8 +417,28 @@ class QdrantLoader:
 
             #########################################################
             
-            # Subimos los puntos a qdrant
-            self.client.upsert(self.collection, points)
+            # Subimos los puntos a qdrant (solo los que han cambiado)
+            if points:
+                self.client.upsert(self.collection, [models.PointStruct(**point) for point in points])
+
+            # Actualizamos los payloads que han cambiado sin cambiar el texto de embedding
+            for point_id, payload in payload_updates:
+                self.client.overwrite_payload(
+                    collection_name=self.collection,
+                    payload=payload,
+                    points=[point_id],
+                )
+
+            # Borramos las tablas que han desaparecido del esquema
+            if removed_ids:
+                self.client.delete(
+                    collection_name=self.collection,
+                    points_selector=models.PointIdsList(points=removed_ids),
+                )
+
+            # Si algo ha cambiado, nueva versión de la colección (invalida las cachés del retriever)
+            if points or payload_updates or removed_ids:
+                write_collection_version(self.client, self.collection)
 
             #########################################################
             # Punto de control 3 Fin de carga de conocimiento
@@ -286,7 +465,13 @@ class QdrantLoader:
                 logger.error(f"Error en experiment.finish: {str(e)}")
             #########################################################
 
-            logger.info(f"Esquema de {schema['module']['id']} cargado exitosamente: {len(points)} puntos")
+            logger.info(
+                f"Esquema de {module_id} cargado exitosamente: {len(points)} puntos con embedding nuevo, "
+                f"{len(payload_updates)} payloads actualizados, {len(removed_ids)} puntos eliminados, "
+                f"{len(ids) - len(points) - len(payload_updates)} sin cambios"
+            )
+
+            return module_id
             
         except Exception as e:
             logger.error(f"Error cargando esquema: {str(e)}")
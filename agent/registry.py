@@ -0,0 +1,171 @@
+###############################################
+# registry.py
+###############################################
+# Notas:
+# Registro de componentes compartidos por todo el proceso (todas las sesiones de Streamlit).
+# Cada componente se crea una única vez por configuración (la clave son las variables de entorno
+# que lo definen), de forma perezosa y protegida con un lock, y después se reutiliza.
+# Los clientes de Qdrant y OpenAI mantienen internamente su propio pool de conexiones HTTP,
+# por lo que compartir la instancia equivale a compartir el pool.
+
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+from agent.response_cache import ResponseCache
+from agent.retriever import QdrantRetriever
+from agent.utils.logging_config import setup_logging
+
+load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Componentes creados: {(tipo, configuración): instancia}
+_components: Dict[Tuple, Any] = {}
+# Un lock por clave, para no bloquear la creación de componentes distintos entre sí.
+_key_locks: Dict[Tuple, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+def _get_or_create(key: Tuple, factory: Callable[[], Any]) -> Any:
+    """
+    Devuelve el componente de la clave, creándolo la primera vez (thread-safe).
+    """
+    component = _components.get(key)
+    if component is not None:
+        return component
+
+    with _registry_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        # Otro hilo puede haberlo creado mientras esperábamos el lock.
+        component = _components.get(key)
+        if component is None:
+            logger.info(f"Registro: creando componente {key[0]}")
+            component = factory()
+            _components[key] = component
+    return component
+
+def _retriever_config() -> Tuple:
+    """
+    Variables de entorno que definen un retriever.
+    """
+    return (
+        "retriever",
+        os.getenv("EMBEDDING_PROVIDER", "OPENAI").upper(),
+        os.getenv("QDRANT_URL"),
+        os.getenv("BASE_COLLECTION_NAME", "qdrant"),
+        os.getenv("LOAD_EMBEDDING_MODEL_OPENAI", "text-embedding-3-small"),
+        os.getenv("OPENAI_EMBEDDING_VECTOR_SIZE", "1536"),
+        os.getenv("RETRIEVER_LIMIT", "25"),
+        os.getenv("RETRIEVER_BACKEND", "QDRANT").upper(),
+        os.getenv("RETRIEVER_SNAPSHOT_DIR"),
+    )
+
+def get_retriever() -> QdrantRetriever:
+    """
+    Devuelve el retriever (RAG) compartido por el proceso.
+    """
+    return _get_or_create(_retriever_config(), QdrantRetriever)
+
+def get_chat_llm(provider: str, model: str, temperature: float) -> ChatOpenAI:
+    """
+    Devuelve el LLM de chat compartido para (proveedor, modelo, temperatura).
+    """
+    provider = provider.upper()
+    if provider == "OPENAI":
+        return _get_or_create(
+            ("chat_llm", provider, model, temperature),
+            lambda: ChatOpenAI(model=model, temperature=temperature)
+        )
+    # Añadir futuros proveedores de LLM elif
+    raise ValueError(f"Proveedor LLM todavía no soportado: {provider}")
+
+def get_sql_llm() -> ChatOpenAI:
+    """
+    Devuelve el LLM razonador de generación de SQL configurado en .env.
+    """
+    return get_chat_llm(
+        os.getenv("SQL_LLM_PROVIDER", "OPENAI"),
+        os.getenv("SQL_LLM_MODEL", "gpt-4o-mini"),
+        float(os.getenv("SQL_LLM_TEMPERATURE", 1)),
+    )
+
+def get_format_llm() -> ChatOpenAI:
+    """
+    Devuelve el LLM barato del formateo del script SQL ya validado (ver sql_validator.py y tools.py).
+    """
+    return get_chat_llm(
+        os.getenv("SQL_LLM_PROVIDER", "OPENAI"),
+        os.getenv("SQL_FORMAT_LLM_MODEL", "gpt-4o-mini-2024-07-18"),
+        float(os.getenv("SQL_FORMAT_LLM_TEMPERATURE", 0)),
+    )
+
+def get_response_cache() -> ResponseCache:
+    """
+    Devuelve la caché semántica de respuestas de la tool compartida por el proceso (ver response_cache.py).
+    """
+    enabled = os.getenv("RESPONSE_CACHE", "NO").upper() == "YES"
+    threshold = float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.97))
+    max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 256))
+    ttl = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 86400))
+    return _get_or_create(
+        ("response_cache", enabled, threshold, max_entries, ttl),
+        lambda: ResponseCache(enabled, threshold, max_entries, ttl)
+    )
+
+def warm_up() -> Dict[str, Any]:
+    """
+    Crea por adelantado los componentes de la tool (retriever y LLM de SQL),
+    para que la primera petición de un usuario no pague su inicialización.
+    Devuelve el resultado de `health_check()`.
+    """
+    try:
+        get_retriever()
+        get_sql_llm()
+    except Exception as e:
+        logger.error(f"Error en el warm-up de componentes: {e}")
+    return health_check()
+
+def health_check() -> Dict[str, Any]:
+    """
+    Comprueba el estado de los componentes compartidos.
+
+    Devuelve un diccionario con:
+    - qdrant: (bool) si la colección del retriever responde (Qdrant o índice NumPy).
+    - backend: (str) backend de búsqueda del retriever.
+    - collection: (str) nombre de la colección.
+    - points_count: (int o None) número de vectores de la colección.
+    - sql_llm: (bool) si el LLM de SQL está configurado.
+    - error: (str) último error encontrado, si lo hay.
+    """
+    status = {"qdrant": False, "backend": None, "collection": None, "points_count": None, "sql_llm": False, "error": None}
+
+    try:
+        retriever = get_retriever()
+        status["backend"] = retriever.backend
+        status["collection"] = retriever.collection
+        status["points_count"] = retriever.count_vectors()
+        status["qdrant"] = True
+    except Exception as e:
+        status["error"] = str(e)
+
+    try:
+        get_sql_llm()
+        status["sql_llm"] = True
+    except Exception as e:
+        status["error"] = str(e)
+
+    return status
+
+def reset_registry() -> None:
+    """
+    Vacía el registro (por ejemplo, tras cambiar variables de entorno en un notebook).
+    """
+    with _registry_lock:
+        _components.clear()
+        _key_locks.clear()
@@ -0,0 +1,148 @@
+###############################################
+# response_cache.py
+###############################################
+# Notas:
+# Caché semántica de respuestas completas de la tool `search_and_generate_sql`.
+# Muchas peticiones piden el mismo log de eventos con pequeñas diferencias de redacción,
+# y cada una paga las dos generaciones del LLM. Aquí se guarda el script SQL final junto al
+# embedding de las necesidades del usuario: si una petición nueva se parece lo suficiente
+# (similitud coseno >= RESPONSE_CACHE_THRESHOLD) a una anterior, se devuelve su script.
+#
+# Solo se comparan entradas con la misma clave (proveedor, modelo y temperatura del LLM, modelo de
+# embedding y versión de los prompts, ver tools.py), y toda la caché se vacía cuando cambia la
+# versión de la colección de conocimiento (ver collection_version.py).
+#
+# Variables de entorno opcionales:
+# - RESPONSE_CACHE: YES o NO (por defecto), activa la caché.
+# - RESPONSE_CACHE_THRESHOLD: similitud mínima para servir una respuesta (por defecto 0.97).
+# - RESPONSE_CACHE_MAX_ENTRIES: número máximo de respuestas, se desaloja la menos usada (por defecto 256).
+# - RESPONSE_CACHE_TTL_SECONDS: caducidad de cada respuesta (por defecto 86400).
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class CachedResponse(NamedTuple):
+    """
+    Respuesta servida desde la caché:
+    - sql_script: (str) script SQL final de la petición anterior.
+    - user_needs: (str) necesidades del usuario de la petición anterior.
+    - similarity: (float) similitud coseno con la petición actual.
+    """
+    sql_script: str
+    user_needs: str
+    similarity: float
+
+class _Entry(NamedTuple):
+    key: Tuple
+    vector: np.ndarray
+    user_needs: str
+    sql_script: str
+    created_at: float
+
+class ResponseCache:
+    """
+    Caché acotada (LRU con TTL) de respuestas indexadas por el embedding de la petición.
+    La búsqueda es exacta sobre las entradas de la misma clave: son pocas y el producto escalar es inmediato.
+    """
+
+    def __init__(self, enabled: bool, threshold: float, max_entries: int, ttl: float | None = None) -> None:
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._next_id = 0
+        self._version: Any = None
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm > 0 else array
+
+    def _check_version(self, version: Any) -> None:
+        """
+        Vacía la caché si la colección ha cambiado de versión (con el lock tomado).
+        """
+        if version != self._version:
+            if self._entries:
+                logger.info("La colección ha cambiado de versión, se vacía la caché de respuestas")
+            self._entries.clear()
+            self._version = version
+
+    def _best_match(self, vector: np.ndarray, key: Tuple) -> Tuple[int | None, float]:
+        """
+        Entrada vigente de la misma clave más similar al vector (con el lock tomado).
+        """
+        now = time.monotonic()
+        expired = [i for i, e in self._entries.items() if self.ttl is not None and now - e.created_at > self.ttl]
+        for entry_id in expired:
+            del self._entries[entry_id]
+
+        candidates = [(i, e.vector) for i, e in self._entries.items() if e.key == key]
+        if not candidates:
+            return None, 0.0
+        scores = np.stack([v for _, v in candidates]) @ vector
+        best = int(np.argmax(scores))
+        return candidates[best][0], float(scores[best])
+
+    def get(self, vector: List[float], key: Tuple, version: Any) -> CachedResponse | None:
+        """
+        Devuelve la respuesta más similar si supera el umbral, o None.
+        """
+        if not self.enabled:
+            return None
+        query = self._normalize(vector)
+        with self._lock:
+            self._check_version(version)
+            entry_id, similarity = self._best_match(query, key)
+            if entry_id is None or similarity < self.threshold:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self._counters["hits"] += 1
+            entry = self._entries[entry_id]
+
+        logger.info(f"Respuesta servida desde la caché de respuestas (similitud {similarity:.4f})")
+        return CachedResponse(entry.sql_script, entry.user_needs, similarity)
+
+    def put(self, vector: List[float], key: Tuple, version: Any, user_needs: str, sql_script: str) -> None:
+        """
+        Guarda la respuesta de una petición. Si ya hay una casi idéntica con la misma clave, se sustituye.
+        """
+        if not self.enabled:
+            return
+        query = self._normalize(vector)
+        with self._lock:
+            self._check_version(version)
+            entry_id, similarity = self._best_match(query, key)
+            if entry_id is not None and similarity >= 0.9999:
+                del self._entries[entry_id]
+            self._entries[self._next_id] = _Entry(key, query, user_needs, sql_script, time.monotonic())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Contadores del proceso: aciertos, fallos, tasa de acierto y número de respuestas guardadas.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -2,19 +2,92 @@
 # retriever.py
 ###############################################
 
+import asyncio
+import hashlib
 import logging
 import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextvars import ContextVar
 from typing import List, Dict, Any, Tuple
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
-from openai import OpenAI
+from qdrant_client import AsyncQdrantClient, QdrantClient
 
+from agent.embeddings import OpenAIEmbedder
+from agent.embedding_cache import with_embedding_cache
+from agent.collection_version import read_collection_version
+from agent.vector_index import NumpyVectorIndex, snapshot_dir_for
 from agent.utils.logging_config import setup_logging
 
 load_dotenv()
 setup_logging()
 logger = logging.getLogger(__name__)
 
+class _LRUCache:
+    """
+    Diccionario acotado en memoria con desalojo LRU y caducidad opcional (TTL) de las entradas.
+    """
+
+    def __init__(self, max_entries: int, ttl: float | None = None) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            created_at, value = item
+            if self.ttl is not None and time.monotonic() - created_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+class _CallState:
+    """
+    Atributos propios de cada llamada: cada hilo y cada tarea de asyncio ven sus propios valores
+    (se guardan en una ContextVar, que a diferencia de threading.local también separa las corrutinas
+    que comparten hilo). `reset()` empieza un estado vacío para la llamada en curso.
+    """
+
+    def __init__(self) -> None:
+        object.__setattr__(self, "_var", ContextVar(f"retriever_call_state_{id(self)}", default=None))
+
+    def _state(self) -> Dict[str, Any]:
+        state = self._var.get()
+        if state is None:
+            state = {}
+            self._var.set(state)
+        return state
+
+    def reset(self) -> None:
+        self._var.set({})
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self._state()[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        self._state()[name] = value
+
 class QdrantRetriever:
     """
     RAG: Búsqueda semántica en Qdrant.
@@ -27,9 +100,18 @@ class QdrantRetriever:
        1.3. Verificación de la existencia de la colección en Qdrant (_verify_collection).
 
     2. Búsqueda en Qdrant (search):
-        2.1. Generación del embedding en función del proveedor (_embed_openai).
+        2.1. Generación del embedding en función del proveedor (embed_query -> _embed_openai).
         2.3. Búsqueda semántica en Qdrant. (search)
 
+    `asearch` es la variante asíncrona de `search` (clientes asíncronos de OpenAI y Qdrant),
+    con las mismas cachés y el mismo resultado.
+
+    Caché de dos niveles en memoria (RETRIEVER_CACHE=YES por defecto):
+    - Nivel 1: texto normalizado de la consulta -> vector de embedding.
+    - Nivel 2: (hash del vector, limit, versión de la colección) -> resultados de Qdrant, con TTL.
+      La versión de la colección es la marca que escribe el loader más el número de puntos,
+      si cambia se vacía el nivel 2 (ver collection_version.py).
+
     Nota:
     Se abusa de los logs para facilitar la depuración, puyede ser molesto por consola,
     pero facilita enormemente el sguimiento en este estado inmaduro del proyecto, 
@@ -41,20 +123,38 @@ class QdrantRetriever:
     - OPENAI_EMBEDDING_VECTOR_SIZE (Ejemplo: 1536)
     - OPENAI_API_KEY (Ejemplo: "<cadena de caracteres de la API key>")
     - BASE_COLLECTION_NAME (Ejemplo: "<nombre de la colección en Qdrant>")
+
+    Backend de búsqueda (RETRIEVER_BACKEND):
+    - QDRANT (por defecto): búsqueda en el servidor Qdrant.
+    - NUMPY: índice en memoria (ver vector_index.py). Se carga del snapshot exportado por el loader
+      (<RETRIEVER_SNAPSHOT_DIR>/<colección>, mapeado en memoria) o, si no existe, desde Qdrant.
+      En ambos casos se recarga si cambia el snapshot o la versión de la colección en Qdrant, con la misma
+      frecuencia que la caché de búsquedas (RETRIEVER_CACHE_VERSION_CHECK_SECONDS).
+      El contrato de `search` es el mismo con ambos backends.
+
+    Una misma instancia se comparte entre hilos y corrutinas (ver registry.py), por eso los datos de
+    la última búsqueda (tokens y modelo del embedding) se guardan por llamada (ver _CallState).
     """
 
     def __init__(self) -> None:
         logger.info("Inicializando Retriever (RAG)")
+        # Datos de la última búsqueda de cada hilo / tarea asyncio
+        self._local = _CallState()
         self._setup_configuration()
         self._setup_embedding_provider()
+        self._setup_cache()
+        self._setup_backend()
         self._verify_collection()
 
     def _setup_configuration(self) -> None:
         """Configura los parámetros básicos del retriever."""
         self.embedding_provider = os.getenv("EMBEDDING_PROVIDER", "OPENAI").upper()
+        self.backend = os.getenv("RETRIEVER_BACKEND", "QDRANT").upper()
         self.limit = int(os.getenv("RETRIEVER_LIMIT", 25))
+        # El cliente no conecta hasta la primera petición, con el backend NUMPY y snapshot no se usa.
         self.client = QdrantClient(url=os.getenv("QDRANT_URL"))
-        logger.info(f"Configuración básica completada: limit={self.limit}")
+        self.async_client = AsyncQdrantClient(url=os.getenv("QDRANT_URL"))
+        logger.info(f"Configuración básica completada: backend={self.backend}, limit={self.limit}")
 
     def _setup_embedding_provider(self) -> None:
         """
@@ -64,8 +164,10 @@ class QdrantRetriever:
         if self.embedding_provider == "OPENAI":
             self.embedding_model = os.getenv("LOAD_EMBEDDING_MODEL_OPENAI", "text-embedding-3-small")
             self._embed = self._embed_openai
+            self._aembed = self._aembed_openai
             self.vector_size = int(os.getenv("OPENAI_EMBEDDING_VECTOR_SIZE", 1536))
-            self._openai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            # Embedder de OpenAI con la caché local de embeddings por delante (si EMBEDDING_CACHE=YES)
+            self.embedder = with_embedding_cache(OpenAIEmbedder(self.embedding_model, self.vector_size))
             self.suffix = "openai"
             # Se define el nombre base de la colección (por si en el futuro se incorporan otros proveedores)
             self.base = os.getenv("BASE_COLLECTION_NAME", "qdrant")
@@ -76,10 +178,79 @@ class QdrantRetriever:
             logger.error(f"Proveedor todavía no soportado: {self.embedding_provider}")
             raise ValueError(f"Proveedor de embeddings no soportado: {self.embedding_provider}")
     
+    def _setup_cache(self) -> None:
+        """
+        Configura la caché de dos niveles del retriever.
+        """
+        self.cache_enabled = os.getenv("RETRIEVER_CACHE", "YES").upper() == "YES"
+        max_entries = int(os.getenv("RETRIEVER_CACHE_MAX_ENTRIES", 256))
+        # Nivel 1: consulta normalizada -> vector
+        self._query_cache = _LRUCache(max_entries)
+        # Nivel 2: (hash vector, limit, versión colección) -> resultados
+        self._search_cache = _LRUCache(max_entries, ttl=float(os.getenv("RETRIEVER_CACHE_TTL_SECONDS", 600)))
+        # Cada cuántos segundos se vuelve a consultar la versión de la colección
+        self._version_check_seconds = float(os.getenv("RETRIEVER_CACHE_VERSION_CHECK_SECONDS", 30))
+        self._version = None
+        self._version_checked_at = 0.0
+        # Contadores globales y latencia media de los fallos, para estimar el tiempo ahorrado
+        self._cache_lock = threading.Lock()
+        self._cache_counters = {"embedding_hits": 0, "embedding_misses": 0, "search_hits": 0, "search_misses": 0}
+        self._avg_miss_seconds = {"embedding": None, "search": None}
+
+    def _setup_backend(self) -> None:
+        """
+        Prepara el backend de búsqueda. Con NUMPY se carga el índice en memoria.
+        """
+        self.index = None
+        self.snapshot_dir = None
+        self._snapshot_mtime = None
+        # Versión de Qdrant (marca del loader, número de puntos) del índice cargado desde Qdrant
+        self._index_version = None
+        self._index_lock = threading.Lock()
+
+        if self.backend == "QDRANT":
+            return
+        if self.backend != "NUMPY":
+            logger.error(f"Backend del retriever no soportado: {self.backend}")
+            raise ValueError(f"Backend del retriever no soportado: {self.backend}")
+
+        snapshot_dir = snapshot_dir_for(self.collection)
+        if (snapshot_dir / "meta.json").exists():
+            self.snapshot_dir = snapshot_dir
+            self._load_snapshot()
+        else:
+            logger.info(f"No existe snapshot en {snapshot_dir}, se carga el índice desde Qdrant")
+            self._load_from_qdrant(read_collection_version(self.client, self.collection))
+
+    def _load_snapshot(self) -> None:
+        """
+        Carga (o recarga) el índice NumPy desde el snapshot, comprobando que sea del mismo modelo de embeddings.
+        """
+        meta_path = self.snapshot_dir / "meta.json"
+        mtime = meta_path.stat().st_mtime
+        index = NumpyVectorIndex.from_snapshot(self.snapshot_dir)
+        if index.meta.get("embedding_model") not in (None, self.embedding_model) or index.meta.get("vector_size") not in (None, self.vector_size):
+            logger.error(f"El snapshot {self.snapshot_dir} no corresponde al modelo de embeddings configurado: {index.meta}")
+            raise ValueError(f"El snapshot {self.snapshot_dir} no corresponde al modelo de embeddings configurado")
+        self.index = index
+        self._snapshot_mtime = mtime
+
+    def _load_from_qdrant(self, info: Dict[str, Any]) -> None:
+        """
+        Carga (o recarga) el índice NumPy desde Qdrant. `info` es la versión leída antes de descargar los puntos
+        (ver read_collection_version): si la colección cambia mientras tanto, se recarga en la siguiente comprobación.
+        """
+        self.index = NumpyVectorIndex.from_qdrant(self.client, self.collection, version=info["version"])
+        self._index_version = (info["version"], info["points_count"])
+
     def _verify_collection(self) -> None:
         """
         Verifica que la colección existe en Qdrant.
         """
+        if self.index is not None:
+            logger.info(f"Índice NumPy de '{self.collection}' disponible: {self.index.count} vectores")
+            return
+
         try:
             self.client.get_collection(self.collection)
             logger.info(f"Colección '{self.collection}' encontrada")
@@ -89,32 +260,294 @@ class QdrantRetriever:
     def _embed_openai(self, text: str) -> List[float]:
         """
         Genera embeddings usando OpenAI.
+        Si el texto ya está en la caché local de embeddings, no se llama a la API (0 tokens).
         """
         try:
             # Generación del embedding que se usará para la búsqueda semántica
-            response = self._openai.embeddings.create(
-                model=self.embedding_model, 
-                input=text
-            )
-
-            vector = response.data[0].embedding
+            # (el tamaño del vector se comprueba en el embedder)
+            vectors, tokens, model_name = self.embedder.embed([text])
 
             # Se obtiene el número de tokens usados para generar el embedding
-            self.embedding_tokens = response.usage.total_tokens
+            self.embedding_tokens = tokens
 
             # Se obtiene el modelo usado realmente
-            self.embedding_model_name = response.model
-            
-            # Comprobación de tamaño del vector de embedding
-            if len(vector) != self.vector_size:
-                logger.error(f"Tamaño del vector de embedding inesperado: expected={self.vector_size}, got={len(vector)}")
-                raise RuntimeError("Tamaño del vector de embedding inesperado.")
+            self.embedding_model_name = model_name
                 
-            return vector
+            return vectors[0]
         except Exception as e:
             logger.error(f"Error generando embedding: {str(e)}")
             raise
 
+    async def _aembed_openai(self, text: str) -> List[float]:
+        """
+        Variante asíncrona de `_embed_openai`.
+        """
+        try:
+            vectors, tokens, model_name = await self.embedder.aembed([text])
+            self.embedding_tokens = tokens
+            self.embedding_model_name = model_name
+            return vectors[0]
+        except Exception as e:
+            logger.error(f"Error generando embedding: {str(e)}")
+            raise
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """
+        Normaliza la consulta para la caché: minúsculas y espacios colapsados.
+        """
+        return " ".join(query.split()).lower()
+
+    @staticmethod
+    def _vector_hash(vector: List[float]) -> str:
+        return hashlib.sha256(array("f", vector).tobytes()).hexdigest()
+
+    def _record_cache(self, level: str, hit: bool, seconds: float | None = None) -> None:
+        """
+        Registra un acierto o fallo de caché del nivel indicado ('embedding' o 'search').
+        En los fallos se actualiza la latencia media (media móvil), que es lo que se estima
+        como ahorrado en cada acierto.
+        """
+        with self._cache_lock:
+            if hit:
+                self._cache_counters[f"{level}_hits"] += 1
+                saved = self._avg_miss_seconds[level] or 0.0
+            else:
+                self._cache_counters[f"{level}_misses"] += 1
+                avg = self._avg_miss_seconds[level]
+                self._avg_miss_seconds[level] = seconds if avg is None else 0.8 * avg + 0.2 * seconds
+                saved = 0.0
+
+        info = getattr(self._local, "cache_info", None)
+        if info is not None:
+            info[f"{level}_hit"] = hit
+            info["saved_seconds"] += saved
+
+    def count_vectors(self) -> int:
+        """
+        Número de vectores de la colección (o del índice NumPy).
+        """
+        if self.index is not None:
+            return self.index.count
+        return self.client.get_collection(self.collection).points_count
+
+    def _read_version(self) -> Tuple[str | None, int | None]:
+        """
+        Lee la versión actual del backend.
+        Con el índice NumPy, si el loader ha exportado un snapshot nuevo o ha cambiado la versión de la colección
+        en Qdrant (índice cargado desde Qdrant), se recarga el índice. Si falla, se sigue usando el anterior.
+        """
+        if self.index is None:
+            info = read_collection_version(self.client, self.collection)
+            return info["version"], info["points_count"]
+
+        with self._index_lock:
+            if self.snapshot_dir is not None:
+                try:
+                    if (self.snapshot_dir / "meta.json").stat().st_mtime != self._snapshot_mtime:
+                        logger.info(f"Snapshot de '{self.collection}' actualizado, se recarga el índice NumPy")
+                        self._load_snapshot()
+                except Exception as e:
+                    logger.warning(f"No se pudo recargar el snapshot {self.snapshot_dir}: {e}")
+            else:
+                info = read_collection_version(self.client, self.collection)
+                # Sin número de puntos no se ha podido leer la colección (Qdrant caído): se mantiene el índice
+                if info["points_count"] is not None and (info["version"], info["points_count"]) != self._index_version:
+                    logger.info(f"La colección '{self.collection}' ha cambiado de versión, se recarga el índice NumPy desde Qdrant")
+                    try:
+                        self._load_from_qdrant(info)
+                    except Exception as e:
+                        logger.warning(f"No se pudo recargar el índice NumPy desde Qdrant: {e}")
+        return self.index.version, self.index.count
+
+    def collection_version(self) -> Tuple[str | None, int | None]:
+        """
+        Devuelve la versión de la colección (marca del loader, número de puntos).
+        Solo se consulta a Qdrant cada RETRIEVER_CACHE_VERSION_CHECK_SECONDS segundos.
+        Si ha cambiado, se vacía la caché de búsquedas.
+        """
+        with self._cache_lock:
+            if self._version is not None and time.monotonic() - self._version_checked_at < self._version_check_seconds:
+                return self._version
+
+        version = self._read_version()
+
+        with self._cache_lock:
+            if self._version is not None and version != self._version:
+                logger.info(f"La colección '{self.collection}' ha cambiado de versión, se vacía la caché de búsquedas")
+                self._search_cache.clear()
+            self._version = version
+            self._version_checked_at = time.monotonic()
+        return version
+
+    def _cached_query_vector(self, key: str) -> List[float] | None:
+        """
+        Nivel 1 de la caché: vector de la consulta normalizada, si está.
+        """
+        vector = self._query_cache.get(key) if self.cache_enabled else None
+        if vector is not None:
+            # Sin llamada al proveedor: 0 tokens
+            self.embedding_tokens = 0
+            self.embedding_model_name = self.embedding_model
+            self._record_cache("embedding", True)
+        return vector
+
+    def _store_query_vector(self, key: str, vector: List[float], seconds: float) -> None:
+        self._record_cache("embedding", False, seconds)
+        if self.cache_enabled:
+            self._query_cache.put(key, vector)
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Devuelve el embedding de la consulta, pasando por el nivel 1 de la caché.
+        """
+        key = self._normalize_query(query)
+        vector = self._cached_query_vector(key)
+        if vector is not None:
+            return vector
+
+        start = time.perf_counter()
+        vector = self._embed(query)
+        self._store_query_vector(key, vector, time.perf_counter() - start)
+        return vector
+
+    async def aembed_query(self, query: str) -> List[float]:
+        """
+        Variante asíncrona de `embed_query`.
+        """
+        key = self._normalize_query(query)
+        vector = self._cached_query_vector(key)
+        if vector is not None:
+            return vector
+
+        start = time.perf_counter()
+        vector = await self._aembed(query)
+        self._store_query_vector(key, vector, time.perf_counter() - start)
+        return vector
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """
+        Contadores globales de la caché del retriever y tasas de acierto.
+        """
+        with self._cache_lock:
+            stats = dict(self._cache_counters)
+        for level in ("embedding", "search"):
+            total = stats[f"{level}_hits"] + stats[f"{level}_misses"]
+            stats[f"{level}_hit_rate"] = stats[f"{level}_hits"] / total if total else 0.0
+        return stats
+
+    def last_cache_info(self) -> Dict[str, Any]:
+        """
+        Datos de caché de la última búsqueda de este hilo (o tarea asyncio), junto a las tasas de acierto globales:
+        - embedding_hit / search_hit: (bool) si cada nivel acertó.
+        - saved_seconds: (float) latencia estimada ahorrada.
+        - embedding_hit_rate / search_hit_rate: (float) tasas de acierto del proceso.
+        """
+        info = dict(getattr(self._local, "cache_info", None) or {"embedding_hit": False, "search_hit": False, "saved_seconds": 0.0})
+        stats = self.cache_stats()
+        info["embedding_hit_rate"] = stats["embedding_hit_rate"]
+        info["search_hit_rate"] = stats["search_hit_rate"]
+        return info
+
+    def last_query_vector(self) -> List[float] | None:
+        """
+        Embedding de la consulta de la última búsqueda de este hilo (o tarea asyncio).
+        """
+        return getattr(self._local, "query_vector", None)
+
+    def _search_vector(self, query_vector: List[float], limit: int) -> List[Any]:
+        """
+        Búsqueda de los `limit` vecinos más cercanos en el backend configurado.
+        Los resultados tienen siempre los atributos `score` y `payload`.
+        """
+        if self.index is not None:
+            return self.index.search(query_vector, limit)
+
+        return self.client.search(
+            collection_name=self.collection,
+            query_vector=query_vector,
+            limit=limit,
+        )
+
+    async def _asearch_vector(self, query_vector: List[float], limit: int) -> List[Any]:
+        """
+        Variante asíncrona de `_search_vector`. El índice NumPy es local, se consulta directamente.
+        """
+        if self.index is not None:
+            return self.index.search(query_vector, limit)
+
+        return await self.async_client.search(
+            collection_name=self.collection,
+            query_vector=query_vector,
+            limit=limit,
+        )
+
+    def _start_search(self, limit: int | None, score: float) -> int:
+        """
+        Prepara una búsqueda nueva: estado vacío de la llamada y límite efectivo.
+        """
+        limit = limit or self.limit
+        logger.info(f"Iniciando búsqueda semántica: limit={limit}, score={score}")
+
+        # Datos de caché de esta búsqueda (por llamada)
+        self._local.reset()
+        self._local.cache_info = {"embedding_hit": False, "search_hit": False, "saved_seconds": 0.0}
+        return limit
+
+    def _cached_hits(self, cache_key: Tuple | None) -> List[Any] | None:
+        """
+        Nivel 2 de la caché: resultados de una búsqueda anterior con la misma clave.
+        """
+        hits = self._search_cache.get(cache_key) if cache_key is not None else None
+        if hits is not None:
+            self._record_cache("search", True)
+            logger.info("Resultados de la búsqueda recuperados de la caché")
+        return hits
+
+    def _store_hits(self, cache_key: Tuple | None, hits: List[Any], seconds: float) -> None:
+        self._record_cache("search", False, seconds)
+        if cache_key is not None:
+            self._search_cache.put(cache_key, hits)
+
+    def _format_results(self, hits: List[Any], score: float) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], float]:
+        """
+        Convierte los resultados del backend al formato de salida de `search`.
+        """
+        # Resultados de la bnúsqueda semántica
+        # Resultados que pasan el filtro de score de relevancia
+        results_score_pass = [
+            {
+                "score": h.score,
+                "module": h.payload.get("module"),
+                "table": h.payload.get("table")
+            }
+            # Se itera sobre los resultados de la búsqueda y se filtra por score de relevancia
+            for h in hits if h.score > score
+        ]
+
+        # Resultados de la búsqueda semántica
+        # Resultados en bruto, sin filtrar por score de relevancia
+        results_score_raw = [
+            {
+                "score": h.score,
+                "module": h.payload.get("module"),
+                "table": h.payload.get("table")
+            }
+            # Se itera sobre los resultados de la búsqueda y se filtra por score de relevancia
+            for h in hits
+        ]
+
+        # Activa si interesa debuguear que está capturando en detalle.
+        #logger.info(f"Resultados de la búsqueda: {results_score_pass}")
+
+        logger.info(f"Búsqueda en Qdrant completada: {len(results_score_pass)} resultados encontrados")
+
+        # Retorna en orden:
+        # 1. Resultados que pasan el filtro de score de relevancia.
+        # 2. Resultados en bruto, sin filtrar por score de relevancia.
+        # 3. Score de relevancia usado para el filtro.
+        return results_score_pass, results_score_raw, score
+
     def search(self, query: str, limit: int | None = None, score: float = 0.50) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], float]:
         """
         Realiza búsqueda semántica en Qdrant.
@@ -133,61 +566,76 @@ class QdrantRetriever:
         - results_score_raw: (list) lista de diccionarios con los resultados en bruto, sin filtrar por score de relevancia.
         - score: (float) score de relevancia usado para el filtro.
         """
-        limit = limit or self.limit
         # Si nos interesa debuguear que query se está pasando a la búsqueda semántica.
         #logger.info(f"Query: query='{query}')
-        logger.info(f"Iniciando búsqueda semántica: limit={limit}, score={score}")
+        limit = self._start_search(limit, score)
 
         try:
-            # Generación del embedding de la query de contexto
-            query_vector = self._embed(query)
-
-            # Búsqueda en Qdrant
-            hits = self.client.search(
-                collection_name=self.collection,
-                query_vector=query_vector,
-                limit=limit,
-            )
-
-            # Resultados de la bnúsqueda semántica
-            # Resultados que pasan el filtro de score de relevancia
-            results_score_pass = [
-                {
-                    "score": h.score,
-                    "module": h.payload.get("module"),
-                    "table": h.payload.get("table")
-                }
-                # Se itera sobre los resultados de la búsqueda y se filtra por score de relevancia
-                for h in hits if h.score > score
-            ]
-            
-            # Resultados de la búsqueda semántica
-            # Resultados en bruto, sin filtrar por score de relevancia
-            results_score_raw = [
-                {
-                    "score": h.score,
-                    "module": h.payload.get("module"),
-                    "table": h.payload.get("table")
-                }
-                # Se itera sobre los resultados de la búsqueda y se filtra por score de relevancia
-                for h in hits
-            ]
-
-            # Activa si interesa debuguear que está capturando en detalle.
-            #logger.info(f"Resultados de la búsqueda: {results_score_pass}")
-            
-            logger.info(f"Búsqueda en Qdrant completada: {len(results_score_pass)} resultados encontrados")
-            
-            # Retorna en orden:
-            # 1. Resultados que pasan el filtro de score de relevancia.
-            # 2. Resultados en bruto, sin filtrar por score de relevancia.
-            # 3. Score de relevancia usado para el filtro.
-            return results_score_pass, results_score_raw, score
+            # Generación del embedding de la query de contexto (nivel 1 de caché)
+            query_vector = self.embed_query(query)
+            self._local.query_vector = query_vector
+
+            # Búsqueda en Qdrant (nivel 2 de caché). Con el índice NumPy la versión se comprueba también sin caché,
+            # es lo que lo recarga si cambia la colección
+            version = self.collection_version() if self.cache_enabled or self.index is not None else None
+            cache_key = (self._vector_hash(query_vector), limit, version) if self.cache_enabled else None
+            hits = self._cached_hits(cache_key)
+            if hits is None:
+                start = time.perf_counter()
+                hits = self._search_vector(query_vector, limit)
+                self._store_hits(cache_key, hits, time.perf_counter() - start)
+
+            return self._format_results(hits, score)
+
+        except Exception as exc:
+            logger.error(f"Error en búsqueda semántica: {str(exc)}")
+            return []
+
+    async def asearch(self, query: str, limit: int | None = None, score: float = 0.50) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], float]:
+        """
+        Variante asíncrona de `search`, mismos argumentos y mismo resultado.
+        La comprobación periódica de la versión de la colección se hace en un hilo aparte.
+        """
+        limit = self._start_search(limit, score)
+
+        try:
+            query_vector = await self.aembed_query(query)
+            self._local.query_vector = query_vector
+
+            version = None
+            if self.cache_enabled or self.index is not None:
+                version = await asyncio.to_thread(self.collection_version)
+            cache_key = (self._vector_hash(query_vector), limit, version) if self.cache_enabled else None
+            hits = self._cached_hits(cache_key)
+            if hits is None:
+                start = time.perf_counter()
+                hits = await self._asearch_vector(query_vector, limit)
+                self._store_hits(cache_key, hits, time.perf_counter() - start)
+
+            return self._format_results(hits, score)
 
         except Exception as exc:
             logger.error(f"Error en búsqueda semántica: {str(exc)}")
             return []
         
+    @property
+    def embedding_tokens(self) -> int | None:
+        """Tokens del último embedding generado en esta llamada (hilo o tarea asyncio)."""
+        return getattr(self._local, "embedding_tokens", None)
+
+    @embedding_tokens.setter
+    def embedding_tokens(self, value: int | None) -> None:
+        self._local.embedding_tokens = value
+
+    @property
+    def embedding_model_name(self) -> str | None:
+        """Modelo real del último embedding generado en esta llamada (hilo o tarea asyncio)."""
+        return getattr(self._local, "embedding_model_name", None)
+
+    @embedding_model_name.setter
+    def embedding_model_name(self, value: str | None) -> None:
+        self._local.embedding_model_name = value
+
     def get_embedding_tokens (self):
         """
         Devuelve el número de tokens usados para generar el embedding.
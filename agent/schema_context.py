@@ -0,0 +1,152 @@
+###############################################
+# schema_context.py
+###############################################
+# Notas:
+# Compilador del contexto de esquema para el prompt del generador de SQL.
+# El retriever devuelve por cada tabla su payload completo (descripciones bilingües, rangos,
+# valores frecuentes, enlaces, etc.) y la descripción del módulo se repite en cada tabla.
+# Aquí se convierte en un texto compacto tipo DDL, con el módulo una sola vez y
+# la información de cada columna en un comentario de una línea.
+#
+# Variables de entorno opcionales:
+# - SCHEMA_CONTEXT_FORMAT: COMPACT (por defecto) o RAW (el `repr` de los resultados, como antes).
+# - SCHEMA_CONTEXT_LANGUAGE: BOTH (por defecto), ENGLISH o SPANISH, idioma de las descripciones.
+# - SCHEMA_CONTEXT_FREQUENT_VALUES: número máximo de valores frecuentes por columna (por defecto 10, 0 para omitirlos).
+# - SCHEMA_CONTEXT_RANGES: YES (por defecto) o NO, incluir los rangos (mínimo y máximo) de las columnas.
+
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple
+
+from agent.utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+_LANGUAGE_KEYS = {
+    "ENGLISH": ["english"],
+    "SPANISH": ["spanish"],
+    "BOTH": ["english", "spanish"],
+}
+_LANGUAGE_LABELS = {"english": "EN", "spanish": "ES"}
+
+class SchemaContext(NamedTuple):
+    """
+    Contexto de esquema compilado:
+    - text: (str) texto para el prompt.
+    - tokens_raw: (int) tokens del contexto sin compilar (`repr` de los resultados del retriever).
+    - tokens: (int) tokens del texto compilado.
+    - format: (str) formato usado (COMPACT o RAW).
+    """
+    text: str
+    tokens_raw: int
+    tokens: int
+    format: str
+
+def _one_line(text: Any) -> str:
+    """
+    Colapsa saltos de línea y espacios, cada comentario debe ocupar una sola línea.
+    """
+    return " ".join(str(text).split())
+
+def _describe(description: Any, languages: List[str]) -> str:
+    """
+    Texto de una descripción bilingüe ({"english": ..., "spanish": ...}) en los idiomas pedidos.
+    """
+    if not isinstance(description, dict):
+        return _one_line(description or "")
+    texts = [_one_line(description[key]) for key in languages if description.get(key)]
+    if len(texts) > 1:
+        return " | ".join(f"{_LANGUAGE_LABELS[key]}: {text}" for key, text in zip(languages, texts))
+    return texts[0] if texts else ""
+
+def _column_line(field: Dict[str, Any], languages: List[str], frequent_values: int, ranges: bool, last: bool) -> str:
+    """
+    Una columna en formato DDL, con su descripción, rango y valores frecuentes como comentario.
+    """
+    ddl = f"{field['name']} {field.get('type', '')}".strip()
+    if field.get("is_pk"):
+        ddl += " PRIMARY KEY"
+    elif field.get("nullable") is False:
+        ddl += " NOT NULL"
+    for link in field.get("link_to") or []:
+        ddl += f" REFERENCES {link['schema']}.{link['table']}({link['column']})"
+
+    notes = []
+    description = _describe(field.get("description"), languages)
+    if description:
+        notes.append(description)
+
+    range_ = field.get("range") or {}
+    if ranges and isinstance(range_, dict) and range_.get("min") not in (None, "N/A"):
+        notes.append(f"range: {range_.get('min')} .. {range_.get('max')}")
+
+    values = [str(v.get("value", "")) for v in field.get("most_frequent_values") or []][:frequent_values]
+    if values:
+        distinct = (field.get("distinct_values") or [{}])[0].get("count")
+        prefix = f"frequent values ({distinct} distinct)" if distinct else "frequent values"
+        notes.append(f"{prefix}: {', '.join(_one_line(v) for v in values)}")
+
+    # La coma separadora va antes del comentario
+    ddl += "" if last else ","
+    return f"  {ddl}" + (f"  -- {' ; '.join(notes)}" if notes else "")
+
+def compile_schema_context(
+    results: List[Dict[str, Any]],
+    format: str | None = None,
+    language: str | None = None,
+    frequent_values: int | None = None,
+    ranges: bool | None = None,
+    model_name: str | None = None,
+) -> SchemaContext:
+    """
+    Compila los resultados del retriever (lista de {"score", "module", "table"}) para el prompt.
+    Los argumentos que no se indiquen se toman de las variables de entorno (ver notas del módulo).
+
+    Devuelve un `SchemaContext` con el texto y los tokens antes y después de compilar.
+    """
+    format = (format or os.getenv("SCHEMA_CONTEXT_FORMAT", "COMPACT")).upper()
+    language = (language or os.getenv("SCHEMA_CONTEXT_LANGUAGE", "BOTH")).upper()
+    if frequent_values is None:
+        frequent_values = int(os.getenv("SCHEMA_CONTEXT_FREQUENT_VALUES", 10))
+    if ranges is None:
+        ranges = os.getenv("SCHEMA_CONTEXT_RANGES", "YES").upper() == "YES"
+    languages = _LANGUAGE_KEYS.get(language)
+    if languages is None:
+        logger.warning(f"SCHEMA_CONTEXT_LANGUAGE no soportado: {language}, se usa BOTH")
+        languages = _LANGUAGE_KEYS["BOTH"]
+
+    raw_text = str(results)
+    tokens_raw = count_tokens(raw_text, model_name)
+    if format == "RAW":
+        return SchemaContext(raw_text, tokens_raw, tokens_raw, format)
+
+    lines: List[str] = []
+    seen_modules = set()
+    seen_tables = set()
+    for result in results:
+        module = result.get("module") or {}
+        table = result.get("table") or {}
+        schema_db = module.get("schema_db") or module.get("id", "")
+
+        # La descripción del módulo se repite en cada tabla, solo se escribe la primera vez.
+        if module.get("id") not in seen_modules:
+            seen_modules.add(module.get("id"))
+            lines.append(f"-- Module {module.get('id')} (schema {schema_db}): {_describe(module.get('description'), languages)}")
+
+        table_key = (schema_db, table.get("name"))
+        if table_key in seen_tables:
+            continue
+        seen_tables.add(table_key)
+
+        lines.append(f"-- {table.get('name')}: {_describe(table.get('definition'), languages)}")
+        purpose = _describe(table.get("purpose"), languages)
+        if purpose:
+            lines.append(f"-- Purpose: {purpose}")
+        fields = table.get("fields", [])
+        columns = [_column_line(field, languages, frequent_values, ranges, i == len(fields) - 1) for i, field in enumerate(fields)]
+        lines.append(f"CREATE TABLE {schema_db}.{table.get('name')} (\n" + "\n".join(columns) + "\n);")
+
+    text = "\n".join(lines)
+    tokens = count_tokens(text, model_name)
+    logger.info(f"Contexto de esquema compilado: {len(seen_tables)} tablas, {tokens_raw} -> {tokens} tokens")
+    return SchemaContext(text, tokens_raw, tokens, format)
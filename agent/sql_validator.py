@@ -0,0 +1,240 @@
+###############################################
+# sql_validator.py
+###############################################
+# Notas:
+# Validación local (sin LLM) del script SQL generado, contra el contexto de esquema recuperado.
+# Se usa entre las dos generaciones de la tool: si el primer script ya es válido,
+# la 2a generación (revisión con el LLM razonador) se puede omitir o sustituir por un formateo barato.
+#
+# Comprobaciones (dialecto PostgreSQL, con sqlglot):
+# 1. El script se puede parsear y es una única sentencia.
+# 2. Todas las tablas con esquema (`esquema.tabla`) existen en los payloads recuperados,
+#    y las tablas sin esquema son CTEs o tablas recuperadas.
+# 3. Todas las columnas referenciadas existen en su tabla (o en la salida del CTE / subconsulta).
+# 4. Las ramas de cada `UNION ALL` tienen el mismo número de columnas, con los mismos nombres y en el mismo orden.
+#
+# La validación es conservadora: lo que no se puede verificar se da por no válido,
+# y en ese caso se ejecuta la revisión completa como hasta ahora.
+
+import logging
+import re
+from typing import Any, Dict, List, NamedTuple, Set, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.scope import Scope, traverse_scope
+
+logger = logging.getLogger(__name__)
+
+class SQLValidationResult(NamedTuple):
+    """
+    Resultado de la validación:
+    - valid: (bool) si el script pasa todas las comprobaciones.
+    - errors: (list) descripción de cada problema encontrado.
+    """
+    valid: bool
+    errors: List[str]
+
+def strip_sql_fences(sql_script: str) -> str:
+    """
+    Quita el bloque markdown (```sql ... ```) si el LLM lo ha incluido.
+    """
+    match = re.search(r"```(?:sql)?\s*(.*?)```", sql_script, re.DOTALL | re.IGNORECASE)
+    return (match.group(1) if match else sql_script).strip()
+
+def _known_tables(results: List[Dict[str, Any]]) -> Dict[Tuple[str, str], List[str]]:
+    """
+    {(esquema, tabla): [columnas en orden]} a partir de los resultados del retriever (en minúsculas).
+    """
+    tables = {}
+    for result in results:
+        module = result.get("module") or {}
+        table = result.get("table") or {}
+        schema_db = (module.get("schema_db") or module.get("id") or "").lower()
+        if table.get("name"):
+            tables[(schema_db, table["name"].lower())] = [f["name"].lower() for f in table.get("fields", [])]
+    return tables
+
+class _Resolver:
+    """
+    Resuelve las columnas de salida (en orden) de tablas, CTEs y subconsultas, expandiendo `*`.
+    Devuelve None cuando no se pueden conocer.
+    """
+
+    def __init__(self, tree: exp.Expression, known: Dict[Tuple[str, str], List[str]]) -> None:
+        self.known = known
+        self.ctes = {cte.alias_or_name.lower(): cte.this for cte in tree.find_all(exp.CTE)}
+        self._resolving: Set[str] = set()
+
+    def table(self, table: exp.Table) -> List[str] | None:
+        name = table.name.lower()
+        schema_db = table.db.lower()
+        if schema_db:
+            return self.known.get((schema_db, name))
+        if name in self.ctes:
+            # Protección frente a CTEs recursivos
+            if name in self._resolving:
+                return None
+            self._resolving.add(name)
+            try:
+                return self.outputs(self.ctes[name])
+            finally:
+                self._resolving.discard(name)
+        matches = [columns for (_, table_name), columns in self.known.items() if table_name == name]
+        return matches[0] if len(matches) == 1 else None
+
+    def source(self, source: exp.Expression) -> List[str] | None:
+        if isinstance(source, exp.Table):
+            return self.table(source)
+        if isinstance(source, exp.Subquery):
+            return self.outputs(source.this)
+        return None
+
+    def outputs(self, expression: exp.Expression) -> List[str] | None:
+        if isinstance(expression, exp.Union):
+            return self.outputs(expression.left)
+        if isinstance(expression, (exp.Subquery, exp.Paren)):
+            return self.outputs(expression.this)
+        if not isinstance(expression, exp.Select):
+            return None
+
+        # Orígenes del SELECT en orden (FROM y JOINs) por alias
+        sources = []
+        from_ = expression.args.get("from")
+        if from_ is not None:
+            sources.append(from_.this)
+        sources.extend(join.this for join in expression.args.get("joins") or [])
+
+        names: List[str] = []
+        for projection in expression.expressions:
+            if isinstance(projection, exp.Star):
+                for source in sources:
+                    columns = self.source(source)
+                    if columns is None:
+                        return None
+                    names.extend(columns)
+            elif isinstance(projection, exp.Column) and isinstance(projection.this, exp.Star):
+                qualifier = projection.table.lower()
+                matched = [source for source in sources if source.alias_or_name.lower() == qualifier]
+                columns = self.source(matched[0]) if matched else None
+                if columns is None:
+                    return None
+                names.extend(columns)
+            else:
+                names.append(projection.alias_or_name.lower())
+        return names
+
+def _union_branches(union: exp.Union) -> List[exp.Expression]:
+    """
+    Ramas de una cadena de UNION (a UNION ALL b UNION ALL c ...), en orden.
+    """
+    branches = []
+    for side in (union.left, union.right):
+        if isinstance(side, exp.Union):
+            branches.extend(_union_branches(side))
+        else:
+            branches.append(side.unnest() if isinstance(side, exp.Paren) else side)
+    return branches
+
+def _check_unions(tree: exp.Expression, resolver: _Resolver, errors: List[str]) -> None:
+    unions = [u for u in tree.find_all(exp.Union) if not isinstance(u.parent, exp.Union)]
+    if not unions:
+        errors.append("El script no tiene ninguna operación UNION ALL")
+        return
+
+    for union in unions:
+        branches = _union_branches(union)
+        expected = None
+        for i, branch in enumerate(branches, start=1):
+            names = resolver.outputs(branch)
+            if names is None:
+                errors.append(f"Rama {i} del UNION ALL con `*` u otra estructura: columnas no verificables")
+                continue
+            if expected is None:
+                expected = names
+            elif names != expected:
+                errors.append(f"Rama {i} del UNION ALL con columnas distintas a la rama 1: {names} != {expected}")
+
+def _check_sources(tree: exp.Expression, resolver: _Resolver, errors: List[str]) -> None:
+    known_names = {name for _, name in resolver.known}
+
+    for table in tree.find_all(exp.Table):
+        name = table.name.lower()
+        schema_db = table.db.lower()
+        if schema_db:
+            if (schema_db, name) not in resolver.known:
+                errors.append(f"Tabla no encontrada en el contexto: {schema_db}.{name}")
+        elif name not in resolver.ctes and name not in known_names:
+            errors.append(f"Tabla sin esquema que no es un CTE ni una tabla del contexto: {name}")
+
+def _check_columns(tree: exp.Expression, resolver: _Resolver, errors: List[str]) -> None:
+    for scope in traverse_scope(tree):
+        # Columnas que ofrece cada origen del scope (alias -> columnas), None si no se conocen
+        source_columns: Dict[str, Set[str] | None] = {}
+        for alias, source in scope.sources.items():
+            if isinstance(source, exp.Table):
+                columns = resolver.table(source)
+            elif isinstance(source, Scope):
+                columns = resolver.outputs(source.expression)
+            else:
+                columns = None
+            source_columns[alias.lower()] = set(columns) if columns is not None else None
+
+        # Alias de la propia SELECT (se pueden usar en ORDER BY)
+        own_aliases = set()
+        if isinstance(scope.expression, exp.Select):
+            own_aliases = {p.alias.lower() for p in scope.expression.expressions if p.alias}
+
+        for column in scope.columns:
+            name = column.name.lower()
+            qualifier = column.table.lower()
+            if qualifier:
+                if qualifier not in source_columns:
+                    errors.append(f"Alias de tabla desconocido: {qualifier}.{name}")
+                    continue
+                columns = source_columns[qualifier]
+                if columns is None:
+                    errors.append(f"Columnas no verificables en el origen '{qualifier}' ({qualifier}.{name})")
+                elif name not in columns:
+                    errors.append(f"Columna no encontrada: {qualifier}.{name}")
+            else:
+                if name in own_aliases:
+                    continue
+                candidates = list(source_columns.values())
+                if any(columns is None for columns in candidates):
+                    errors.append(f"Columna '{name}' sin alias y con orígenes no verificables")
+                elif not any(name in columns for columns in candidates):
+                    errors.append(f"Columna no encontrada en ningún origen: {name}")
+
+def validate_sql(sql_script: str, results: List[Dict[str, Any]], dialect: str = "postgres") -> SQLValidationResult:
+    """
+    Valida el script SQL contra los resultados del retriever (lista de {"score", "module", "table"}).
+    """
+    sql = strip_sql_fences(sql_script)
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=dialect) if s is not None]
+    except SqlglotError as e:
+        return SQLValidationResult(False, [f"Error de sintaxis: {e}"])
+
+    if len(statements) != 1:
+        return SQLValidationResult(False, [f"Se esperaba una única sentencia SQL y hay {len(statements)}"])
+
+    tree = statements[0]
+    resolver = _Resolver(tree, _known_tables(results))
+    errors: List[str] = []
+    try:
+        _check_sources(tree, resolver, errors)
+        _check_columns(tree, resolver, errors)
+        _check_unions(tree, resolver, errors)
+    except Exception as e:
+        # Cualquier estructura que el validador no sepa recorrer se trata como no verificable
+        errors.append(f"Script no verificable: {e}")
+
+    # Sin duplicados y manteniendo el orden
+    errors = list(dict.fromkeys(errors))
+    if errors:
+        logger.info(f"Validación SQL local: {len(errors)} problemas, p. ej. {errors[0]}")
+    else:
+        logger.info("Validación SQL local superada")
+    return SQLValidationResult(not errors, errors)
@@ -6,20 +6,54 @@
 # Se ha preferido tener centralizada toda la funcionalidad en el módulo de tools para facilitar seguimiento.
 # También se han añadido puntos de control para capturar datos del comportamiento,
 # se activan si DATA_EXPERIMENT en .env está a 'YES'.
-# los logs de experimento se guardan en el fichero '<uuid>.json' en el directorio 'output'.
-
+# los logs de experimento se guardan en segundo plano en el fichero '<uuid>.json(.gz)' del directorio 'output'
+# (ver experiment_writer.py).
+#
+# La tool tiene dos implementaciones con los mismos pasos, prompts y puntos de control:
+# - `_search_and_generate_sql`: síncrona (AgentExecutor.invoke, Agent.chat).
+# - `_asearch_and_generate_sql`: asíncrona (AgentExecutor.ainvoke, Agent.achat), con los clientes
+#   asíncronos de OpenAI y Qdrant, para atender muchas sesiones concurrentes sin un hilo por llamada.
+# Los pasos comunes están en `_ToolRun`; cada implementación solo hace las llamadas a Qdrant y al LLM.
+#
+# Modo de la 2a generación (SQL_ENHANCE_MODE):
+# - FULL (por defecto): el revisor recibe el mismo contexto de esquema que el generador.
+# - DIFF: el revisor solo recibe las tablas que referencia el primer script.
+#
+# Validación local entre las dos generaciones (SQL_VALIDATION=YES por defecto, ver sql_validator.py):
+# si el primer script es válido contra el contexto recuperado, la revisión con el LLM razonador se sustituye
+# según SQL_VALIDATION_PASS_ACTION por:
+# - FORMAT (por defecto): un formateo barato (SQL_FORMAT_LLM_MODEL) que solo tabula y comenta el script.
+#   Si el resultado deja de ser válido, se devuelve el primer script.
+# - SKIP: se devuelve directamente el primer script.
+#
+# Caché semántica de respuestas (RESPONSE_CACHE=YES, ver response_cache.py): tras la búsqueda del retriever,
+# si una petición anterior con el mismo modelo, la misma versión de los prompts y la misma colección
+# es suficientemente similar, se devuelve su script SQL final sin llamar al LLM.
+#
+# Streaming: si hay un receptor de tokens activo (`stream_sql_tokens`, lo activa Agent.chat con `on_token`),
+# la 2a generación (la respuesta final que ve el usuario) se pide en streaming y cada fragmento
+# se entrega al receptor según llega.
+
+import asyncio
+import hashlib
 import logging
 import json
 import os
-from typing import List
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Tuple
 
 from dotenv import load_dotenv
 
-from langchain.tools import tool
-from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
+from langchain_core.tools import StructuredTool
 
-from agent.retriever import QdrantRetriever
+from agent.registry import get_format_llm, get_response_cache, get_retriever, get_sql_llm
+from agent.response_cache import CachedResponse, ResponseCache
+from agent.schema_context import SchemaContext, compile_schema_context
+from agent.sql_validator import SQLValidationResult, strip_sql_fences, validate_sql
 from agent.utils.logging_config import setup_logging
 from agent.experiment_log import Experiment, is_experiment_enabled
 
@@ -27,94 +61,25 @@ load_dotenv()
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# Receptor de los tokens del script SQL final de la llamada en curso (por hilo / tarea asyncio)
+_sql_token_sink: ContextVar[Callable[[str], None] | None] = ContextVar("sql_token_sink", default=None)
 
-# Tool: Busca en Qdrant el contexto relevante (RAG) y genera SQL en una sola llamada
-@tool(
-    name_or_callable="search_and_generate_sql",
-    # Devuelve el resultado directamente, sin usar el LLM del agente (El agente debe terminar ahí.)
-    return_direct=True,
-    description="""
-    Recibe como entrada el informe completo de necesidad del usuario 
-    Con esta tool buscará el contexto relevante en la base de datos de datos corporativa.
-    Posteriormente generará directamente un script SQL.
+@contextmanager
+def stream_sql_tokens(on_token: Callable[[str], None] | None) -> Iterator[None]:
     """
-)
-def search_and_generate_sql(user_needs: str) -> dict:
-    """Recupera contexto del esquema + genera SQL en una sola llamada."""
-    
-    ##################################################
-    # Punto 1 control de experimento: Inicio Tool.
-    experiment = None
-    if is_experiment_enabled():
-        try:
-            experiment = Experiment(user_needs)
-        except Exception as e:
-            logger.warning(f"Fallo en experiment.add_retriever_start: {e}")
-    ##################################################
-
-    # Configuración LLM
-    provider = os.getenv("SQL_LLM_PROVIDER", "OPENAI").upper()
-    model = os.getenv("SQL_LLM_MODEL", "gpt-4o-mini")
-    temperature = float(os.getenv("SQL_LLM_TEMPERATURE", 1))
-
-    if provider == "OPENAI":
-        llm = ChatOpenAI(model=model, temperature=temperature)
-    else:
-        return {"error": f"Proveedor LLM todavía no soportado: {provider}"}
-
-    ##################################################
-    # Punto 2 control de experimento: Inicio recuperación RAG
-    if experiment:
-        try:
-            experiment.add_retriever_start()
-        except Exception as e:
-            logger.warning(f"Fallo en experiment.add_retriever_start: {e}")
-    ##################################################
-
-    # Recuperar contexto de Qdrant (RAG)
-    retriever = QdrantRetriever()
-    # Se capturan resultados que pasan el score, los resultados en bruto y el score límite que aplicó
-    results_score_pass, results_score_raw, score_limit = retriever.search(query=user_needs)
-
-    ##################################################
-    # Punto 3 control de experimento: Fin recuperación RAG
-    
-    if experiment:
-        try:
-            experiment.add_retriever_finish(
-                result_pass=results_score_pass,  # Resultado que pasa el filtro.
-                result_raw=results_score_raw,  # Scores limite para pasar el filtro.
-                score_limit=score_limit,
-                embedding_model=retriever.embedding_model_name, # no confundir con .embedding_model
-                embedding_tokens=retriever.get_embedding_tokens()
-            )
-        except Exception as e:
-            logger.warning(f"Fallo en experiment.add_retriever_finish: {e}")
-    ##################################################
-
-    # Si no hay resultados que pasen el filtro, devolvemos error.
-    if not results_score_pass:
-        return {
-            "error": "No se encontró información relevante en el esquema.",
-            "context": "",
-            "prompt": "",
-            "sql_script": ""
-        }
-
-    # El resultado de la técnica RAG, es nuestra parte del prompt de contexto de esquema.
-    # Se hace este paso, redundante por si en el futuro se cree interesante
-    # aplicar aquí algún tipo de preprocesado de los resultados de RAG.
-    schema_context = results_score_pass
-
-    # Parte del prompt con el resumen de las necesidades del usuario.
-    # Este resumen de necesidad, es generado por el LLM del agente, después
-    # de lanzarle las preguntas metodológicas al usuario.
-    user_summary = f"Consulta del usuario: {user_needs}"
+    Activa el streaming del script SQL final dentro del bloque: `on_token` recibe cada fragmento de texto.
+    Con `on_token=None` no cambia nada.
+    """
+    token = _sql_token_sink.set(on_token)
+    try:
+        yield
+    finally:
+        _sql_token_sink.reset(token)
 
-    # Prompt para la generación de un Log de Eventos Hospitalarios (SQL)
-    # Aquí describe la parte del prompt que regula el formato del script SQL a generar.
-    script_sql_format = (
-        """
+# Prompt para la generación de un Log de Eventos Hospitalarios (SQL)
+# Aquí describe la parte del prompt que regula el formato del script SQL a generar.
+SCRIPT_SQL_FORMAT = (
+    """
         # Tu tarea principal es: Generación de un **Log de Eventos Hospitalarios** en formato de script SQL compatible con el dialecto PostgreSQL,
           siguiendo las reglas siguientes:
 
@@ -178,69 +143,60 @@ def search_and_generate_sql(user_needs: str) -> dict:
         | 12345         | 21231         | 2025-04-19T09:25:00 | Alta       | NULL                | B34.9               | … |,
 
         """
-    )
+)
 
-    # Se genera el prompt final a partir de las 3 partes anteriores.
-    # Este prompt contiene necesidad del usuario, contexto de la base de datos y formato del script SQL.
-    prompt_sql_generator = f"""
-            Eres un experto en SQL hospitalario. Genera un log de eventos en formato SQL según las reglas siguientes.
+# Orden de los prompts (pensado para la caché de prompts del proveedor, que reutiliza el prefijo común más largo):
+# 1. Prefijo estático, idéntico en las dos etapas y en todas las peticiones: rol y reglas del formato SQL.
+# 2. Contexto de la petición: necesidades del usuario y contexto del esquema (común a las dos etapas en modo FULL).
+# 3. Tarea de cada etapa: generación, o script generado + revisión.
+SQL_PROMPT_PREFIX = f"""
+            Eres un experto en SQL hospitalario. Trabajas en dos etapas: generación de un log de eventos en formato SQL y revisión del script SQL generado, según las reglas siguientes.
 
+            # Reglas del formato SQL:
+            {SCRIPT_SQL_FORMAT}
+            """
+
+def _build_request_context(user_needs: str, schema_context: str) -> str:
+    """
+    Parte del prompt propia de cada petición: necesidades del usuario y contexto del esquema.
+    """
+    # Parte del prompt con el resumen de las necesidades del usuario.
+    # Este resumen de necesidad, es generado por el LLM del agente, después
+    # de lanzarle las preguntas metodológicas al usuario.
+    user_summary = f"Consulta del usuario: {user_needs}"
+
+    return f"""
             # Necesidades del usuario:
             {user_summary}
 
             # Contexto del esquema:
             {schema_context}
-
-            # Reglas del formato SQL:
-            {script_sql_format}
             """
 
-    # Se intenta lanzar la primera invocación del LLM para generar el script SQL.
-    try:
-        
-        ##################################################
-        # Punto 4 control de experimento: Inicio 1a generación SQL
-
-        if experiment:
-            try:
-                experiment.add_sql_generator_start()
-            except Exception as e:
-                logger.warning(f"Fallo en experiment.add_sql_generator_start: {e}")
-        ##################################################
-        
-        # 1a Generación del Script SQL con modelo LLM
-        response = llm.invoke(prompt_sql_generator)
-
-        #logger.info(json.dumps(response.response_metadata, indent=2, ensure_ascii=False))
-        sql_script = response.content.strip()
-        
-        ##################################################
-        # Punto 5 control de experimento: Fin 1a generación SQL
-        if experiment:
-            try:
-                experiment.add_sql_generator_finish(
-                    prompt=prompt_sql_generator, 
-                    sql_script=sql_script, 
-                    metadata_llm=response.response_metadata
-                    )
-            except Exception as e:
-                logger.warning(f"Fallo en experiment.add_sql_generator_finish: {e}")
-
-        # Se genera el prompt para la 2a generación del Script SQL,
-        # que tiene como objetivo, mejorar el resultado de la primera generación.
-        prompt_enhance_sql = f"""
-            Eres un experto en SQL. Revisa el script SQL generado en dialecto PostgreSQL y realiza las correcciones necesarias.
-
-            # Bloque de contexto de necesidades del usuario, conocimientos de la base de datos corporativa y formato del script SQL:
+def _build_sql_generator_prompt(user_needs: str, schema_context: str) -> str:
+    """
+    Prompt de la 1a generación: formato del script SQL, necesidad del usuario y contexto de la base de datos.
+    """
+    return SQL_PROMPT_PREFIX + _build_request_context(user_needs, schema_context) + """
+            # Objetivo
             #################################
-            {prompt_sql_generator}
+            Genera un log de eventos en formato SQL para las necesidades del usuario, según el contexto del esquema y las reglas del formato SQL.
+            """
 
+def _build_enhance_sql_prompt(user_needs: str, schema_context: str, sql_script: str) -> str:
+    """
+    Prompt de la 2a generación, que tiene como objetivo mejorar el resultado de la primera.
+    Empieza igual que el de la 1a generación (en modo FULL), solo cambia lo que va detrás del contexto.
+    """
+    return SQL_PROMPT_PREFIX + _build_request_context(user_needs, schema_context) + f"""
             # Script SQL generado para satisfacer las necesidades del usuario:
             #################################
             {sql_script}
 
             # Objetivo
             #################################
+            Eres un experto en SQL. Revisa el script SQL generado en dialecto PostgreSQL y realiza las correcciones necesarias.
+
             En base a:
             - las necesidades del usuario.
             - conocimiento de la base de datos corporativa.
@@ -267,41 +223,530 @@ def search_and_generate_sql(user_needs: str) -> dict:
             #################################
             - Script SQL corregido y mejorado.
             """
-        
-        # Se lanza la 2a Generación del Script SQL para la búsqueda de errores, inconsistencias y mejoras de formato.
-        if experiment:
-            try:
-                experiment.add_sql_enhanced_start()
-            except Exception as e:
-                logger.warning(f"Fallo en experiment.add_sql_enhanced_start: {e}")
-        
-        response_enhanced = llm.invoke(prompt_enhance_sql)
-        sql_script_enhanced = response_enhanced.content.strip()
-        #logger.info(json.dumps(response_enhanced.response_metadata, indent=2, ensure_ascii=False))
-        
-        if experiment:
-            try:
-                experiment.add_sql_enhanced_finish(
-                    prompt=prompt_enhance_sql,
-                    sql_script=sql_script_enhanced,
-                    metadata_llm=response_enhanced.response_metadata
-                    )
-                experiment.finish()
-
-            except Exception as e:
-                logger.warning(f"Fallo en experiment.add_sql_enhanced_finish: {e}")
-        
+
+def _track(experiment: Experiment | None, step: str, **kwargs: Any) -> None:
+    """
+    Lanza un punto de control del experimento (si está activo), sin interrumpir la tool si falla.
+    """
+    if experiment:
+        try:
+            getattr(experiment, step)(**kwargs)
+        except Exception as e:
+            logger.warning(f"Fallo en experiment.{step}: {e}")
+
+def _llm_metadata(response) -> Dict[str, Any]:
+    """
+    Metadata de la respuesta del LLM en el formato que espera el experimento.
+    En streaming OpenAI no devuelve `token_usage`, se reconstruye a partir de `usage_metadata`.
+    """
+    metadata = dict(response.response_metadata or {})
+    usage = getattr(response, "usage_metadata", None)
+    if "token_usage" not in metadata and usage:
+        metadata["token_usage"] = {
+            "prompt_tokens": usage.get("input_tokens", 0),
+            "completion_tokens": usage.get("output_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+            # Tokens del prompt servidos desde la caché de prompts del proveedor
+            "prompt_tokens_details": {"cached_tokens": (usage.get("input_token_details") or {}).get("cache_read", 0)},
+        }
+    return metadata
+
+def _stream_enhanced(llm, prompt: str, sink: Callable[[str], None], experiment: Experiment | None):
+    """
+    2a generación en streaming: entrega cada fragmento al receptor y devuelve el mensaje agregado.
+    """
+    message = None
+    for chunk in llm.stream(prompt, stream_usage=True):
+        if chunk.content:
+            if message is None or not message.content:
+                _track(experiment, "add_sql_enhanced_first_token")
+            sink(chunk.content)
+        message = chunk if message is None else message + chunk
+    return message
+
+async def _astream_enhanced(llm, prompt: str, sink: Callable[[str], None], experiment: Experiment | None):
+    """
+    Variante asíncrona de `_stream_enhanced`.
+    """
+    message = None
+    async for chunk in llm.astream(prompt, stream_usage=True):
+        if chunk.content:
+            if message is None or not message.content:
+                _track(experiment, "add_sql_enhanced_first_token")
+            sink(chunk.content)
+        message = chunk if message is None else message + chunk
+    return message
+
+def _compile_schema_context(results_score_pass: List[Dict[str, Any]], experiment: Experiment | None) -> SchemaContext:
+    """
+    El resultado de la técnica RAG es nuestra parte del prompt de contexto de esquema.
+    Se compila a un formato compacto tipo DDL (ver schema_context.py) y se registran los tokens antes y después.
+    """
+    schema_context = compile_schema_context(results_score_pass, model_name=os.getenv("SQL_LLM_MODEL", "gpt-4o-mini"))
+    _track(experiment, "add_schema_context", tokens_raw=schema_context.tokens_raw, tokens=schema_context.tokens, format=schema_context.format)
+    return schema_context
+
+def _referenced_results(results_score_pass: List[Dict[str, Any]], sql_script: str) -> List[Dict[str, Any]]:
+    """
+    Resultados del retriever cuyas tablas aparecen en el script SQL
+    (`esquema.tabla`, con o sin comillas, o `FROM/JOIN tabla`).
+    """
+    referenced = []
+    for result in results_score_pass:
+        module = result.get("module") or {}
+        name = (result.get("table") or {}).get("name")
+        schema_db = module.get("schema_db") or module.get("id", "")
+        if not name:
+            continue
+        pattern = (
+            rf'"?\b{re.escape(schema_db)}\b"?\s*\.\s*"?\b{re.escape(name)}\b'
+            rf'|\b(?:FROM|JOIN)\s+"?{re.escape(name)}\b'
+        )
+        if re.search(pattern, sql_script, re.IGNORECASE):
+            referenced.append(result)
+    return referenced
+
+def _enhance_schema_context(
+    results_score_pass: List[Dict[str, Any]],
+    schema_context: SchemaContext,
+    sql_script: str,
+    experiment: Experiment | None,
+) -> str:
+    """
+    Contexto de esquema para la 2a generación según SQL_ENHANCE_MODE (ver notas del módulo).
+    En modo DIFF, si no se reconoce ninguna tabla en el primer script, se envía el contexto completo.
+    """
+    mode = os.getenv("SQL_ENHANCE_MODE", "FULL").upper()
+    text, tokens = schema_context.text, schema_context.tokens
+
+    if mode == "DIFF":
+        referenced = _referenced_results(results_score_pass, sql_script)
+        if referenced and len(referenced) < len(results_score_pass):
+            reduced = compile_schema_context(referenced, model_name=os.getenv("SQL_LLM_MODEL", "gpt-4o-mini"))
+            text, tokens = reduced.text, reduced.tokens
+            logger.info(f"Revisión en modo DIFF: {len(referenced)}/{len(results_score_pass)} tablas en el contexto")
+
+    _track(experiment, "add_sql_enhance_context", mode=mode, tokens_full=schema_context.tokens, tokens=tokens)
+    return text
+
+def _build_format_sql_prompt(schema_context: str, sql_script: str) -> str:
+    """
+    Prompt del formateo barato de un script ya validado (sustituye a la revisión completa).
+    """
+    return f"""
+            Eres un experto en SQL. El script SQL siguiente ya ha sido validado: NO cambies su lógica, tablas, columnas, alias, filtros ni el orden de las columnas.
+
+            # Contexto del esquema:
+            {schema_context}
+
+            # Script SQL validado:
+            #################################
+            {sql_script}
+
+            # Objetivo
+            #################################
+            - Tabula el script SQL para facilitar la lectura de los bloques `CTE` y las operaciones `CAST`.
+            - Comenta todos los bloques de eventos según el contexto de la base de datos.
+            - Comenta los campos individuales que lo componen, según el contexto de la base de datos (unidad, significado, etc.).
+            - Usa comentarios de línea (`--`), no de bloque (`/**/`).
+
+            # Output:
+            #################################
+            - Únicamente el script SQL comentado.
+            """
+
+class _StageTwo(NamedTuple):
+    """
+    Plan de la 2a generación:
+    - action: ENHANCE (revisión completa), FORMAT (formateo barato) o SKIP (sin llamada al LLM).
+    - llm / prompt: LLM y prompt de la llamada (None y "" en SKIP).
+    - validation: resultado de la validación local (None si está desactivada).
+    - validation_seconds: tiempo de la validación local.
+    """
+    action: str
+    llm: Any
+    prompt: str
+    validation: SQLValidationResult | None
+    validation_seconds: float
+
+# Estadísticas del proceso de la 2a generación, para la tasa de omisión y el tiempo ahorrado.
+_stage_two_lock = threading.Lock()
+_stage_two_stats = {"runs": 0, "skipped": 0, "avg_enhance_seconds": None}
+
+def _plan_stage_two(
+    user_needs: str,
+    results_score_pass: List[Dict[str, Any]],
+    schema_context: SchemaContext,
+    sql_script: str,
+    llm,
+    experiment: Experiment | None,
+) -> _StageTwo:
+    """
+    Valida el primer script y decide la 2a generación (ver notas del módulo).
+    """
+    validation = None
+    validation_seconds = 0.0
+    if os.getenv("SQL_VALIDATION", "YES").upper() == "YES":
+        start = time.perf_counter()
+        validation = validate_sql(sql_script, results_score_pass)
+        validation_seconds = time.perf_counter() - start
+
+    if validation is not None and validation.valid:
+        action = os.getenv("SQL_VALIDATION_PASS_ACTION", "FORMAT").upper()
+        if action == "SKIP":
+            return _StageTwo("SKIP", None, "", validation, validation_seconds)
+        # Solo las tablas del script, sin valores frecuentes ni rangos: el formateo no los necesita
+        referenced = _referenced_results(results_score_pass, sql_script) or results_score_pass
+        context = compile_schema_context(referenced, frequent_values=0, ranges=False).text
+        return _StageTwo("FORMAT", get_format_llm(), _build_format_sql_prompt(context, strip_sql_fences(sql_script)), validation, validation_seconds)
+
+    enhance_context = _enhance_schema_context(results_score_pass, schema_context, sql_script, experiment)
+    prompt_enhance_sql = _build_enhance_sql_prompt(user_needs, enhance_context, sql_script)
+    return _StageTwo("ENHANCE", llm, prompt_enhance_sql, validation, validation_seconds)
+
+def _finish_stage_two(
+    stage: _StageTwo,
+    results_score_pass: List[Dict[str, Any]],
+    sql_script: str,
+    sql_script_enhanced: str,
+    seconds: float,
+    experiment: Experiment | None,
+) -> str:
+    """
+    Cierra la 2a generación: comprueba el formateo, actualiza las estadísticas y las registra en el experimento.
+    Devuelve el script SQL final.
+    """
+    if stage.action == "FORMAT" and not validate_sql(sql_script_enhanced, results_score_pass).valid:
+        logger.warning("El formateo ha alterado el script validado, se devuelve el primer script")
+        sql_script_enhanced = strip_sql_fences(sql_script)
+
+    with _stage_two_lock:
+        _stage_two_stats["runs"] += 1
+        avg = _stage_two_stats["avg_enhance_seconds"]
+        if stage.action == "ENHANCE":
+            _stage_two_stats["avg_enhance_seconds"] = seconds if avg is None else 0.8 * avg + 0.2 * seconds
+            saved = 0.0
+        else:
+            _stage_two_stats["skipped"] += 1
+            # Se estima con la duración media de las revisiones completas de este proceso
+            saved = max(avg - seconds, 0.0) if avg is not None else 0.0
+        skip_rate = _stage_two_stats["skipped"] / _stage_two_stats["runs"]
+
+    _track(
+        experiment, "add_sql_validation",
+        valid=stage.validation.valid if stage.validation else None,
+        errors=stage.validation.errors if stage.validation else [],
+        action=stage.action,
+        seconds=stage.validation_seconds,
+        saved_seconds=saved,
+        skip_rate=skip_rate,
+    )
+    return sql_script_enhanced
+
+def _skip_stage_two(sql_script: str, sink: Callable[[str], None] | None, experiment: Experiment | None) -> Tuple[str, Dict[str, Any]]:
+    """
+    2a generación omitida: el script final es el primero (se entrega de una vez si hay streaming).
+    """
+    sql_script_enhanced = strip_sql_fences(sql_script)
+    if sink is not None:
+        _track(experiment, "add_sql_enhanced_first_token")
+        sink(sql_script_enhanced)
+    return sql_script_enhanced, {}
+
+# Variables de entorno que cambian los prompts o el script final, forman parte de la versión de los prompts.
+_PROMPT_OPTIONS = (
+    "SCHEMA_CONTEXT_FORMAT", "SCHEMA_CONTEXT_LANGUAGE", "SCHEMA_CONTEXT_FREQUENT_VALUES", "SCHEMA_CONTEXT_RANGES",
+    "SQL_ENHANCE_MODE", "SQL_VALIDATION", "SQL_VALIDATION_PASS_ACTION", "SQL_FORMAT_LLM_MODEL",
+)
+
+def prompt_version() -> str:
+    """
+    Versión de los prompts de la tool: hash de las plantillas (con marcadores en lugar de los datos)
+    y de las opciones que las modifican. Cambia sola al editar cualquier prompt.
+    """
+    templates = "".join([
+        _build_sql_generator_prompt("{user_needs}", "{schema_context}"),
+        _build_enhance_sql_prompt("{user_needs}", "{schema_context}", "{sql_script}"),
+        _build_format_sql_prompt("{schema_context}", "{sql_script}"),
+        *(f"{name}={os.getenv(name, '')}" for name in _PROMPT_OPTIONS),
+    ])
+    return hashlib.sha256(templates.encode("utf-8")).hexdigest()[:16]
+
+class _ResponseLookup(NamedTuple):
+    """
+    Consulta a la caché de respuestas: datos para servir la respuesta o guardarla al terminar.
+    """
+    cache: ResponseCache
+    key: Tuple
+    vector: List[float] | None
+    version: Any
+    hit: CachedResponse | None
+
+def _lookup_response(cache: ResponseCache, retriever, llm, version: Any, experiment: Experiment | None) -> _ResponseLookup:
+    """
+    Busca en la caché de respuestas con el embedding de la última búsqueda del retriever.
+    """
+    key = (
+        os.getenv("SQL_LLM_PROVIDER", "OPENAI").upper(),
+        getattr(llm, "model_name", None),
+        getattr(llm, "temperature", None),
+        retriever.embedding_model,
+        prompt_version(),
+    )
+    vector = retriever.last_query_vector() if cache.enabled else None
+    hit = cache.get(vector, key, version) if vector is not None else None
+    if cache.enabled:
+        _track(
+            experiment, "add_response_cache",
+            hit=hit is not None,
+            similarity=hit.similarity if hit else None,
+            hit_rate=cache.stats()["hit_rate"],
+        )
+    return _ResponseLookup(cache, key, vector, version, hit)
+
+def _serve_cached_response(hit: CachedResponse, experiment: Experiment | None) -> str:
+    """
+    Devuelve el script de la caché como respuesta final de la tool (sin llamadas al LLM).
+    """
+    _track(experiment, "add_sql_enhanced_start")
+    sink = _sql_token_sink.get()
+    if sink is not None:
+        _track(experiment, "add_sql_enhanced_first_token")
+        sink(hit.sql_script)
+    _track(experiment, "add_sql_enhanced_finish", prompt="", sql_script=hit.sql_script, metadata_llm={})
+    _track(experiment, "finish")
+    return f"```sql\n{hit.sql_script}\n```"
+
+def _store_response(lookup: _ResponseLookup, user_needs: str, sql_script_enhanced: str) -> None:
+    if lookup.vector is not None:
+        lookup.cache.put(lookup.vector, lookup.key, lookup.version, user_needs, sql_script_enhanced)
+
+def _start_experiment(user_needs: str) -> Experiment | None:
+    ##################################################
+    # Punto 1 control de experimento: Inicio Tool.
+    if is_experiment_enabled():
+        try:
+            return Experiment(user_needs)
+        except Exception as e:
+            logger.warning(f"Fallo al crear el experimento: {e}")
+    return None
+
+def _track_retriever_finish(experiment: Experiment | None, retriever, results_score_pass, results_score_raw, score_limit) -> None:
+    ##################################################
+    # Punto 3 control de experimento: Fin recuperación RAG
+    _track(
+        experiment, "add_retriever_finish",
+        result_pass=results_score_pass,  # Resultado que pasa el filtro.
+        result_raw=results_score_raw,  # Scores limite para pasar el filtro.
+        score_limit=score_limit,
+        embedding_model=retriever.embedding_model_name, # no confundir con .embedding_model
+        embedding_tokens=retriever.get_embedding_tokens(),
+        cache_info=retriever.last_cache_info()
+    )
+
+# Si no hay resultados que pasen el filtro, devolvemos error.
+NO_CONTEXT_RESPONSE = {
+    "error": "No se encontró información relevante en el esquema.",
+    "context": "",
+    "prompt": "",
+    "sql_script": ""
+}
+
+def _error_response(exc: Exception, experiment: Experiment | None, schema_context: str, prompt_sql_generator: str) -> dict:
+    # Si hay algún error, se captura y se devuelve un error de fallo en la generación del script SQL.
+    logger.error(f"Fallo en la generación del script SQL: {exc}")
+    if experiment:
+        experiment.finish()
+    return {
+        "error": str(exc),
+        "context": schema_context,
+        "prompt": prompt_sql_generator,
+        "sql_script": "[ERROR]",
+    }
+
+class _ToolRun:
+    """
+    Pasos de una invocación de la tool comunes a la variante síncrona y a la asíncrona: puntos de control del
+    experimento, contexto de esquema, prompts, caché de respuestas, validación y 2a generación.
+    Las variantes solo hacen, entre paso y paso, las llamadas de E/S: búsqueda en el retriever, versión de la
+    colección y llamadas al LLM (síncronas o con `await`).
+    """
+
+    def __init__(self, user_needs: str) -> None:
+        self.user_needs = user_needs
+        self.experiment = _start_experiment(user_needs)
+        self.schema_context: SchemaContext | None = None
+        self.prompt_sql_generator = ""
+        self.sql_script = ""
+        self.stage: _StageTwo | None = None
+        self.sink: Callable[[str], None] | None = None
+        self._stage_two_start = 0.0
+
+    def setup(self) -> dict | None:
+        """
+        LLM, retriever y caché de respuestas (se comparten entre invocaciones, ver registry.py).
+        Devuelve la respuesta de error si no se puede crear el LLM.
+        """
+        # Configuración LLM
+        # El LLM se comparte entre invocaciones (ver registry.py), solo se crea la primera vez.
+        try:
+            self.llm = get_sql_llm()
+        except ValueError as e:
+            return {"error": str(e)}
+
+        # Punto 2 control de experimento: Inicio recuperación RAG
+        _track(self.experiment, "add_retriever_start")
+
+        # El retriever (clientes de Qdrant y OpenAI) se comparte entre invocaciones y sesiones.
+        self.retriever = get_retriever()
+        self.response_cache = get_response_cache()
+        return None
+
+    def retrieved(self, search_results) -> dict | None:
+        """
+        Registra la búsqueda del retriever. Devuelve la respuesta de error si no hay resultados que pasen el filtro.
+        """
+        # Se capturan resultados que pasan el filtro, los resultados en bruto y el score límite que aplicó
+        self.results_score_pass, results_score_raw, score_limit = search_results
+        _track_retriever_finish(self.experiment, self.retriever, self.results_score_pass, results_score_raw, score_limit)
+        if not self.results_score_pass:
+            return dict(NO_CONTEXT_RESPONSE)
+        return None
+
+    def cached_response(self, version: Any) -> str | None:
+        """
+        Caché semántica de respuestas: una petición anterior equivalente evita las dos generaciones.
+        Si no hay respuesta en caché, prepara el prompt de la 1a generación y devuelve None.
+        """
+        self.lookup = _lookup_response(self.response_cache, self.retriever, self.llm, version, self.experiment)
+        if self.lookup.hit is not None:
+            return _serve_cached_response(self.lookup.hit, self.experiment)
+
+        # El resultado de la técnica RAG, compilado, es nuestra parte del prompt de contexto de esquema.
+        self.schema_context = _compile_schema_context(self.results_score_pass, self.experiment)
+        self.prompt_sql_generator = _build_sql_generator_prompt(self.user_needs, self.schema_context.text)
+        return None
+
+    def start_generation(self) -> str:
+        """
+        Devuelve el prompt de la 1a generación.
+        """
+        # Punto 4 control de experimento: Inicio 1a generación SQL
+        _track(self.experiment, "add_sql_generator_start")
+        return self.prompt_sql_generator
+
+    def plan_stage_two(self, response) -> _StageTwo:
+        """
+        Registra la 1a generación y decide la 2a (revisión completa, formateo barato o nada).
+        """
+        self.sql_script = response.content.strip()
+
+        # Punto 5 control de experimento: Fin 1a generación SQL
+        _track(self.experiment, "add_sql_generator_finish", prompt=self.prompt_sql_generator, sql_script=self.sql_script, metadata_llm=response.response_metadata)
+
+        # Validación local del primer script: decide si hace falta la revisión completa.
+        self.stage = _plan_stage_two(self.user_needs, self.results_score_pass, self.schema_context, self.sql_script, self.llm, self.experiment)
+
+        # Se lanza la 2a Generación del Script SQL para la búsqueda de errores, inconsistencias y mejoras de formato
+        # (o el formateo barato, o nada, si el primer script ya es válido).
+        _track(self.experiment, "add_sql_enhanced_start")
+        self._stage_two_start = time.perf_counter()
+
+        # Si hay receptor de tokens, el script final se entrega en streaming según se genera.
+        self.sink = _sql_token_sink.get()
+        return self.stage
+
+    def finish(self, response_enhanced=None) -> str:
+        """
+        Cierra la invocación con la respuesta de la 2a generación (None si se ha omitido) y devuelve el script final.
+        """
+        if response_enhanced is None:
+            sql_script_enhanced, metadata_enhanced = _skip_stage_two(self.sql_script, self.sink, self.experiment)
+        else:
+            sql_script_enhanced = response_enhanced.content.strip()
+            metadata_enhanced = _llm_metadata(response_enhanced)
+
+        seconds = time.perf_counter() - self._stage_two_start
+        sql_script_enhanced = _finish_stage_two(self.stage, self.results_score_pass, self.sql_script, sql_script_enhanced, seconds, self.experiment)
+        _track(self.experiment, "add_sql_enhanced_finish", prompt=self.stage.prompt, sql_script=sql_script_enhanced, metadata_llm=metadata_enhanced)
+        _track(self.experiment, "finish")
+        _store_response(self.lookup, self.user_needs, sql_script_enhanced)
+
         # Se devuelve el script SQL mejorado.
         return  f"```sql\n{sql_script_enhanced}\n```"
 
-    # Si hay algún error, se captura y se devuelve un error de fallo en la generación del script SQL.
+    def error(self, exc: Exception) -> dict:
+        return _error_response(exc, self.experiment, self.schema_context.text, self.prompt_sql_generator)
+
+def _search_and_generate_sql(user_needs: str) -> dict:
+    """Recupera contexto del esquema + genera SQL en una sola llamada."""
+    run = _ToolRun(user_needs)
+    error = run.setup()
+    if error is not None:
+        return error
+
+    # Recuperar contexto de Qdrant (RAG)
+    no_context = run.retrieved(run.retriever.search(query=user_needs))
+    if no_context is not None:
+        return no_context
+
+    version = run.retriever.collection_version() if run.response_cache.enabled else None
+    cached = run.cached_response(version)
+    if cached is not None:
+        return cached
+
+    # Se intenta lanzar la primera invocación del LLM para generar el script SQL.
+    try:
+        # 1a Generación del Script SQL con modelo LLM
+        stage = run.plan_stage_two(run.llm.invoke(run.start_generation()))
+        if stage.llm is None:
+            return run.finish()
+        # 2a Generación (en streaming si hay receptor de tokens)
+        if run.sink is not None:
+            return run.finish(_stream_enhanced(stage.llm, stage.prompt, run.sink, run.experiment))
+        return run.finish(stage.llm.invoke(stage.prompt))
+
     except Exception as exc:
-        logger.error(f"Fallo en la generación del script SQL: {exc}")
-        if experiment:
-            experiment.finish()
-        return {
-            "error": str(exc),
-            "context": schema_context,
-            "prompt": prompt_sql_generator,
-            "sql_script": "[ERROR]",
-        }
\ No newline at end of file
+        return run.error(exc)
+
+async def _asearch_and_generate_sql(user_needs: str) -> dict:
+    """Variante asíncrona de la tool: mismos pasos (ver _ToolRun), con `asearch` y `ainvoke`."""
+    run = _ToolRun(user_needs)
+    error = run.setup()
+    if error is not None:
+        return error
+
+    no_context = run.retrieved(await run.retriever.asearch(query=user_needs))
+    if no_context is not None:
+        return no_context
+
+    version = await asyncio.to_thread(run.retriever.collection_version) if run.response_cache.enabled else None
+    cached = run.cached_response(version)
+    if cached is not None:
+        return cached
+
+    try:
+        stage = run.plan_stage_two(await run.llm.ainvoke(run.start_generation()))
+        if stage.llm is None:
+            return run.finish()
+        if run.sink is not None:
+            return run.finish(await _astream_enhanced(stage.llm, stage.prompt, run.sink, run.experiment))
+        return run.finish(await stage.llm.ainvoke(stage.prompt))
+
+    except Exception as exc:
+        return run.error(exc)
+
+# Tool: Busca en Qdrant el contexto relevante (RAG) y genera SQL en una sola llamada
+# Con `invoke` se ejecuta la función síncrona y con `ainvoke` la corrutina.
+search_and_generate_sql = StructuredTool.from_function(
+    func=_search_and_generate_sql,
+    coroutine=_asearch_and_generate_sql,
+    name="search_and_generate_sql",
+    # Devuelve el resultado directamente, sin usar el LLM del agente (El agente debe terminar ahí.)
+    return_direct=True,
+    description="""
+    Recibe como entrada el informe completo de necesidad del usuario 
+    Con esta tool buscará el contexto relevante en la base de datos de datos corporativa.
+    Posteriormente generará directamente un script SQL.
+    """
+)
@@ -0,0 +1,51 @@
+###############################################
+# tokens.py
+###############################################
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Codificación por defecto de los modelos de embeddings y chat de OpenAI.
+DEFAULT_ENCODING = "cl100k_base"
+
+@lru_cache(maxsize=16)
+def _get_encoding(model_name: str | None):
+    """
+    Devuelve el codificador de `tiktoken` para el modelo indicado.
+    `tiktoken` llega como dependencia de `langchain-openai`, pero si no está disponible
+    (o no puede descargar la codificación) devolvemos None y se usa la aproximación.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+
+    try:
+        if model_name:
+            return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        pass
+    except Exception as e:
+        logger.warning(f"No se pudo cargar la codificación de tiktoken para {model_name}: {e}")
+        return None
+
+    try:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.warning(f"No se pudo cargar la codificación de tiktoken {DEFAULT_ENCODING}: {e}")
+        return None
+
+def count_tokens(text: str, model_name: str | None = None) -> int:
+    """
+    Cuenta los tokens de un texto para el modelo indicado.
+    Si `tiktoken` no está disponible, se aproxima con la regla habitual de ~4 caracteres por token.
+    """
+    if not text:
+        return 0
+
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        return max(1, len(text) // 4)
+
+    return len(encoding.encode(text, disallowed_special=()))
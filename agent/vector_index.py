@@ -0,0 +1,155 @@
+###############################################
+# vector_index.py
+###############################################
+# Notas:
+# Índice vectorial en memoria con NumPy, alternativa a Qdrant para el retriever.
+# La base de conocimiento tiene un vector por tabla (unas pocas decenas o cientos de vectores),
+# así que una búsqueda exacta con un único producto matriz-vector es más rápida que ir a Qdrant por red.
+#
+# El índice se puede cargar directamente de Qdrant o de un snapshot exportado por el loader:
+# - vectors.npy: matriz float32 (n x vector_size) con los vectores ya normalizados.
+# - meta.json: ids, payloads, versión de la colección, modelo y tamaño del vector.
+# El snapshot se abre mapeado en memoria (np.load con mmap_mode), no se copia a RAM.
+
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple
+import numpy as np
+from qdrant_client import QdrantClient
+
+logger = logging.getLogger(__name__)
+
+def snapshot_dir_for(collection: str) -> Path:
+    """
+    Directorio del snapshot de una colección: <RETRIEVER_SNAPSHOT_DIR>/<colección>
+    (por defecto `cache/snapshots` en la raíz del proyecto).
+    """
+    base_dir = os.getenv("RETRIEVER_SNAPSHOT_DIR") or Path(__file__).parent.parent / "cache" / "snapshots"
+    return Path(base_dir) / collection
+
+class VectorHit(NamedTuple):
+    """
+    Resultado de búsqueda, con los mismos atributos que usa el retriever de `ScoredPoint` de Qdrant.
+    """
+    id: str
+    score: float
+    payload: Dict[str, Any]
+
+class NumpyVectorIndex:
+    """
+    Índice de búsqueda exacta por similitud coseno sobre una matriz float32 contigua.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        vectors: np.ndarray,
+        payloads: List[Dict[str, Any]],
+        version: str | None = None,
+        normalized: bool = False,
+    ) -> None:
+        self.ids = ids
+        self.payloads = payloads
+        self.version = version
+        # Metadatos adicionales del snapshot (modelo, tamaño del vector, etc.)
+        self.meta: Dict[str, Any] = {}
+        # Se normalizan las filas una sola vez, la similitud coseno pasa a ser un producto escalar.
+        if not normalized:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors = vectors / norms
+        self.vectors = vectors
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_qdrant(cls, client: QdrantClient, collection: str, version: str | None = None) -> "NumpyVectorIndex":
+        """
+        Descarga todos los puntos (vectores y payloads) de una colección de Qdrant.
+        """
+        ids, vectors, payloads = [], [], []
+        offset = None
+        while True:
+            records, offset = client.scroll(
+                collection_name=collection,
+                with_payload=True,
+                with_vectors=True,
+                limit=256,
+                offset=offset,
+            )
+            for record in records:
+                ids.append(str(record.id))
+                vectors.append(record.vector)
+                payloads.append(record.payload or {})
+            if offset is None:
+                break
+
+        logger.info(f"Índice NumPy cargado desde Qdrant: {collection} ({len(ids)} vectores)")
+        matrix = np.asarray(vectors, dtype=np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+        return cls(ids, matrix, payloads, version=version)
+
+    @classmethod
+    def from_snapshot(cls, snapshot_dir: Path | str, mmap: bool = True) -> "NumpyVectorIndex":
+        """
+        Carga un snapshot exportado con `save_snapshot` (por defecto, mapeado en memoria).
+        """
+        snapshot_dir = Path(snapshot_dir)
+        meta = json.loads((snapshot_dir / "meta.json").read_text("utf-8"))
+        vectors = np.load(snapshot_dir / "vectors.npy", mmap_mode="r" if mmap else None)
+        logger.info(f"Índice NumPy cargado desde snapshot: {snapshot_dir} ({len(meta['ids'])} vectores)")
+        index = cls(meta["ids"], vectors, meta["payloads"], version=meta.get("version"), normalized=True)
+        index.meta = {k: v for k, v in meta.items() if k not in ("ids", "payloads")}
+        return index
+
+    def save_snapshot(self, snapshot_dir: Path | str, **metadata: Any) -> Path:
+        """
+        Guarda el índice en disco (vectors.npy + meta.json).
+        Se escribe primero en ficheros temporales para no dejar un snapshot a medias.
+        """
+        snapshot_dir = Path(snapshot_dir)
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+
+        tmp_vectors = snapshot_dir / "vectors.tmp.npy"
+        np.save(tmp_vectors, np.ascontiguousarray(self.vectors, dtype=np.float32))
+
+        meta = {
+            "version": self.version,
+            "exported_at": datetime.now().isoformat(timespec="seconds"),
+            **metadata,
+            "ids": self.ids,
+            "payloads": self.payloads,
+        }
+        tmp_meta = snapshot_dir / "meta.tmp.json"
+        tmp_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+        os.replace(tmp_vectors, snapshot_dir / "vectors.npy")
+        os.replace(tmp_meta, snapshot_dir / "meta.json")
+        logger.info(f"Snapshot del índice guardado en {snapshot_dir} ({self.count} vectores)")
+        return snapshot_dir
+
+    def search(self, query_vector: List[float], limit: int) -> List[VectorHit]:
+        """
+        Devuelve los `limit` vectores más similares (coseno), ordenados de mayor a menor score.
+        """
+        if self.count == 0:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        scores = self.vectors @ query
+
+        # Top-k sin ordenar toda la matriz
+        limit = min(limit, self.count)
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+
+        return [VectorHit(self.ids[i], float(scores[i]), self.payloads[i]) for i in top]
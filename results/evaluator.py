@@ -1,34 +1,62 @@
 import numpy as np
 import os
+import re
+import unicodedata
 import pandas as pd
 from typing import Tuple
-from openai import OpenAI
+from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 from scipy.optimize import linear_sum_assignment
 import logging
 from dotenv import load_dotenv
+from agent.embeddings import EmbeddingBatcher, OpenAIEmbedder
+from agent.embedding_cache import with_embedding_cache
 
 load_dotenv()
 #setup_logging()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Versión de las métricas: cambiarla cuando cambie el cálculo (o el SCORE_THRESHOLD de result_generator.py),
+# para que la evaluación incremental vuelva a evaluar los experimentos (ver result_manifest.py)
+EVALUATOR_VERSION = "2"
+
+# Similitud mínima (TF-IDF de n-gramas de caracteres) para emparejar dos nombres sin embeddings, ver _lexical_matches
+LEXICAL_THRESHOLD = 0.9
+
+def _normalize_name(text) -> str:
+    """
+    Forma normalizada de un nombre de columna o evento: sin acentos, en minúsculas,
+    camelCase y snake_case separados por espacios (`Subject_ID`, `subjectId` y `subject id` -> `subject id`).
+    """
+    text = re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", str(text))
+    text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+    return " ".join(re.split(r"[\W_]+", text.lower())).strip()
+
 class EvaluationSQLScripts:
     def __init__(self):
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
         self.openai_model = "text-embedding-3-small"
+        self.openai_vector_size = int(os.getenv("OPENAI_EMBEDDING_VECTOR_SIZE", 1536))
+        # Un solo cliente para toda la evaluación, por lotes y con la caché local de embeddings por delante.
+        # Entre experimentos se repiten las mismas listas del benchmark, la caché evita volver a generarlas.
+        self.embedder = with_embedding_cache(
+            EmbeddingBatcher(OpenAIEmbedder(self.openai_model, self.openai_vector_size, api_key=self.openai_api_key))
+        )
+        # Vectores ya calculados en esta evaluación {texto: vector}
+        self._vectors: dict = {}
 
     def _embed_openai(self, texts: list[str]) -> list[list[float]]:
         """
         Devuelve una lista de vectores (embeddings) para una lista de textos.
         Se aprovecha que ya teníamos la api openai configurada.
+        Solo se llama a la API para los textos que no estén ya calculados o en la caché local de embeddings.
         """
-        client = OpenAI(api_key=self.openai_api_key)
-        response = client.embeddings.create(
-            input=texts,
-            model=self.openai_model
-        )
-        return np.array([d.embedding for d in response.data])
+        missing = [t for t in dict.fromkeys(texts) if t not in self._vectors]
+        if missing:
+            vectors, _, _ = self.embedder.embed(missing)
+            self._vectors.update(zip(missing, vectors))
+        return np.array([self._vectors[t] for t in texts])
 
     def _list_of_elements_cosine_similarity(
         self,
@@ -41,15 +69,39 @@ class EvaluationSQLScripts:
         - list_benchmark: lista con los vectores de embeddings del benchmark.
         - list_current: lista con los vectores de embeddings de la AI Tool.
         """
-        embeddings_benchmark = self._embed_openai(list_benchmark)
-        embeddings_current = self._embed_openai(list_current)
-        return cosine_similarity(embeddings_benchmark, embeddings_current)
+        return self._list_of_pairs_cosine_similarity([(list_benchmark, list_current)])[0]
+
+    def _list_of_pairs_cosine_similarity(
+        self,
+        pairs: list[Tuple[list[str], list[str]]],
+    ) -> list[np.ndarray]:
+        """
+        Igual que _list_of_elements_cosine_similarity, pero para muchos pares (lista benchmark, lista AI Tool) a la vez,
+        p. ej. columnas y eventos de todos los experimentos de una evaluación.
+        Los textos de todos los pares se deduplican y sus embeddings se generan en una sola llamada por lotes:
+        las listas del benchmark, iguales en todos los experimentos, se generan una única vez.
+        Devuelve una matriz de similitud por par, en el mismo orden.
+        """
+        texts = list(dict.fromkeys(text for list_benchmark, list_current in pairs for text in (*list_benchmark, *list_current)))
+        if len(texts) > len(self._vectors):
+            logger.info(f"Embeddings de {len(texts)} textos únicos para {len(pairs)} pares de listas")
+        embeddings = self._embed_openai(texts)
+        position = {text: i for i, text in enumerate(texts)}
+        return [
+            cosine_similarity(
+                embeddings[[position[text] for text in list_benchmark]],
+                embeddings[[position[text] for text in list_current]],
+            )
+            for list_benchmark, list_current in pairs
+        ]
 
     def _list_elements_metrics_F1(
         self,
         list_benchmark: list[str],
         list_current: list[str],
         score_threshold: float = 0.9,
+        matrix_similarity: np.ndarray | None = None,
+        lexical: Tuple[dict, list[int], list[int]] | None = None,
     ) -> Tuple[float, float, float, int, int, int, dict]:
         """
         Calcula F1-score, precisión y recall para la correspondencia semántica
@@ -62,6 +114,11 @@ class EvaluationSQLScripts:
         El LLM genera strings sinónimos al benchmak, y para mejorar la medición
         se optó por la similitud semántica entre los strings de ambas listas.
 
+        Antes de los embeddings se emparejan los casos triviales (ver _lexical_matches):
+        nombres iguales o iguales tras normalizar (score 1.0), y nombres casi iguales por TF-IDF de n-gramas de caracteres.
+        Solo el resto (residuo) se compara con embeddings y asignación lineal, así las coincidencias triviales
+        tienen una puntuación determinista y la matriz de similitud es más pequeña.
+
         Esto se aplica a la lista de eventos únicos generados y a la lista de nombres de columnas.
 
         Al tener cierto control en estas listas, podemos aplicar F1 ya que:
@@ -94,6 +151,7 @@ class EvaluationSQLScripts:
         - Una lista de eventos/columnas del benchmark.
         - Una lista de eventos/columnas de la AI Tool.
         - Un score_pass para considerar un emparejamiento como TP.
+        - (Opcional) Los emparejamientos léxicos y la matriz de similitud del residuo ya calculados, ver _list_elements_metrics_F1_many.
         Retornamos una tupla con todas las métricas calculadas.
         """
 
@@ -104,12 +162,22 @@ class EvaluationSQLScripts:
                 logger.error("No pueden existir listas vacías de elementos")
                 raise ValueError("No pueden existir listas vacías de elementos")
 
-            # 1. Matriz de similitud mediante distancia coseno
-            matrix_similarity = self._list_of_elements_cosine_similarity(list_benchmark, list_current)
-
-            # 2. Aplicamos el algoritmo de asignación lineal para encontrar el mejor emparejamiento
-            cost = 1.0 - matrix_similarity
-            rows, cols = linear_sum_assignment(cost)
+            # 1. Emparejamientos sin embeddings: exactos, normalizados y léxicos (si no nos los han pasado ya calculados)
+            #    matches: {índice benchmark: (índice AI Tool, score, tipo de emparejamiento)}
+            matches, rest_benchmark, rest_current = lexical or self._lexical_matches(list_benchmark, list_current)
+            matches = dict(matches)
+
+            # 2. Con el residuo: matriz de similitud mediante distancia coseno (si no nos la han pasado ya calculada)
+            #    y algoritmo de asignación lineal para encontrar el mejor emparejamiento
+            if rest_benchmark and rest_current:
+                if matrix_similarity is None:
+                    matrix_similarity = self._list_of_elements_cosine_similarity(
+                        [list_benchmark[i] for i in rest_benchmark], [list_current[j] for j in rest_current]
+                    )
+                cost = 1.0 - matrix_similarity
+                rows, cols = linear_sum_assignment(cost)
+                for r, c in zip(rows, cols):
+                    matches[rest_benchmark[r]] = (rest_current[c], float(matrix_similarity[r, c]), "semantic")
 
             # 3. Contamos los elementos que nuestra AI Tool ha generado
             #    y que estaban en el benchmark. (True Positives)
@@ -119,13 +187,14 @@ class EvaluationSQLScripts:
             match_dict = {}
             # Recorremos la matriz de similitus para verificar si el emparejamiento
             # es un True Positive.
-            for r, c in zip(rows, cols):
+            for r in sorted(matches):
+                c, score, match_type = matches[r]
                 # Hacemos pequeña lógica de monitorización
                 benchmark_item = list_benchmark[r]
                 ai_item = list_current[c]
 
                 # Capturamos si superamos el score, por tanto es un TP
-                score_ok = matrix_similarity[r, c] >= score_threshold
+                score_ok = score >= score_threshold
 
                 if score_ok:
                     valid = 1
@@ -136,9 +205,10 @@ class EvaluationSQLScripts:
                 # Guardamos en el diccionario
                 match_dict[benchmark_item] = {
                     "ai_column": ai_item,
-                    "score": float(matrix_similarity[r, c]),
+                    "score": score,
                     "score_treshold": score_threshold,
-                    "pass": valid
+                    "pass": valid,
+                    "match": match_type,
                 }
 
             # 4. Calculamos FP (False Positives) y FN (False Negatives)
@@ -174,6 +244,92 @@ class EvaluationSQLScripts:
             logger.error(f"Error inesperado al calcular las métricas F1, Precision, Recall, TP, FP y FN: {e}")
             raise Exception(f"Error inesperado al calcular las métricas F1, Precision, Recall, TP, FP y FN: {e}")
         
+    def _list_elements_metrics_F1_many(
+        self,
+        pairs: list[Tuple[list[str], list[str]]],
+        score_threshold: float = 0.9,
+    ) -> list[Tuple[float, float, float, int, int, int, dict]]:
+        """
+        Métricas de _list_elements_metrics_F1 para muchos pares (lista benchmark, lista AI Tool) a la vez,
+        con todos los embeddings generados juntos (ver _list_of_pairs_cosine_similarity).
+        Devuelve una tupla de métricas por par, en el mismo orden.
+        """
+        if any(not list_benchmark or not list_current for list_benchmark, list_current in pairs):
+            logger.error("No pueden existir listas vacías de elementos")
+            raise ValueError("No pueden existir listas vacías de elementos")
+
+        # Solo el residuo de cada par (lo que no se empareja sin embeddings) pasa por los embeddings
+        lexicals = [self._lexical_matches(list_benchmark, list_current) for list_benchmark, list_current in pairs]
+        residues = [
+            i for i, (_, rest_benchmark, rest_current) in enumerate(lexicals) if rest_benchmark and rest_current
+        ]
+        matrices = dict(zip(residues, self._list_of_pairs_cosine_similarity([
+            ([pairs[i][0][r] for r in lexicals[i][1]], [pairs[i][1][c] for c in lexicals[i][2]]) for i in residues
+        ]))) if residues else {}
+        return [
+            self._list_elements_metrics_F1(list_benchmark, list_current, score_threshold, matrices.get(i), lexicals[i])
+            for i, (list_benchmark, list_current) in enumerate(pairs)
+        ]
+
+    def _lexical_matches(
+        self,
+        list_benchmark: list[str],
+        list_current: list[str],
+    ) -> Tuple[dict, list[int], list[int]]:
+        """
+        Empareja, sin embeddings y uno a uno, los elementos triviales de las dos listas:
+        1. exact: el mismo string (score 1.0).
+        2. normalized: el mismo nombre normalizado, también sin espacios (`Subject_ID` / `subjectid`, score 1.0).
+        3. lexical: nombres casi iguales, similitud TF-IDF de n-gramas de caracteres >= LEXICAL_THRESHOLD
+           y mejor candidato el uno del otro (score = esa similitud).
+        Devuelve ({índice benchmark: (índice AI Tool, score, tipo)}, índices benchmark restantes, índices AI Tool restantes).
+        """
+        matches = {}
+        rest_benchmark = list(range(len(list_benchmark)))
+        rest_current = list(range(len(list_current)))
+
+        keys = [
+            ("exact", lambda text: text),
+            ("normalized", _normalize_name),
+            ("normalized", lambda text: _normalize_name(text).replace(" ", "")),
+        ]
+        for match_type, key in keys:
+            available = {}
+            for c in rest_current:
+                available.setdefault(key(list_current[c]), []).append(c)
+            for r in list(rest_benchmark):
+                # Los nombres que se quedan vacíos al normalizar (solo símbolos) no se emparejan así
+                candidates = available.get(key(list_benchmark[r])) if key(list_benchmark[r]) != "" else None
+                if candidates:
+                    c = candidates.pop(0)
+                    matches[r] = (c, 1.0, match_type)
+                    rest_benchmark.remove(r)
+                    rest_current.remove(c)
+
+        if rest_benchmark and rest_current:
+            names_benchmark = [_normalize_name(list_benchmark[r]) for r in rest_benchmark]
+            names_current = [_normalize_name(list_current[c]) for c in rest_current]
+            try:
+                vectorizer = TfidfVectorizer(analyzer="char", ngram_range=(2, 4)).fit(names_benchmark + names_current)
+                similarity = cosine_similarity(vectorizer.transform(names_benchmark), vectorizer.transform(names_current))
+            except ValueError:
+                # Sin n-gramas (nombres vacíos o solo símbolos): todo queda para los embeddings
+                similarity = np.zeros((len(names_benchmark), len(names_current)))
+            best_current = similarity.argmax(axis=1)
+            best_benchmark = similarity.argmax(axis=0)
+            lexical = [
+                (i, j) for i, j in enumerate(best_current)
+                if best_benchmark[j] == i and similarity[i, j] >= LEXICAL_THRESHOLD
+            ]
+            for i, j in lexical:
+                matches[rest_benchmark[i]] = (rest_current[j], float(similarity[i, j]), "lexical")
+            matched_benchmark = {rest_benchmark[i] for i, _ in lexical}
+            matched_current = {rest_current[j] for _, j in lexical}
+            rest_benchmark = [r for r in rest_benchmark if r not in matched_benchmark]
+            rest_current = [c for c in rest_current if c not in matched_current]
+
+        return matches, rest_benchmark, rest_current
+
     def _coverage_total_rows(
         self,
         len_df_benchmark: int,
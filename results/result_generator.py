@@ -15,9 +15,18 @@
 #     log_json_path:    ruta al archivo o los archivos json que se generó al trackear la AI Tool,
 #                       se ubican en el proyecto en la carpeta output (output/TestToolAgent_<uuid>.json)
 #     df_benchmark:     pandas dataframe con el benchmark.
-#     ai_csv_dir:       ruta a la carpeta donde se guardan los csv generados por la AI Tool.
+#     ai_csv_dir:       ruta a la carpeta donde se guardan los resultados (Parquet o csv) generados por la AI Tool.
 #     results_json_dir: ruta a la carpeta donde se guardan los json con los resultados de la evaluación.
 #
+# Los experimentos se evalúan en paralelo (ver evaluate_experiments): RESULTS_WORKERS hilos,
+# como mucho RESULTS_DB_CONCURRENCY consultas a la vez en PostgreSQL y los embeddings de todos por lotes.
+#
+# Con EVALUATION_BACKEND=DUCKDB las SQL se ejecutan en un sandbox local (DuckDB con filas sintéticas, ver sandbox.py)
+# en lugar de PostgreSQL, y los resultados se guardan en 'results/json/sandbox' y 'results/csv/AI_tool/sandbox'.
+#
+# La evaluación es incremental (RESULTS_INCREMENTAL=YES): solo se evalúan los experimentos nuevos o con cambios
+# en la SQL, el benchmark o el evaluador, y una ejecución interrumpida continúa donde se quedó (ver result_manifest.py).
+#
 # Si no se ha generado el fichero de control, se lanzará un error.
 # Si se ha generado el fichero de resultados, se guardará en 'results/json/Result_<TestToolAgent_(uuid original)>.json'
 #
@@ -31,16 +40,27 @@
 
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 import pandas as pd
 import numpy as np
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Tuple
 from datetime import datetime
 from pathlib import Path
-from sqlalchemy import create_engine, text
+from sqlalchemy import Engine, create_engine, text
+from sqlalchemy.exc import DBAPIError
 from dotenv import load_dotenv
 import logging
 from agent.utils.logging_config import setup_logging
-from results.evaluator import EvaluationSQLScripts
+from agent.embedding_cache import embedding_cache_stats
+from agent.experiment_files import iter_experiment_files, read_experiment_file
+from results.evaluator import EVALUATOR_VERSION, EvaluationSQLScripts
+from results.result_manifest import MANIFEST_NAME, EvaluationManifest, file_hash, is_incremental, sql_hash
+from results.sql_guard import REASON_SQL_ERROR, SQLGuard, Watchdog, failure_from_exception, sql_body
+from results.result_io import ResultWriter, load_benchmark, result_path, schema_from_cursor
+from results.sandbox import SandboxDatabase, evaluation_backend, to_duckdb
 
 # Variables de entorno y logger
 load_dotenv()
@@ -48,6 +68,70 @@ setup_logging()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Similitud mínima para considerar un emparejamiento de columnas o eventos como TP (ver evaluator.py)
+SCORE_THRESHOLD = 0.4
+
+# SQLSTATE de la agregación del modo pushdown con los que se lee el resultado en su lugar (ver _pushdown_metrics):
+# columna `activity` ambigua y tipo sin operador de igualdad para el GROUP BY (json, ...)
+_PUSHDOWN_FALLBACK_SQLSTATES = ("42702", "42883")
+
+class ResultAccumulator:
+    """
+    Métricas del resultado de la SQL calculadas por bloques (chunks), sin tener el resultado completo en memoria:
+    - total_rows: número de filas.
+    - columns: lista de columnas, en el orden del resultado.
+    - events: lista de eventos únicos (columna `activity`), en orden de aparición, como `unique()` de pandas.
+    - event_counts: filas de cada evento.
+    También se construye directamente con los agregados calculados en PostgreSQL (modo pushdown, ver _pushdown_metrics).
+    """
+
+    def __init__(self) -> None:
+        self.total_rows = 0
+        self.columns: List[str] = []
+        self._events: Dict[Any, int | None] = {}
+
+    def update(self, df: pd.DataFrame) -> None:
+        if not self.columns:
+            self.columns = df.columns.tolist()
+        self.total_rows += len(df)
+        # Solo se guardan los valores distintos del bloque y sus filas, el diccionario conserva el orden de aparición
+        if "activity" in df.columns:
+            counts = df.activity.value_counts(dropna=False)
+            for event in df.activity.unique().tolist():
+                self._events[event] = (self._events.get(event) or 0) + int(counts.get(event, 0))
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "ResultAccumulator":
+        accumulator = cls()
+        accumulator.update(df)
+        return accumulator
+
+    @property
+    def events(self) -> List[Any]:
+        return list(self._events)
+
+    @property
+    def event_counts(self) -> Dict[Any, int | None]:
+        return dict(self._events)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_rows": self.total_rows,
+            "columns": self.columns,
+            "events": self.events,
+            "event_counts": list(self._events.values()),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ResultAccumulator":
+        accumulator = cls()
+        accumulator.total_rows = data["total_rows"]
+        accumulator.columns = list(data["columns"])
+        # Los manifiestos anteriores no guardaban las filas de cada evento
+        counts = data.get("event_counts") or [None] * len(data["events"])
+        accumulator._events = dict(zip(data["events"], counts))
+        return accumulator
+
 class ResultsSQLScripts:
     """
     Se crea esta clase para poder ejecutar la evaluación de resultados
@@ -66,6 +150,7 @@ class ResultsSQLScripts:
                           Es necesario autorización de acceso y curso de formación para acceder a los datos.
 
     - ai_csv_dir: csv generado tras la ejecución exitosa del script SQL generado por la AI Tool.- Se ubicaría en la carpeta "results/csv/AI_tool/"
+                  Por defecto se guarda en Parquet (<id>.parquet) en lugar de csv, ver result_io.py (RESULTS_OUTPUT_FORMAT).
     - results_json_dir: ruta del directorio donde su guardará los logs json con los resultados de la evaluación, se ubica en la carpeta "results/json/"
 
     Al ejecutar la clase, mediante el método run(), se generaran los resultados.
@@ -104,6 +189,9 @@ class ResultsSQLScripts:
 
     NOTA 2 IMPORTANTE: Si replicas el experimento, los `csv` resultantes pesan alrededor de 1GB, si ejecutas el script con el IDE abierto,
     en algunos casos puede saltar error y cerrarte el IDE. ¡No te asustes! :)
+    Por eso, por defecto (RESULTS_SQL_STREAMING=YES), la SQL se lee con un cursor de servidor en bloques de
+    RESULTS_SQL_CHUNK_SIZE filas: cada bloque se añade al fichero de resultado (un row group de Parquet) y a las métricas (ResultAccumulator) y se libera,
+    así la memoria no depende del tamaño del log de eventos. Con RESULTS_SQL_STREAMING=NO se carga todo como antes.
 
     NOTA 3 IMPORTANTE: El proveedor de datos de MIMICEL, no permite la distribución de los datos, por lo que no se incluye en el repositorio.
     """
@@ -114,7 +202,29 @@ class ResultsSQLScripts:
         df_benchmark: pd.DataFrame,
         ai_csv_dir: str,
         results_json_dir: str,
+        engine: Engine | None = None,
+        db_semaphore: threading.Semaphore | None = None,
+        benchmark: ResultAccumulator | None = None,
+        guard: SQLGuard | None = None,
+        sandbox: SandboxDatabase | None = None,
     ) -> None:
+        # Motor de base de datos compartido y límite de consultas simultáneas (evaluación en paralelo, ver evaluate_experiments)
+        self.engine = engine
+        self.db_semaphore = db_semaphore
+        # Filas, columnas y eventos del benchmark, calculados una sola vez para todos los experimentos
+        self._benchmark = benchmark
+        # Protección de la base de datos: EXPLAIN, solo lectura, statement_timeout y watchdog (ver sql_guard.py)
+        self.guard = guard or SQLGuard.from_env()
+        # Sandbox DuckDB donde se ejecuta la SQL en lugar de PostgreSQL (EVALUATION_BACKEND=DUCKDB, ver sandbox.py)
+        self.sandbox = sandbox
+        self.execution_ok = 0
+        self.result_ai: ResultAccumulator | None = None
+        # Estimación del planificador y motivo estructurado del fallo de la SQL, si lo hay (se guardan en los resultados)
+        self.plan: Dict[str, Any] = {}
+        self.execution_failure: Dict[str, Any] = {}
+        # Experimento ya evaluado sin cambios (evaluación incremental, ver result_manifest.py)
+        self.skipped = False
+
         # Rutas
         self.log_json_path = Path(log_json_path)
         self.df_benchmark = df_benchmark # DataFrame con el benchmark
@@ -125,8 +235,8 @@ class ResultsSQLScripts:
 
         try:
             # Cargar datos de log de la AI Tool
-            with self.log_json_path.open(encoding="utf-8") as f:
-                self.log_data: Dict[str, Any] = json.load(f)
+            # Los logs pueden estar comprimidos (.json.gz, ver experiment_writer.py)
+            self.log_data: Dict[str, Any] = read_experiment_file(self.log_json_path)
         except FileNotFoundError as e:
             logger.error(f"No existe el fichero TestToolAgent {self.log_json_path}")
             raise e
@@ -153,8 +263,8 @@ class ResultsSQLScripts:
         self.db_port = os.getenv("DB_PORT")
         self.db_name = os.getenv("DB_NAME")
 
-        # Por si las moscas, chequeamos, que las credenciales estén bien.
-        if not all([self.db_user, self.db_password, self.db_host, self.db_port, self.db_name]):
+        # Por si las moscas, chequeamos, que las credenciales estén bien (el sandbox no las necesita).
+        if self.sandbox is None and not all([self.db_user, self.db_password, self.db_host, self.db_port, self.db_name]):
             logger.error("Credenciales de la base de datos incompletas")
             raise EnvironmentError("Credenciales de la base de datos incompletas")
 
@@ -167,91 +277,298 @@ class ResultsSQLScripts:
             sql = sql[:-3]
         return sql.strip()
 
+    # Filas, columnas y eventos del benchmark (se calculan la primera vez si no nos los han pasado)
+    @property
+    def benchmark(self) -> ResultAccumulator:
+        if self._benchmark is None:
+            self._benchmark = ResultAccumulator.from_dataframe(self.df_benchmark)
+        return self._benchmark
+
+    # Modo pushdown: las métricas del resultado se calculan en PostgreSQL, sin traer las filas
+    def _pushdown_metrics(self, conn, sql_clean: str, watchdog: Watchdog) -> ResultAccumulator | None:
+        """
+        Envuelve la SQL como subconsulta y pide a la base de datos solo lo que necesita la evaluación:
+        - columnas: `LIMIT 0` (el planificador valida la SQL sin ejecutarla; si falla, la SQL no es válida).
+        - filas y eventos: `COUNT(*)` agrupado por `activity` (una sola ejecución de la SQL).
+        Devuelve None si la agregación no se puede hacer en la base de datos (columna `activity` duplicada
+        o sin operador de igualdad, ver _PUSHDOWN_FALLBACK_SQLSTATES), y entonces se lee el resultado como siempre.
+        El resto de errores (cancelaciones, timeouts, conexión) se lanzan: la SQL no se vuelve a ejecutar.
+        """
+        # Sin comentarios ni `;` finales: si no, el paréntesis de cierre quedaría dentro de un comentario
+        subquery = sql_body(sql_clean)
+        columns = list(conn.execute(text(f"SELECT * FROM (\n{subquery}\n) AS ai_result LIMIT 0")).keys())
+        accumulator = ResultAccumulator()
+        accumulator.columns = columns
+        if columns.count("activity") > 1:
+            logger.warning("Columna activity duplicada, se lee el resultado")
+            return None
+        try:
+            if "activity" in columns:
+                rows = conn.execute(text(
+                    f"SELECT activity, COUNT(*) AS n FROM (\n{subquery}\n) AS ai_result "
+                    f"GROUP BY activity ORDER BY n DESC, activity"
+                )).fetchall()
+                accumulator._events = {activity: int(n) for activity, n in rows}
+                accumulator.total_rows = sum(accumulator._events.values())
+            else:
+                accumulator.total_rows = int(conn.execute(text(f"SELECT COUNT(*) FROM (\n{subquery}\n) AS ai_result")).scalar())
+        except DBAPIError as e:
+            # Si el watchdog ha saltado, no se vuelve a ejecutar la SQL
+            watchdog.check()
+            if getattr(e.orig, "pgcode", None) not in _PUSHDOWN_FALLBACK_SQLSTATES:
+                raise
+            logger.warning(f"No se pudieron calcular las métricas en la base de datos, se lee el resultado: {e}")
+            conn.rollback()
+            # Nueva transacción: se vuelve a proteger
+            self.guard.begin(conn)
+            return None
+        return accumulator
+
+    # Ejecuta la SQL en el sandbox DuckDB, traducida al dialecto de DuckDB
+    def _run_sql_sandbox(self) -> Tuple[int, ResultAccumulator | None]:
+        """
+        Igual que _run_sql, pero contra el sandbox (ver sandbox.py): mismo fichero de resultado y mismas métricas,
+        con filas sintéticas. Cada hilo usa su propia conexión al sandbox compartido.
+        """
+        sql_clean = self._clean_markdown_sql(sql=self.sql_script)
+        out_path = result_path(self.ai_csv_dir, self.test_id)
+        chunk_size = int(os.getenv("RESULTS_SQL_CHUNK_SIZE", 50000))
+        accumulator = ResultAccumulator()
+        writer = None
+        self.plan, self.execution_failure = {}, {}
+        try:
+            conn = self.sandbox.connect()
+            try:
+                conn.execute(to_duckdb(sql_clean))
+                columns = [column[0] for column in conn.description]
+                writer = ResultWriter(out_path)
+                while True:
+                    rows = conn.fetchmany(chunk_size)
+                    df = pd.DataFrame(rows, columns=columns)
+                    if rows or not accumulator.columns:
+                        writer.write(df)
+                        accumulator.update(df)
+                    if len(rows) < chunk_size:
+                        break
+            finally:
+                conn.close()
+            saved = writer.commit()
+            logger.info(f"SQL ejecutada correctamente en el sandbox ({accumulator.total_rows} filas), resultado en {saved or 'ningún fichero'}")
+            return 1, accumulator
+        except Exception as e:
+            self.execution_failure = failure_from_exception(e, sql_errors=(self.sandbox.errors,))
+            logger.error(f"SQL execution failed in sandbox ({self.execution_failure['reason']}): {e}")
+            if writer is not None:
+                writer.abort()
+            return 0, None
+
     # Ejecuta lScript SQL
-    def _run_sql(self) -> Tuple[int, pd.DataFrame | None]:
+    def _run_sql(self) -> Tuple[int, ResultAccumulator | None]:
         """
         Esta función ejectua el Script SQL, para checkear si la AI Tool ha generado un script SQL válido.
         Si es así, se guarda el CSV con el resultado de la ejecución.
 
         Esta función tiene que devolvernos una Tupla:
         - 0/1: Si la SQL se ha ejecutado correctamente o no.
-        - DataFrame: (Opcional) En el caso de que SQL haya ejecutado correctamente.
+        - ResultAccumulator: (Opcional) Filas, columnas y eventos del resultado, en el caso de que SQL haya ejecutado correctamente.
+
+        Con RESULTS_SQL_PUSHDOWN=YES no se trae el resultado: las métricas se calculan en PostgreSQL
+        (ver _pushdown_metrics) y no se guarda el fichero de resultado.
+
+        La SQL se ejecuta protegida (ver sql_guard.py): si falla, el motivo queda en self.execution_failure.
+        Con sandbox, se ejecuta en DuckDB (ver _run_sql_sandbox).
         """
-        # Instanciamos el motor de base de datos
-        engine = create_engine(
+        if self.sandbox is not None:
+            return self._run_sql_sandbox()
+        # Instanciamos el motor de base de datos (o usamos el compartido por la evaluación en paralelo)
+        engine = self.engine or create_engine(
             f"postgresql://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
         )
         # Limpiamos la SQL, que el trackeo tiene formato markdown
         sql_clean = self._clean_markdown_sql(sql=self.sql_script)
+        # Parquet (o csv) que se escribe en un temporal y se renombra al terminar, para no dejar un fichero a medias si falla la SQL
+        out_path = result_path(self.ai_csv_dir, self.test_id)
+        writer = None
+        streaming = os.getenv("RESULTS_SQL_STREAMING", "YES").upper() == "YES"
+        pushdown = os.getenv("RESULTS_SQL_PUSHDOWN", "NO").upper() == "YES"
+        chunk_size = int(os.getenv("RESULTS_SQL_CHUNK_SIZE", 50000))
+        accumulator = ResultAccumulator()
+        watchdog = None
+        self.plan, self.execution_failure = {}, {}
         try:
-            # Ejecutamos la SQL
-            with engine.connect() as conn:
-                result = conn.execute(text(sql_clean))
-                df = pd.DataFrame(result.fetchall(), columns=result.keys())
+            # Ejecutamos la SQL, sin superar el límite de consultas simultáneas si lo hay
+            with self.db_semaphore or nullcontext(), engine.connect() as conn:
+                # Solo lectura, statement_timeout y EXPLAIN antes de ejecutar nada
+                self.guard.begin(conn)
+                self.plan = self.guard.check_plan(conn, sql_clean)
+                # Watchdog: cancela la SQL si supera RESULTS_SQL_MAX_SECONDS
+                with self.guard.watchdog(conn) as watchdog:
+                    pushed = self._pushdown_metrics(conn, sql_clean, watchdog) if pushdown else None
+                    if pushed is not None:
+                        accumulator = pushed
+                    elif streaming:
+                        # Cursor de servidor: PostgreSQL envía las filas por bloques de `chunk_size`
+                        conn = conn.execution_options(stream_results=True, yield_per=chunk_size)
+                        result = conn.execute(text(sql_clean))
+                        columns = list(result.keys())
+                        # Tipos de las columnas informados por PostgreSQL, para el esquema del Parquet
+                        writer = ResultWriter(out_path, schema_from_cursor(result.cursor.description))
+                        empty = True
+                        for rows in result.partitions(chunk_size):
+                            # El watchdog puede haber saltado entre dos bloques
+                            watchdog.check()
+                            df = pd.DataFrame(rows, columns=columns)
+                            writer.write(df)
+                            accumulator.update(df)
+                            empty = False
+                        if empty:
+                            # Resultado vacío: fichero solo con las columnas
+                            df = pd.DataFrame(columns=columns)
+                            writer.write(df)
+                            accumulator.update(df)
+                    else:
+                        result = conn.execute(text(sql_clean))
+                        writer = ResultWriter(out_path, schema_from_cursor(result.cursor.description))
+                        df = pd.DataFrame(result.fetchall(), columns=result.keys())
+                        writer.write(df)
+                        accumulator.update(df)
+                    watchdog.check()
 
             # Si llegamos aquí, la SQL se ha ejecutado correctamente.
-            out_csv = self.ai_csv_dir / f"{self.test_id}.csv"
-            df.to_csv(out_csv, index=False)
-            logger.info(f"SQL ejecutada correctamente, y se ha generado el `csv` en {out_csv}")
-
-            # Devolvemos 1 (Éxito de ejecución) y el DataFrame con el resultado de la ejecución.
-            return 1, df
+            if writer is not None:
+                # Si no se ha podido escribir el fichero, la SQL sigue siendo correcta (ver ResultWriter)
+                if writer.commit() is not None:
+                    logger.info(f"SQL ejecutada correctamente ({accumulator.total_rows} filas), y se ha generado el resultado en {out_path}")
+                else:
+                    logger.info(f"SQL ejecutada correctamente ({accumulator.total_rows} filas), sin fichero de resultado")
+            else:
+                logger.info(f"SQL ejecutada correctamente ({accumulator.total_rows} filas), métricas calculadas en la base de datos")
+
+            # Devolvemos 1 (Éxito de ejecución) y las métricas del resultado de la ejecución.
+            return 1, accumulator
         except Exception as e:
-            logger.error(f"SQL execution failed: {e}")
+            self.execution_failure = failure_from_exception(e, cancelled=watchdog is not None and watchdog.cancelled.is_set())
+            logger.error(f"SQL execution failed ({self.execution_failure['reason']}): {e}")
+            if writer is not None:
+                writer.abort()
             # Devolvemos 0 (Fallo de ejecución) y None
             return 0, None
+        finally:
+            if self.engine is None:
+                engine.dispose()
 
     # Método principal de la clase, este es el que se ejecuta que ejecuta todo el proceso.
     def run(self) -> Dict[str, Any]:
-        execution_ok, df_ai = self._run_sql()
+        self.execute()
+        return self.evaluate()
+
+    # Primera fase: ejecución de la SQL (en paralelo con otros experimentos, ver evaluate_experiments)
+    def execute(self) -> int:
+        self.execution_ok, self.result_ai = self._run_sql()
+        return self.execution_ok
+
+    # Motor donde se ha ejecutado la SQL (se guarda en los resultados)
+    @property
+    def execution_backend(self) -> str:
+        return "duckdb" if self.sandbox is not None else "postgresql"
+
+    # Hash de la SQL evaluada y de los límites del guard, y ruta del json de resultados (evaluación incremental)
+    @property
+    def sql_digest(self) -> str:
+        return sql_hash(self._clean_markdown_sql(sql=self.sql_script), self.guard.settings())
+
+    # Solo se guardan en el manifiesto las ejecuciones correctas y los errores de la propia SQL;
+    # los fallos transitorios (base de datos caída, timeouts, límites del guard) se reintentan en la siguiente evaluación
+    @property
+    def cacheable(self) -> bool:
+        return bool(self.execution_ok) or self.execution_failure.get("reason") == REASON_SQL_ERROR
+
+    @property
+    def result_json_path(self) -> Path:
+        return self.results_json_dir / f"Result_{self.test_id}.json"
+
+    # Resumen de la ejecución que se guarda en el manifiesto, y su recuperación sin volver a ejecutar la SQL
+    def execution_summary(self) -> Dict[str, Any]:
+        return {
+            "execution_ok": self.execution_ok,
+            "result": self.result_ai.to_dict() if self.result_ai is not None else None,
+            "plan": self.plan,
+            "failure": self.execution_failure,
+        }
+
+    def restore_execution(self, execution: Dict[str, Any]) -> None:
+        self.execution_ok = execution["execution_ok"]
+        self.result_ai = ResultAccumulator.from_dict(execution["result"]) if execution["result"] else None
+        self.plan = execution.get("plan") or {}
+        self.execution_failure = execution.get("failure") or {}
+
+    # Pares (lista benchmark, lista AI Tool) que se comparan en evaluate(): columnas y eventos.
+    # evaluate_experiments calcula los de todos los experimentos a la vez (ver _list_elements_metrics_F1_many)
+    def metric_pairs(self) -> List[Tuple[List[Any], List[Any]]]:
+        if not self.execution_ok:
+            return []
+        return [
+            (list(self.benchmark.columns), list(self.result_ai.columns)),
+            (self.benchmark.events, self.result_ai.events),
+        ]
+
+    # Segunda fase: métricas y json de resultados.
+    # `metrics`: (Opcional) métricas de columnas y eventos ya calculadas para metric_pairs().
+    def evaluate(self, evaluator: EvaluationSQLScripts | None = None, metrics: List[Tuple] | None = None) -> Dict[str, Any]:
+        execution_ok, result_ai = self.execution_ok, self.result_ai
 
         # Aquí generamos la primera marca de tiempo que será la ejecución de los resultados.
         self.evaluation_datetime = datetime.now().isoformat(timespec="seconds")
 
         if execution_ok:
 
-            # Llegados a este punto, instanciamos la clase que encapsula las métricas.
-            self.evaluator = EvaluationSQLScripts()
+            # Llegados a este punto, instanciamos la clase que encapsula las métricas (o usamos la compartida).
+            self.evaluator = evaluator or EvaluationSQLScripts()
 
-            # Iniciamos la carga del dataset benchmark
-            df_benchmark = self.df_benchmark
+            # Iniciamos la carga del dataset benchmark (filas, columnas y eventos ya calculados)
+            benchmark = self.benchmark
 
             # Referente al df benchmark
-            df_benchmark_total_rows = len(df_benchmark)
+            df_benchmark_total_rows = benchmark.total_rows
 
             # Capturamos las columnas del df benchmark
-            df_benchmark_list_columns = df_benchmark.columns.tolist()
+            df_benchmark_list_columns = list(benchmark.columns)
 
             # Número de columnas del df benchmark
             df_benchmark_num_columns = len(df_benchmark_list_columns)
 
             # Capturamos los valores únicos de la columna activity
-            df_benchmark_list_events = df_benchmark.activity.unique().tolist()
+            df_benchmark_list_events = benchmark.events
 
             # Número de eventos únicos del df benchmark
             df_benchmark_num_events = len(df_benchmark_list_events)
 
-            # Referente al df generado por la AI Tool
-            df_ai_total_rows = len(df_ai)
+            # Referente al resultado generado por la AI Tool (acumulado por bloques en _run_sql)
+            df_ai_total_rows = result_ai.total_rows
 
-            # Capturamos las columnas del df generado por la AI Tool
-            df_ai_list_columns = df_ai.columns.tolist()
+            # Capturamos las columnas del resultado generado por la AI Tool
+            df_ai_list_columns = result_ai.columns
 
-            # Número de columnas del df generado por la AI Tool
+            # Número de columnas del resultado generado por la AI Tool
             df_ai_num_columns = len(df_ai_list_columns)
 
             # Capturamos los valores únicos de la columna activity
-            df_ai_list_events = df_ai.activity.unique().tolist()
+            df_ai_list_events = result_ai.events
 
-            # Número de eventos únicos del df generado por la AI Tool
+            # Número de eventos únicos del resultado generado por la AI Tool
             df_ai_num_events = len(df_ai_list_events)
 
-            # Capturamos las columnas del df generado por la AI Tool
-            df_ai_tool_list_columns = df_ai.columns.tolist()
-
-            # Calculamos las métricas
-            f1_c, precision_c, recall_c, TP_c, FP_c, FN_c, match_dict_c = self.evaluator._list_elements_metrics_F1(df_benchmark_list_columns, df_ai_tool_list_columns, score_threshold=0.4)
-            f1_e, precision_e, recall_e, TP_e, FP_e, FN_e, match_dict_e = self.evaluator._list_elements_metrics_F1(df_benchmark_list_events, df_ai_list_events, score_threshold=0.4)
+            # Capturamos las columnas del resultado generado por la AI Tool
+            df_ai_tool_list_columns = list(df_ai_list_columns)
+
+            # Calculamos las métricas de columnas y eventos (con una sola llamada de embeddings), si no nos las han pasado
+            if metrics is None:
+                metrics = self.evaluator._list_elements_metrics_F1_many(
+                    [(df_benchmark_list_columns, df_ai_tool_list_columns), (df_benchmark_list_events, df_ai_list_events)],
+                    score_threshold=SCORE_THRESHOLD,
+                )
+            f1_c, precision_c, recall_c, TP_c, FP_c, FN_c, match_dict_c = metrics[0]
+            f1_e, precision_e, recall_e, TP_e, FP_e, FN_e, match_dict_e = metrics[1]
             coverage = self.evaluator._coverage_total_rows(df_benchmark_total_rows, df_ai_total_rows)
 
             # Recuperamos el modelo de embeddings usado
@@ -265,6 +582,11 @@ class ResultsSQLScripts:
 
                 # Métrica de ejecución.
                 "execution_ok": execution_ok,
+                "execution_backend": self.execution_backend,
+                "execution_failure_reason": None,
+                "execution_failure": {},
+                "plan_total_cost": self.plan.get("plan_total_cost"),
+                "plan_rows": self.plan.get("plan_rows"),
 
                 # Métricas de evaluación.
                 "coverage": coverage,
@@ -292,7 +614,9 @@ class ResultsSQLScripts:
                 "columns_list_benchmark": df_benchmark_list_columns,
                 "columns_list_ai_tool": df_ai_list_columns,
                 "events_list_benchmark": df_benchmark_list_events,
-                "events_list_ai_tool": df_ai_list_events
+                "events_list_ai_tool": df_ai_list_events,
+                # Filas de cada evento del resultado de la AI Tool (null si no se conocen)
+                "events_rows_ai_tool": [[event, rows] for event, rows in result_ai.event_counts.items()],
             }
         else:
             # Diccionario si la ejecución de la SQL es fallida.
@@ -303,6 +627,13 @@ class ResultsSQLScripts:
 
                 # Métrica de ejecución.
                 "execution_ok": execution_ok,
+                "execution_backend": self.execution_backend,
+                # Motivo del fallo (sql_error, statement_timeout, cancelled, plan_cost_exceeded, plan_rows_exceeded,
+                # database_unavailable, internal_error) y detalle
+                "execution_failure_reason": self.execution_failure.get("reason"),
+                "execution_failure": self.execution_failure,
+                "plan_total_cost": self.plan.get("plan_total_cost"),
+                "plan_rows": self.plan.get("plan_rows"),
 
                 # Métricas de evaluación.
                 "coverage": 0,
@@ -329,17 +660,154 @@ class ResultsSQLScripts:
                 "columns_list_benchmark": [],
                 "columns_list_ai_tool": [],
                 "events_list_benchmark": [],
-                "events_list_ai_tool": []
+                "events_list_ai_tool": [],
+                "events_rows_ai_tool": [],
             }
 
         # guardar JSON, manteniendo id para mejorar la auditoría de resultados.
-        out_json = self.results_json_dir / f"Result_{self.test_id}.json"
+        out_json = self.result_json_path
         with out_json.open("w", encoding="utf-8") as f:
             json.dump(results, f, indent=2, ensure_ascii=False)
         logger.info(f"Archivo `json` de resultados, gauardado: {out_json}")
         return results
 
 
+def create_results_engine(pool_size: int) -> Engine:
+    """
+    Motor de PostgreSQL compartido por la evaluación en paralelo, con un pool de `pool_size` conexiones.
+    """
+    credentials = [os.getenv(name) for name in ("DB_USER", "DB_PASSWORD", "DB_HOST", "DB_PORT", "DB_NAME")]
+    if not all(credentials):
+        logger.error("Credenciales de la base de datos incompletas")
+        raise EnvironmentError("Credenciales de la base de datos incompletas")
+    db_user, db_password, db_host, db_port, db_name = credentials
+    return create_engine(
+        f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}",
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_pre_ping=True,
+    )
+
+def evaluate_experiments(
+    files: List[Path],
+    df_benchmark: pd.DataFrame,
+    ai_csv_dir: str,
+    results_json_dir: str,
+    workers: int = 4,
+    db_concurrency: int | None = None,
+    engine: Engine | None = None,
+    manifest: EvaluationManifest | None = None,
+    sandbox: SandboxDatabase | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Evalúa varios experimentos en paralelo:
+    1. Las SQL se ejecutan en `workers` hilos con un único motor (pool de conexiones) y como mucho
+       `db_concurrency` consultas a la vez en la base de datos.
+    2. Los embeddings de columnas y eventos de todos los experimentos se generan juntos, por lotes.
+    3. Se calculan las métricas y se guardan los json de resultados.
+    Un experimento que falla se registra en el log y no detiene al resto.
+
+    Con `manifest` (evaluación incremental, ver result_manifest.py) los experimentos sin cambios se saltan,
+    las SQL sin cambios no se vuelven a ejecutar, y se guarda un checkpoint tras cada fase de cada experimento.
+
+    Con `sandbox` las SQL se ejecutan en DuckDB (ver sandbox.py) y no se conecta a PostgreSQL.
+    """
+    db_concurrency = db_concurrency or workers
+    own_engine = engine is None and sandbox is None
+    if own_engine:
+        engine = create_results_engine(db_concurrency)
+    db_semaphore = threading.BoundedSemaphore(db_concurrency)
+    # El benchmark se resume una sola vez para todos los experimentos
+    benchmark = ResultAccumulator.from_dataframe(df_benchmark)
+    total = len(files)
+    start = time.perf_counter()
+
+    def execute(file: Path) -> ResultsSQLScripts:
+        results = ResultsSQLScripts(
+            log_json_path=file,
+            df_benchmark=df_benchmark,
+            ai_csv_dir=ai_csv_dir,
+            results_json_dir=results_json_dir,
+            engine=engine,
+            db_semaphore=db_semaphore,
+            benchmark=benchmark,
+            sandbox=sandbox,
+        )
+        if manifest is None:
+            results.execute()
+            return results
+
+        digest = results.sql_digest
+        if manifest.is_evaluated(results.test_id, digest, results.result_json_path):
+            results.skipped = True
+            return results
+        execution = manifest.execution(results.test_id, digest)
+        if execution is not None:
+            results.restore_execution(execution)
+            return results
+        results.execute()
+        if results.cacheable:
+            manifest.record_execution(results.test_id, digest, results.execution_summary())
+        return results
+
+    executed: List[ResultsSQLScripts] = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="results") as pool:
+            futures = {pool.submit(execute, file): file for file in files}
+            for done, future in enumerate(as_completed(futures), start=1):
+                file = futures[future]
+                try:
+                    executed.append(future.result())
+                    status = "OK" if executed[-1].execution_ok else "SQL fallida"
+                    if executed[-1].skipped:
+                        status = "sin cambios, ya evaluado"
+                except Exception as e:
+                    status = "error"
+                    logger.error(f"No se pudo evaluar {file}: {e}")
+                logger.info(f"[{done}/{total}] SQL ejecutada ({status}) {Path(file).name} - {time.perf_counter() - start:.1f}s")
+    finally:
+        if own_engine:
+            engine.dispose()
+
+    # Mismo orden que la lista de ficheros
+    order = {Path(file).resolve(): i for i, file in enumerate(files)}
+    executed.sort(key=lambda results: order[results.log_json_path.resolve()])
+
+    # Resultados por experimento, en el orden de la lista de ficheros
+    summaries_by_id: Dict[str, Dict[str, Any]] = {}
+    # Los experimentos sin cambios devuelven su json de resultados anterior
+    for results in executed:
+        if results.skipped:
+            with results.result_json_path.open("r", encoding="utf-8") as f:
+                summaries_by_id[results.test_id] = json.load(f)
+
+    pending = [results for results in executed if not results.skipped]
+    if pending:
+        evaluator = EvaluationSQLScripts()
+        # Métricas de columnas y eventos de todos los experimentos de una vez, con los textos deduplicados.
+        # Los que tienen alguna lista vacía se evalúan por separado, para que su error no afecte al resto.
+        batch = [results for results in pending if results.metric_pairs() and all(all(pair) for pair in results.metric_pairs())]
+        batch_metrics: Dict[int, List[Tuple]] = {}
+        if batch:
+            pairs = [pair for results in batch for pair in results.metric_pairs()]
+            metrics = evaluator._list_elements_metrics_F1_many(pairs, score_threshold=SCORE_THRESHOLD)
+            batch_metrics = {id(results): metrics[2 * i:2 * i + 2] for i, results in enumerate(batch)}
+        for done, results in enumerate(pending, start=1):
+            try:
+                summaries_by_id[results.test_id] = results.evaluate(evaluator, batch_metrics.get(id(results)))
+                if manifest is not None and results.cacheable:
+                    manifest.record_evaluation(results.test_id, results.sql_digest)
+            except Exception as e:
+                logger.error(f"No se pudieron calcular las métricas de {results.log_json_path}: {e}")
+            logger.info(f"[{done}/{len(pending)}] Métricas calculadas {results.test_id}")
+
+    summaries = [summaries_by_id[results.test_id] for results in executed if results.test_id in summaries_by_id]
+    logger.info(
+        f"Evaluados {len(summaries)} de {total} experimentos ({len(executed) - len(pending)} sin cambios) "
+        f"en {time.perf_counter() - start:.1f}s"
+    )
+    return summaries
+
 #  main (Llamada a  la main)
 def main():
 
@@ -352,23 +820,42 @@ def main():
         logger.error(f"El fichero de control no se ha encontrado: {path_file}")
         raise FileNotFoundError(f"El fichero de control no se ha encontrado: {path_file}")
 
-    # Cargamos el df benchmark
-    df_benchmark = pd.read_csv(path_file)
-
-    # Por cada archivo json en la carpeta "output", que empiece por TestToolAgent_
-    for file in Path("output").glob("TestToolAgent_*.json"):
-
-        # Instanciamos la clase
-        results = ResultsSQLScripts(
-            log_json_path=file,
-            df_benchmark=df_benchmark,
-            ai_csv_dir="results/csv/AI_tool",
-            results_json_dir="results/json",
-        )
-        # Ejecutamos el proceso de generación de resultados
-        summary = results.run()
+    # Cargamos el df benchmark (desde su copia Parquet a partir de la segunda ejecución, ver result_io.py)
+    df_benchmark = load_benchmark(path_file)
+
+    # Todos los archivos json (o json.gz) en la carpeta "output", que empiecen por TestToolAgent_,
+    # se evalúan en paralelo (RESULTS_WORKERS hilos, RESULTS_DB_CONCURRENCY consultas a la vez)
+    workers = int(os.getenv("RESULTS_WORKERS", 4))
+
+    # Con EVALUATION_BACKEND=DUCKDB, las SQL se ejecutan en el sandbox y los resultados se guardan aparte
+    sandbox = SandboxDatabase.from_env() if evaluation_backend() == "DUCKDB" else None
+    results_json_dir = "results/json" if sandbox is None else "results/json/sandbox"
+    ai_csv_dir = "results/csv/AI_tool" if sandbox is None else "results/csv/AI_tool/sandbox"
+
+    # Evaluación incremental: solo se evalúan los experimentos cuya SQL, benchmark o evaluador han cambiado
+    manifest = EvaluationManifest(
+        Path(results_json_dir) / MANIFEST_NAME,
+        benchmark_hash=file_hash(path_file),
+        evaluator_version=EVALUATOR_VERSION,
+        incremental=is_incremental(),
+    )
+    summaries = evaluate_experiments(
+        files=list(iter_experiment_files("output")),
+        df_benchmark=df_benchmark,
+        ai_csv_dir=ai_csv_dir,
+        results_json_dir=results_json_dir,
+        workers=workers,
+        db_concurrency=int(os.getenv("RESULTS_DB_CONCURRENCY", workers)),
+        manifest=manifest,
+        sandbox=sandbox,
+    )
+    for summary in summaries:
         print(summary)
 
+    # Aciertos y fallos de la caché local de embeddings en esta ejecución
+    for name, stats in embedding_cache_stats().items():
+        logger.info(f"Caché de embeddings {name}: {stats}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,264 @@
+###############################################
+# result_io.py
+###############################################
+# Notas:
+# Entrada/salida de los resultados de la evaluación con Arrow (pyarrow).
+#
+# - Resultado de la SQL de la AI Tool: por defecto (RESULTS_OUTPUT_FORMAT=PARQUET) se guarda en
+#   results/csv/AI_tool/<id>.parquet, comprimido (RESULTS_PARQUET_COMPRESSION, zstd por defecto) y con tipos.
+#   Cada bloque leído del cursor (ver `_run_sql` en result_generator.py) se escribe como un row group,
+#   así nunca está el resultado completo en memoria. El esquema sale de los tipos de PostgreSQL del cursor
+#   (numeric -> float64, timestamp -> timestamp, ...), y si no se conocen, del primer bloque.
+#   Con RESULTS_OUTPUT_FORMAT=CSV se escribe el `csv` como antes.
+# - Benchmark: `load_benchmark` lee el `csv` una sola vez y lo guarda junto a él en Parquet
+#   (mimicel.csv -> mimicel.parquet); las siguientes ejecuciones leen el Parquet mientras el `csv` no cambie.
+#   Con tipos: las marcas de tiempo (`timestamps` y las columnas terminadas en `time`, p. ej. `intime`) como datetime64
+#   y las columnas de texto con pocos valores distintos (p. ej. `activity`) como categorías.
+#   Las copias Parquet de una versión anterior (sin tipos) se vuelven a generar.
+#
+# Los ficheros se escriben en un temporal y se renombran al terminar, para no dejar ficheros a medias.
+#
+# Parquet no admite columnas con el mismo nombre (p. ej. `SELECT e.*, t.*` con `stay_id` en ambas): en el fichero
+# se renombran (`stay_id`, `stay_id_1`), las métricas usan los nombres originales del resultado.
+# Un error al escribir el fichero no es un fallo de la SQL: se registra, se descarta el fichero y la evaluación sigue.
+
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# OID de los tipos de PostgreSQL (pg_type) -> tipo Arrow. El resto se guarda como texto.
+_PG_TYPES: Dict[int, pa.DataType] = {
+    16: pa.bool_(),                       # bool
+    20: pa.int64(),                       # int8
+    21: pa.int64(),                       # int2
+    23: pa.int64(),                       # int4
+    700: pa.float64(),                    # float4
+    701: pa.float64(),                    # float8
+    1700: pa.float64(),                   # numeric (Decimal)
+    1082: pa.date32(),                    # date
+    1114: pa.timestamp("us"),             # timestamp
+    1184: pa.timestamp("us", tz="UTC"),   # timestamptz
+}
+
+# Proporción máxima de valores distintos para guardar una columna de texto del benchmark como categoría
+_CATEGORY_RATIO = 0.5
+
+# Columnas del benchmark que son marcas de tiempo (`timestamps` en MIMICEL, `intime`, `charttime`, ...)
+_TIMESTAMP_COLUMN = re.compile(r"(time|timestamps?)$", re.IGNORECASE)
+
+# Versión de la copia Parquet del benchmark: si cambian los tipos, las copias anteriores se vuelven a generar
+_BENCHMARK_CACHE_VERSION = "2"
+_BENCHMARK_CACHE_KEY = b"benchmark_cache_version"
+
+def result_format() -> str:
+    """
+    Formato del resultado de la SQL de la AI Tool: PARQUET (por defecto) o CSV.
+    """
+    return os.getenv("RESULTS_OUTPUT_FORMAT", "PARQUET").upper()
+
+def schema_from_cursor(description: Sequence[Any] | None) -> pa.Schema | None:
+    """
+    Esquema Arrow a partir de `cursor.description` (psycopg2: name, type_code, ...).
+    Devuelve None si el driver no informa de los tipos (p. ej. otros motores).
+    """
+    if not description or any(not isinstance(column[1], int) for column in description):
+        return None
+    return pa.schema([(column[0], _PG_TYPES.get(column[1], pa.string())) for column in description])
+
+def _unique_names(columns: List[str]) -> List[str]:
+    """
+    Nombres de columna sin repetidos: la segunda `stay_id` pasa a `stay_id_1` (sin chocar con otra columna).
+    """
+    taken = set(columns)
+    seen: set = set()
+    names = []
+    for column in columns:
+        name, n = column, 0
+        while name in seen or (n and name in taken):
+            n += 1
+            name = f"{column}_{n}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+def _infer_schema(df: pd.DataFrame) -> pa.Schema:
+    """
+    Esquema Arrow del primer bloque. Las columnas sin ningún valor (tipo null) se guardan como texto.
+    """
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    return pa.schema([
+        pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+        for field in schema
+    ])
+
+def _to_table(df: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+    """
+    Convierte el bloque al esquema. Los Decimal de `numeric` se pasan a float, y los tipos sin equivalente
+    (uuid, interval, json, ...) a texto, antes de convertir.
+    """
+    df = df.copy()
+    for field in schema:
+        if pa.types.is_floating(field.type) and df[field.name].dtype == object:
+            df[field.name] = df[field.name].astype("float64")
+        elif pa.types.is_string(field.type):
+            df[field.name] = df[field.name].astype("string")
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+class ResultWriter:
+    """
+    Escritor por bloques del resultado de la SQL (Parquet o CSV, ver notas del módulo).
+    Uso: `write(df)` por cada bloque, `commit()` al terminar bien y `abort()` si falla.
+    Si no se puede escribir, el fichero se descarta, `error` guarda el motivo y `commit()` devuelve None
+    (sin lanzar la excepción: la SQL se ha ejecutado bien).
+    """
+
+    def __init__(self, path: Path, schema: pa.Schema | None = None) -> None:
+        self.path = Path(path)
+        self.format = "CSV" if self.path.suffix == ".csv" else "PARQUET"
+        self.compression = os.getenv("RESULTS_PARQUET_COMPRESSION", "zstd")
+        self._tmp = self.path.with_name(self.path.name + ".tmp")
+        if schema is not None and len(set(schema.names)) != len(schema.names):
+            schema = pa.schema([field.with_name(name) for field, name in zip(schema, _unique_names(schema.names))])
+        self._schema = schema
+        self.error: Exception | None = None
+        self._parquet: pq.ParquetWriter | None = None
+        self._rows = 0
+        self._columns: List[str] | None = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.error is not None:
+            return
+        if self._columns is None:
+            self._columns = df.columns.tolist()
+        if df.empty and self._rows:
+            return
+        try:
+            if self.format == "CSV":
+                first = self._rows == 0
+                df.to_csv(self._tmp, index=False, header=first, mode="w" if first else "a")
+            else:
+                df = df.set_axis(_unique_names(df.columns.tolist()), axis=1)
+                if self._parquet is None:
+                    self._schema = self._schema or _infer_schema(df)
+                    self._parquet = pq.ParquetWriter(self._tmp, self._schema, compression=self.compression)
+                self._parquet.write_table(_to_table(df, self._schema))
+            self._rows += len(df)
+        except Exception as e:
+            self._fail(e)
+
+    def commit(self) -> Path | None:
+        """
+        Cierra el fichero y lo mueve a su ruta final. Un resultado sin bloques se guarda solo con las columnas.
+        Devuelve None si no se ha podido escribir (ver `error`).
+        """
+        if self.error is not None:
+            return None
+        try:
+            if self._rows == 0 and self._parquet is None and self.format == "PARQUET":
+                empty = pd.DataFrame(columns=_unique_names(self._columns or []))
+                schema = self._schema or _infer_schema(empty)
+                pq.write_table(_to_table(empty, schema), self._tmp, compression=self.compression)
+            elif self._rows == 0 and self.format == "CSV" and not self._tmp.exists():
+                pd.DataFrame(columns=self._columns or []).to_csv(self._tmp, index=False)
+            if self._parquet is not None:
+                self._parquet.close()
+            self._tmp.replace(self.path)
+        except Exception as e:
+            self._fail(e)
+            return None
+        return self.path
+
+    def _fail(self, error: Exception) -> None:
+        self.error = error
+        logger.error(f"No se pudo escribir el resultado {self.path}, se descarta el fichero: {error}")
+        self.abort()
+
+    def abort(self) -> None:
+        if self._parquet is not None:
+            try:
+                self._parquet.close()
+            except Exception:
+                pass
+            self._parquet = None
+        self._tmp.unlink(missing_ok=True)
+
+def result_path(directory: Path, test_id: str) -> Path:
+    """
+    Ruta del resultado de la SQL de la AI Tool según RESULTS_OUTPUT_FORMAT.
+    """
+    suffix = ".csv" if result_format() == "CSV" else ".parquet"
+    return Path(directory) / f"{test_id}{suffix}"
+
+def read_result(path: Path, columns: List[str] | None = None) -> pd.DataFrame:
+    """
+    Lee un resultado guardado (Parquet o CSV).
+    """
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+def _parse_timestamps(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convierte a datetime64 las columnas de texto del benchmark con nombre de marca de tiempo (ver _TIMESTAMP_COLUMN).
+    Si alguna no se puede convertir, se deja como texto.
+    """
+    for column in df.columns:
+        if df[column].dtype == object and _TIMESTAMP_COLUMN.search(str(column)):
+            try:
+                df[column] = pd.to_datetime(df[column], format="ISO8601")
+            except (ValueError, TypeError):
+                logger.warning(f"La columna {column} del benchmark no es una marca de tiempo ISO 8601, se deja como texto")
+    return df
+
+def _categorize(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convierte a categoría las columnas de texto con pocos valores distintos.
+    """
+    for column in df.columns:
+        if df[column].dtype == object and len(df) and df[column].nunique(dropna=False) / len(df) <= _CATEGORY_RATIO:
+            df[column] = df[column].astype("category")
+    return df
+
+def _benchmark_cache_is_valid(csv_path: Path, parquet_path: Path) -> bool:
+    """
+    La copia Parquet es válida si es posterior al `csv` y de la versión actual (_BENCHMARK_CACHE_VERSION).
+    """
+    if not parquet_path.is_file() or parquet_path.stat().st_mtime < csv_path.stat().st_mtime:
+        return False
+    try:
+        metadata = pq.read_schema(parquet_path).metadata or {}
+    except Exception:
+        return False
+    return metadata.get(_BENCHMARK_CACHE_KEY) == _BENCHMARK_CACHE_VERSION.encode()
+
+def load_benchmark(csv_path: Path) -> pd.DataFrame:
+    """
+    Carga el benchmark desde su copia Parquet si está al día, o desde el `csv` (y guarda la copia Parquet).
+    """
+    csv_path = Path(csv_path)
+    parquet_path = csv_path.with_suffix(".parquet")
+    if _benchmark_cache_is_valid(csv_path, parquet_path):
+        logger.info(f"Benchmark cargado desde la copia Parquet {parquet_path}")
+        return pd.read_parquet(parquet_path)
+
+    df = _categorize(_parse_timestamps(pd.read_csv(csv_path)))
+    tmp = parquet_path.with_name(parquet_path.name + ".tmp")
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), _BENCHMARK_CACHE_KEY: _BENCHMARK_CACHE_VERSION.encode()})
+        pq.write_table(table, tmp, compression=os.getenv("RESULTS_PARQUET_COMPRESSION", "zstd"))
+        tmp.replace(parquet_path)
+        logger.info(f"Copia Parquet del benchmark guardada en {parquet_path}")
+    except Exception as e:
+        tmp.unlink(missing_ok=True)
+        logger.warning(f"No se pudo guardar la copia Parquet del benchmark: {e}")
+    return df
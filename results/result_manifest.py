@@ -0,0 +1,123 @@
+###############################################
+# result_manifest.py
+###############################################
+# Notas:
+# Manifiesto de la evaluación incremental (results/json/evaluation_manifest.json).
+# Evaluar un experimento supone ejecutar su SQL (lo más caro) y calcular las métricas contra el benchmark.
+# Por cada experimento se guarda lo necesario para no repetir ninguna de las dos fases:
+#
+# - Ejecución: hash de la SQL (y de los límites de ejecución, ver sql_guard.py) y resumen del resultado
+#   (ok, filas, columnas y eventos, ver ResultAccumulator). Si no han cambiado, no se vuelve a ejecutar.
+#   Solo se guardan las ejecuciones correctas y los errores de la propia SQL (`sql_error`): los fallos que dependen
+#   del momento (base de datos caída, timeouts, cancelaciones, límites del EXPLAIN) no se guardan y se reintentan.
+# - Evaluación: hash de la SQL, hash del benchmark y versión del evaluador (EVALUATOR_VERSION en evaluator.py).
+#   Si ninguno ha cambiado y existe el json de resultados, el experimento se salta por completo.
+#
+# El manifiesto se guarda (escritura atómica) después de cada experimento, así una evaluación
+# interrumpida continúa donde se quedó.
+#
+# RESULTS_INCREMENTAL=NO vuelve a evaluar todos los experimentos (el manifiesto se actualiza igualmente).
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "evaluation_manifest.json"
+
+def sql_hash(sql: str, settings: Dict[str, Any] | None = None) -> str:
+    """
+    Hash de la SQL (sin espacios al principio y al final) y, si los hay, de los ajustes de su ejecución.
+    """
+    digest = hashlib.sha256(sql.strip().encode("utf-8"))
+    if settings:
+        digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+def file_hash(path: Path) -> str:
+    """
+    Hash del contenido de un fichero (el benchmark), leído por bloques.
+    """
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def is_incremental() -> bool:
+    return os.getenv("RESULTS_INCREMENTAL", "YES").upper() == "YES"
+
+class EvaluationManifest:
+    """
+    Manifiesto {id del experimento: entrada} con checkpoint en disco tras cada cambio (ver notas del módulo).
+    """
+
+    def __init__(self, path: Path, benchmark_hash: str, evaluator_version: str, incremental: bool = True) -> None:
+        self.path = Path(path)
+        self.benchmark_hash = benchmark_hash
+        self.evaluator_version = evaluator_version
+        self.incremental = incremental
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if self.path.is_file():
+            try:
+                self._entries = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Manifiesto de evaluación ilegible, se empieza de cero: {e}")
+
+    def execution(self, test_id: str, sql_digest: str) -> Dict[str, Any] | None:
+        """
+        Resumen de la ejecución guardada si la SQL no ha cambiado, o None.
+        """
+        if not self.incremental:
+            return None
+        entry = self._entries.get(test_id) or {}
+        if entry.get("sql_hash") == sql_digest and "execution" in entry:
+            return entry["execution"]
+        return None
+
+    def is_evaluated(self, test_id: str, sql_digest: str, result_json: Path) -> bool:
+        """
+        Si el experimento ya se evaluó con la misma SQL, el mismo benchmark y la misma versión del evaluador.
+        """
+        if not self.incremental or not Path(result_json).is_file():
+            return False
+        entry = self._entries.get(test_id) or {}
+        return (
+            entry.get("sql_hash") == sql_digest
+            and entry.get("benchmark_hash") == self.benchmark_hash
+            and entry.get("evaluator_version") == self.evaluator_version
+        )
+
+    def record_execution(self, test_id: str, sql_digest: str, execution: Dict[str, Any]) -> None:
+        """
+        Checkpoint tras ejecutar la SQL. Invalida la evaluación anterior del experimento.
+        """
+        with self._lock:
+            self._entries[test_id] = {"sql_hash": sql_digest, "execution": execution}
+            self._save()
+
+    def record_evaluation(self, test_id: str, sql_digest: str) -> None:
+        """
+        Checkpoint tras guardar el json de resultados.
+        """
+        with self._lock:
+            entry = self._entries.setdefault(test_id, {"sql_hash": sql_digest})
+            entry.update({
+                "benchmark_hash": self.benchmark_hash,
+                "evaluator_version": self.evaluator_version,
+                "evaluated_at": datetime.now().isoformat(timespec="seconds"),
+            })
+            self._save()
+
+    def _save(self) -> None:
+        """
+        Escritura atómica (temporal + rename), con el lock tomado.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self._entries, indent=2, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.path)
@@ -0,0 +1,236 @@
+###############################################
+# sandbox.py
+###############################################
+# Notas:
+# Base de datos de pruebas (sandbox) para ejecutar las SQL generadas por la AI Tool sin la instancia
+# de PostgreSQL de MIMIC-IV (acceso restringido, DB_USER/DB_HOST...).
+#
+# Con EVALUATION_BACKEND=DUCKDB la evaluación (ver `_run_sql` en result_generator.py) ejecuta las SQL en una
+# base de datos DuckDB en memoria, construida a partir de `knowledge/ed_schema.json`:
+# - Un esquema con el nombre de `schema_db` (module_ed) y sus tablas, con los tipos declarados en el json.
+# - Filas sintéticas: SANDBOX_STAYS estancias en urgencias y sus filas en el resto de tablas.
+#   Los valores salen de `most_frequent_values` (con su frecuencia) o de `range` de cada campo;
+#   los campos con `link_to` apuntan a una fila de la tabla enlazada (y copian su subject_id),
+#   y las marcas de tiempo de cada estancia caen entre su `intime` y su `outtime`.
+#
+# Las SQL se ejecutan en milisegundos, así se puede comprobar en local, y en paralelo, que todas las SQL
+# generadas se ejecutan y que devuelven las columnas y los eventos esperados, antes de usar la base de datos real.
+# Las filas son sintéticas: el número de filas (coverage) no es comparable con el benchmark.
+#
+# Las SQL están escritas para PostgreSQL: antes de ejecutarlas se traducen al dialecto de DuckDB con sqlglot
+# (ver `to_duckdb`). Los datos son deterministas para una misma semilla (SANDBOX_SEED).
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List
+
+import duckdb
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+logger = logging.getLogger(__name__)
+
+# Esquema de la base de datos documentado (módulo ED de MIMIC-IV)
+SANDBOX_SCHEMA_PATH = Path("knowledge/ed_schema.json")
+
+# Marcas de tiempo de la estancia: las filas de las tablas enlazadas caen entre ambas
+_STAY_WINDOW = ("intime", "outtime")
+
+# Proporción de nulos en los campos `nullable` (que no son claves)
+_NULL_RATIO = 0.1
+
+# Primer identificador de las claves sintéticas (parecidos a los de MIMIC-IV)
+_ID_BASE = 10_000_000
+
+def evaluation_backend() -> str:
+    """
+    Motor donde se ejecutan las SQL en la evaluación: POSTGRES (por defecto) o DUCKDB (sandbox).
+    """
+    return os.getenv("EVALUATION_BACKEND", "POSTGRES").upper()
+
+def to_duckdb(sql: str) -> str:
+    """
+    Traduce una SQL de PostgreSQL al dialecto de DuckDB.
+    PostgreSQL nombra `vs.subject_id::INTEGER` sin alias como `subject_id` y DuckDB como `CAST(...)`:
+    se añade el alias explícito para que las columnas del resultado sean las mismas.
+    Si sqlglot no puede leer la SQL, se devuelve tal cual (y el error lo dará DuckDB).
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read="postgres")
+    except SqlglotError:
+        return sql
+    for select in tree.find_all(exp.Select):
+        for projection in select.expressions:
+            if isinstance(projection, exp.Cast) and projection.output_name:
+                projection.replace(exp.alias_(projection.copy(), projection.output_name))
+    return tree.sql(dialect="duckdb")
+
+def _is_missing(value: Any) -> bool:
+    return value is None or value == "N/A"
+
+class _FieldGenerator:
+    """
+    Valores sintéticos de un campo de ed_schema.json.
+    """
+
+    def __init__(self, field: Dict[str, Any]) -> None:
+        self.name = field["name"]
+        self.type = field["type"].upper()
+        self.nullable = field.get("nullable", True) and not field.get("is_pk") and not field.get("is_fk")
+        values = [item for item in field.get("most_frequent_values", []) if not _is_missing(item.get("value"))]
+        self.values = [item["value"] for item in values]
+        self.weights = [max(item.get("count", 0), 1) for item in values]
+        field_range = field.get("range") or {}
+        self.min, self.max = field_range.get("min"), field_range.get("max")
+        if _is_missing(self.min) or _is_missing(self.max):
+            self.min = self.max = None
+        length = re.search(r"VARCHAR\((\d+)\)", self.type)
+        self.length = int(length.group(1)) if length else None
+
+    def value(self, rng: random.Random, index: int, window: tuple | None = None) -> Any:
+        if self.nullable and rng.random() < _NULL_RATIO:
+            return None
+        if self.values:
+            return rng.choices(self.values, weights=self.weights)[0]
+        if self.type == "TIMESTAMP":
+            start, end = window or (datetime.fromisoformat(self.min), datetime.fromisoformat(self.max))
+            return start + timedelta(seconds=rng.randint(0, int((end - start).total_seconds())))
+        if self.type in ("INTEGER", "SMALLINT"):
+            if self.min is None:
+                # Identificadores sin rango (subject_id, hadm_id, ...) y contadores (med_rn, ...)
+                return _ID_BASE + rng.randrange(index + 1) if self.name.endswith("_id") else rng.randint(1, 9)
+            return rng.randint(int(float(self.min)), int(float(self.max)))
+        if self.type.startswith("NUMERIC"):
+            low, high = (float(self.min), float(self.max)) if self.min is not None else (0.0, 100.0)
+            return round(rng.uniform(low, high), 4)
+        text = f"{self.name}_{rng.randrange(50)}"
+        return text[:self.length] if self.length else text
+
+class SandboxDatabase:
+    """
+    Base de datos DuckDB en memoria con las tablas de ed_schema.json y filas sintéticas (ver notas del módulo).
+    Cada hilo pide su propia conexión con `connect()` (DuckDB comparte la base de datos entre cursores).
+    """
+
+    # Errores de DuckDB al ejecutar una SQL (errores de la propia SQL, ver failure_from_exception)
+    errors = duckdb.Error
+
+    def __init__(self, schema_path: Path = SANDBOX_SCHEMA_PATH, stays: int = 1000, rows_per_stay: int = 4, seed: int = 42) -> None:
+        with Path(schema_path).open("r", encoding="utf-8") as f:
+            self.module = json.load(f)["module"]
+        self.schema = self.module["schema_db"]
+        self.stays = stays
+        self.rows_per_stay = rows_per_stay
+        self._rng = random.Random(seed)
+        self._con = duckdb.connect(":memory:")
+        self._lock = threading.Lock()
+        self.row_counts: Dict[str, int] = {}
+        self._build()
+
+    @classmethod
+    def from_env(cls) -> "SandboxDatabase":
+        return sandbox_database(
+            str(SANDBOX_SCHEMA_PATH),
+            int(os.getenv("SANDBOX_STAYS", 1000)),
+            int(os.getenv("SANDBOX_SEED", 42)),
+        )
+
+    def connect(self) -> duckdb.DuckDBPyConnection:
+        with self._lock:
+            return self._con.cursor()
+
+    def _ordered_tables(self) -> List[Dict[str, Any]]:
+        """
+        Tablas de ed_schema.json con las tablas enlazadas (`link_to`) antes que las que las enlazan.
+        """
+        tables = {table["name"]: table for table in self.module["tables"]}
+        ordered: List[Dict[str, Any]] = []
+
+        def visit(name: str) -> None:
+            if any(table["name"] == name for table in ordered):
+                return
+            for field in tables[name]["fields"]:
+                for link in field.get("link_to", []):
+                    if link["table"] in tables and link["table"] != name:
+                        visit(link["table"])
+            ordered.append(tables[name])
+
+        for name in tables:
+            visit(name)
+        return ordered
+
+    def _rows(self, table: Dict[str, Any], data: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Filas sintéticas de una tabla. Sin enlaces: SANDBOX_STAYS filas con clave primaria secuencial.
+        Con enlace: una fila por fila enlazada si el enlace es la única clave primaria (triage), o
+        `rows_per_stay` filas por fila enlazada de media.
+        """
+        rng = self._rng
+        fields = table["fields"]
+        links = [(field["name"], link) for field in fields for link in field.get("link_to", []) if link["table"] in data]
+        generators = {field["name"]: _FieldGenerator(field) for field in fields}
+        pk = [field["name"] for field in fields if field.get("is_pk")]
+
+        if not links:
+            parents, count = None, self.stays
+        else:
+            column, link = links[0]
+            parents = data[link["table"]]
+            count = len(parents) if pk == [column] else len(parents) * self.rows_per_stay
+
+        rows = []
+        for i in range(count):
+            row: Dict[str, Any] = {}
+            window = None
+            if parents is not None:
+                parent = parents[i if count == len(parents) else rng.randrange(len(parents))]
+                # Campo enlazado y campos con el mismo nombre que en la tabla enlazada (subject_id, ...)
+                row[column] = parent[link["column"]]
+                row.update({name: parent[name] for name in generators if name in parent and name not in row})
+                if all(name in parent for name in _STAY_WINDOW):
+                    window = (parent[_STAY_WINDOW[0]], parent[_STAY_WINDOW[1]])
+            for name, generator in generators.items():
+                if name in row:
+                    continue
+                if name in pk and parents is None and generator.type in ("INTEGER", "SMALLINT"):
+                    row[name] = 3 * _ID_BASE + i
+                elif name == _STAY_WINDOW[1] and _STAY_WINDOW[0] in row:
+                    row[name] = row[_STAY_WINDOW[0]] + timedelta(minutes=rng.randint(30, 24 * 60))
+                else:
+                    row[name] = generator.value(rng, i, window)
+            rows.append(row)
+        return rows
+
+    def _build(self) -> None:
+        con = self._con
+        con.execute(f"CREATE SCHEMA {self.schema}")
+        data: Dict[str, List[Dict[str, Any]]] = {}
+        for table in self._ordered_tables():
+            name = table["name"]
+            columns = [field["name"] for field in table["fields"]]
+            definition = ", ".join(f"{field['name']} {field['type']}" for field in table["fields"])
+            con.execute(f"CREATE TABLE {self.schema}.{name} ({definition})")
+            data[name] = self._rows(table, data)
+            # Se insertan de una vez desde un DataFrame
+            sandbox_rows = pd.DataFrame(data[name], columns=columns)
+            con.register("sandbox_rows", sandbox_rows)
+            con.execute(f"INSERT INTO {self.schema}.{name} SELECT * FROM sandbox_rows")
+            con.unregister("sandbox_rows")
+            self.row_counts[name] = len(sandbox_rows)
+        logger.info(f"Sandbox DuckDB creado ({self.schema}): {self.row_counts}")
+
+@lru_cache(maxsize=None)
+def sandbox_database(schema_path: str = str(SANDBOX_SCHEMA_PATH), stays: int = 1000, seed: int = 42) -> SandboxDatabase:
+    """
+    Sandbox compartido por todos los experimentos de la evaluación (se construye una sola vez por proceso).
+    """
+    return SandboxDatabase(Path(schema_path), stays=stays, seed=seed)
@@ -0,0 +1,224 @@
+###############################################
+# sql_guard.py
+###############################################
+# Notas:
+# Protección de la base de datos al ejecutar las SQL generadas por la AI Tool en la evaluación (ver `_run_sql`
+# en result_generator.py). Un `JOIN` mal planteado puede tardar horas contra MIMIC-IV y ocupar la base de datos compartida.
+#
+# Antes de ejecutar, en la misma transacción:
+# 1. `SET TRANSACTION READ ONLY`: la SQL no puede modificar nada.
+# 2. `SET LOCAL statement_timeout` (RESULTS_SQL_TIMEOUT_SECONDS): tiempo máximo de cada sentencia.
+# 3. `EXPLAIN (FORMAT JSON)`: se rechaza la SQL si el coste o las filas estimadas por el planificador superan
+#    RESULTS_SQL_MAX_COST o RESULTS_SQL_MAX_ROWS (0 = sin límite, el plan se guarda igualmente en los resultados
+#    para poder ajustar los límites).
+# Durante la ejecución, un watchdog (RESULTS_SQL_MAX_SECONDS) cancela la consulta en curso. Con cursor de servidor
+# cada bloque es una sentencia distinta, así que statement_timeout no limita el tiempo total; el watchdog sí.
+#
+# Los fallos se lanzan como SQLGuardError con un motivo estructurado (`reason`) que se guarda en Result_<id>.json.
+# Solo `sql_error` es un fallo de la propia SQL; el resto (base de datos caída, timeouts, límites) dependen del momento
+# o de la configuración, y la evaluación incremental los vuelve a intentar (ver result_manifest.py).
+# Solo se aplica con PostgreSQL; RESULTS_SQL_GUARD=NO lo desactiva.
+
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict
+
+from sqlalchemy import exc, text
+from sqlglot.dialects.dialect import Dialect
+from sqlglot.errors import SqlglotError
+
+logger = logging.getLogger(__name__)
+
+# Motivos de fallo que se guardan en los resultados
+REASON_PLAN_COST = "plan_cost_exceeded"
+REASON_PLAN_ROWS = "plan_rows_exceeded"
+REASON_TIMEOUT = "statement_timeout"
+REASON_CANCELLED = "cancelled"
+REASON_SQL_ERROR = "sql_error"
+REASON_UNAVAILABLE = "database_unavailable"
+REASON_INTERNAL = "internal_error"
+
+# SQLSTATE de PostgreSQL para una sentencia cancelada (por statement_timeout o por cancelación)
+_QUERY_CANCELED = "57014"
+# Clases de SQLSTATE que no dependen de la SQL: conexión, recursos, intervención del operador, sistema
+# y transacción abortada (interbloqueos)
+_UNAVAILABLE_CLASSES = ("08", "53", "57", "58", "40")
+
+def sql_body(sql: str) -> str:
+    """
+    SQL sin los comentarios ni los `;` del final, para poder envolverla (EXPLAIN, subconsulta del pushdown).
+    Se corta tras el último token de la SQL (sqlglot no devuelve los comentarios como tokens).
+    Si sqlglot no puede leerla, se devuelve sin espacios ni `;` finales (y el error lo dará la base de datos).
+    """
+    try:
+        tokens = Dialect.get_or_raise("postgres").tokenize(sql)
+    except SqlglotError:
+        return sql.strip().rstrip(";")
+    while tokens and tokens[-1].text == ";":
+        tokens.pop()
+    return sql[:tokens[-1].end + 1] if tokens else ""
+
+class SQLGuardError(Exception):
+    """
+    Fallo de la ejecución protegida:
+    - reason: (str) motivo, una de las constantes REASON_*.
+    - details: (dict) datos del fallo (coste y filas estimadas, límites, ...).
+    """
+
+    def __init__(self, reason: str, message: str, details: Dict[str, Any] | None = None) -> None:
+        super().__init__(message)
+        self.reason = reason
+        self.details = details or {}
+
+def failure_from_exception(error: Exception, cancelled: bool = False, sql_errors: tuple = ()) -> Dict[str, Any]:
+    """
+    Campos estructurados del fallo de una SQL: {"reason", "message", ...detalles}.
+    - sql_error: la base de datos ha rechazado la SQL (errores del driver con SQLSTATE, o de `sql_errors`).
+    - database_unavailable: sin conexión (psycopg2 sin SQLSTATE, pool agotado) o SQLSTATE de _UNAVAILABLE_CLASSES.
+    - internal_error: cualquier otro error del propio proceso de evaluación.
+    """
+    if isinstance(error, SQLGuardError):
+        return {"reason": error.reason, "message": str(error), **error.details}
+    original = getattr(error, "orig", error)
+    pgcode = getattr(original, "pgcode", None)
+    if pgcode == _QUERY_CANCELED:
+        reason = REASON_CANCELLED if cancelled else REASON_TIMEOUT
+    elif pgcode and pgcode[:2] in _UNAVAILABLE_CLASSES:
+        reason = REASON_UNAVAILABLE
+    elif isinstance(error, (exc.TimeoutError, exc.DisconnectionError)):
+        reason = REASON_UNAVAILABLE
+    elif isinstance(error, exc.DBAPIError):
+        # psycopg2 informa siempre del SQLSTATE de los errores de la SQL; sin él, no se ha llegado a la base de datos
+        no_sqlstate = hasattr(original, "pgcode") and pgcode is None
+        reason = REASON_UNAVAILABLE if no_sqlstate or error.connection_invalidated else REASON_SQL_ERROR
+    elif isinstance(error, exc.ResourceClosedError) or isinstance(error, sql_errors):
+        # La SQL no devuelve filas, o error del motor del sandbox
+        reason = REASON_SQL_ERROR
+    else:
+        reason = REASON_INTERNAL
+    return {"reason": reason, "message": str(original).strip()}
+
+class Watchdog:
+    """
+    Cancela la consulta en curso de la conexión cuando pasan `seconds` segundos (o al llamar a `cancel()`).
+    Uso: `with Watchdog(conn, seconds) as watchdog:` y `watchdog.check()` entre bloques del cursor.
+    """
+
+    def __init__(self, conn, seconds: float | None) -> None:
+        self.seconds = seconds
+        self.cancelled = threading.Event()
+        # Conexión de psycopg2 (tiene cancel()), si el driver lo permite
+        self._dbapi_connection = getattr(getattr(conn, "connection", None), "dbapi_connection", None)
+        self._timer: threading.Timer | None = None
+
+    def __enter__(self) -> "Watchdog":
+        if self.seconds:
+            self._timer = threading.Timer(self.seconds, self.cancel)
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        logger.warning(f"Watchdog: se cancela la SQL tras {self.seconds}s")
+        cancel = getattr(self._dbapi_connection, "cancel", None)
+        if cancel is not None:
+            try:
+                cancel()
+            except Exception as e:
+                logger.error(f"Watchdog: no se pudo cancelar la SQL: {e}")
+
+    def check(self) -> None:
+        if self.cancelled.is_set():
+            raise SQLGuardError(REASON_CANCELLED, f"SQL cancelada por el watchdog tras {self.seconds}s", {"max_seconds": self.seconds})
+
+class SQLGuard:
+    """
+    Ejecución protegida de las SQL de la evaluación (ver notas del módulo).
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_cost: float = 0,
+        max_rows: float = 0,
+        timeout_seconds: float = 900,
+        max_seconds: float = 1800,
+    ) -> None:
+        self.enabled = enabled
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.timeout_seconds = timeout_seconds
+        self.max_seconds = max_seconds
+
+    @classmethod
+    def from_env(cls) -> "SQLGuard":
+        return cls(
+            enabled=os.getenv("RESULTS_SQL_GUARD", "YES").upper() == "YES",
+            max_cost=float(os.getenv("RESULTS_SQL_MAX_COST", 0)),
+            max_rows=float(os.getenv("RESULTS_SQL_MAX_ROWS", 0)),
+            timeout_seconds=float(os.getenv("RESULTS_SQL_TIMEOUT_SECONDS", 900)),
+            max_seconds=float(os.getenv("RESULTS_SQL_MAX_SECONDS", 1800)),
+        )
+
+    def settings(self) -> Dict[str, Any]:
+        """
+        Límites que cambian el resultado de la ejecución (forman parte de la clave del manifiesto).
+        """
+        return {
+            "enabled": self.enabled,
+            "max_cost": self.max_cost,
+            "max_rows": self.max_rows,
+            "timeout_seconds": self.timeout_seconds,
+            "max_seconds": self.max_seconds,
+        }
+
+    def applies_to(self, conn) -> bool:
+        return self.enabled and conn.dialect.name == "postgresql"
+
+    def begin(self, conn) -> None:
+        """
+        Transacción de solo lectura con statement_timeout. Tiene que ser lo primero de la transacción
+        (también después de un rollback).
+        """
+        if not self.applies_to(conn):
+            return
+        conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+        if self.timeout_seconds:
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(self.timeout_seconds * 1000)}")
+
+    def check_plan(self, conn, sql: str) -> Dict[str, Any]:
+        """
+        EXPLAIN de la SQL: devuelve {"plan_total_cost", "plan_rows"} o lanza SQLGuardError si supera los límites.
+        """
+        if not self.applies_to(conn):
+            return {}
+        # Con text(), igual que la propia SQL en _run_sql
+        plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql_body(sql)}")).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]["Plan"]
+        estimate = {"plan_total_cost": float(root["Total Cost"]), "plan_rows": float(root["Plan Rows"])}
+
+        if self.max_cost and estimate["plan_total_cost"] > self.max_cost:
+            raise SQLGuardError(
+                REASON_PLAN_COST,
+                f"Coste estimado {estimate['plan_total_cost']:.0f} > {self.max_cost:.0f}",
+                {**estimate, "max_cost": self.max_cost},
+            )
+        if self.max_rows and estimate["plan_rows"] > self.max_rows:
+            raise SQLGuardError(
+                REASON_PLAN_ROWS,
+                f"Filas estimadas {estimate['plan_rows']:.0f} > {self.max_rows:.0f}",
+                {**estimate, "max_rows": self.max_rows},
+            )
+        return estimate
+
+    def watchdog(self, conn) -> Watchdog:
+        return Watchdog(conn, self.max_seconds if self.applies_to(conn) else None)
@@ -9,9 +9,15 @@ se ha dejado implementado la subida multiproveedor.
 
 Si se usan varios proveedores, guarda el nombre de la colección con el sufijo del proveedor.
 
+La carga es incremental: solo se generan embeddings de las tablas que han cambiado,
+se borran las tablas (y módulos) que ya no existen, y la colección sigue disponible durante la recarga.
+
 Guía rápida de uso:
 - Invoca el comando `python -m scripts.load_schema.py` en el entorno virtual del proyecto.
+- Si quieres borrar y reconstruir la colección desde cero: `python -m scripts.load_schema --reset`
+- Si quieres exportar además el snapshot local para RETRIEVER_BACKEND=NUMPY: `python -m scripts.load_schema --snapshot`
 """
+import argparse
 import sys
 import logging
 from pathlib import Path
@@ -26,6 +32,12 @@ logger = logging.getLogger("load_schema")
 load_dotenv()  # Variables de entorno desde .env
 
 def main() -> None:
+    # Argumentos de consola
+    parser = argparse.ArgumentParser(description="Carga de los archivos *_schema.json en Qdrant.")
+    parser.add_argument("--reset", action="store_true", help="Borra y vuelve a crear la colección antes de cargar.")
+    parser.add_argument("--snapshot", action="store_true", help="Exporta la colección a un snapshot local para el backend NumPy.")
+    args = parser.parse_args()
+
     # Buscamos todos los archivos *_schema.json en la carpeta knowledge
     knowledge_dir = Path("knowledge")
 
@@ -57,7 +69,12 @@ def main() -> None:
     for provider in providers:
         logger.info(f"Proveedor: {provider}")
         # Creamos el loader una sola vez por proveedor
-        loader = QdrantLoader(provider, reset_collection=True)  # Solo reset en la primera creación
+        # Por defecto la carga es incremental, solo se resetea si se pide con --reset.
+        loader = QdrantLoader(provider, reset_collection=args.reset)  # Solo reset en la primera creación
+
+        # Módulos cargados correctamente, para limpiar los que ya no tienen archivo.
+        loaded_modules = []
+        all_loaded = True
         
         # Esta parte cargará a Qdrant cada archivo `<prefijo modulo>_schema` detectado.
         for schema_file in schema_files:
@@ -68,13 +85,24 @@ def main() -> None:
                 # sin resetear la colección.
                 if schema_file != schema_files[0]:
                     loader = QdrantLoader(provider, reset_collection=False)
-                loader.load_schema(schema_file)
+                loaded_modules.append(loader.load_schema(schema_file))
                 logger.info(f"Schema {schema_file.name} cargado exitosamente.")
             except Exception as e:
                 logger.error(f"Error cargando schema {schema_file.name}: {str(e)}")
+                all_loaded = False
                 # Continuamos con el siguiente schema aunque falle uno
                 continue
 
+        # Si todos los esquemas se han cargado, borramos los módulos que ya no tienen `_schema.json`.
+        # Si alguno ha fallado no se borra nada, para no perder los puntos de ese módulo.
+        if all_loaded and loaded_modules:
+            loader.delete_other_modules(loaded_modules)
+
+        # Snapshot local de la colección para el retriever con RETRIEVER_BACKEND=NUMPY
+        if args.snapshot:
+            snapshot_dir = loader.export_snapshot()
+            logger.info(f"Snapshot exportado en {snapshot_dir}")
+
         logger.info(f"Proceso finalizado para el proveedor {provider}.")
 
 if __name__ == "__main__":
@@ -10,9 +10,11 @@ root_path = str(Path(__file__).resolve().parent.parent)
 if root_path not in sys.path:
     sys.path.insert(0, root_path)
 
+import time
 import streamlit as st
 from ui.utils.style import footer, page_config, title
 from agent.agent import Agent
+from agent.registry import health_check, warm_up
 from ui.auth.auth_decorators import require_auth
 import os
 from dotenv import load_dotenv
@@ -30,6 +32,11 @@ def app():
     Función principal que ejecuta el chatbot en el framework Streamlit.
     """
 
+    # Se inicializan los componentes compartidos del proceso (retriever y LLM de SQL)
+    # Solo la primera sesión paga su creación, el resto los reutiliza.
+    if "agent" not in st.session_state:
+        warm_up()
+
     # Se inicializa el agente y se guarda en sesión de streamlit
     if "agent" not in st.session_state:
         st.session_state.agent = Agent()
@@ -45,13 +52,11 @@ def app():
     title()
 
     # Obtener y mostrar el número de vectores
-    try:
-        collection_info = st.session_state.agent.retriever.client.get_collection(st.session_state.agent.retriever.collection)
-        num_vectors = collection_info.points_count
-        qdrant_status = True
-    except Exception as e:
+    status = health_check()
+    num_vectors = status["points_count"]
+    qdrant_status = status["qdrant"]
+    if not qdrant_status:
         #st.badge("no disponible", color="orange")
-        qdrant_status = False
         st.error(f"Error en Qdrant, revisa que Qdrant esté activado o que la colección en .env esté creada.")
 
     # Sidebar con metadatos del chatbot
@@ -124,12 +129,24 @@ def app():
 
             # Obtener respuesta
             with st.chat_message("assistant"):
+                # El script SQL se va mostrando según lo genera la tool (streaming).
+                # Se repinta como mucho cada 0.1 s para no saturar la conexión con el navegador.
+                placeholder = st.empty()
+                streamed = {"text": "", "painted_at": 0.0}
+
+                def on_token(token: str) -> None:
+                    streamed["text"] += token
+                    now = time.monotonic()
+                    if now - streamed["painted_at"] >= 0.1:
+                        placeholder.markdown(f"```sql\n{streamed['text']}\n```")
+                        streamed["painted_at"] = now
+
                 with st.spinner("Pensando..."):
                     # Obtenemos respuesta pasando el prompt
-                    response = st.session_state.agent.chat(prompt)
+                    response = st.session_state.agent.chat(prompt, on_token=on_token)
 
-                    # Mostrar respuesta en interfaz
-                    st.markdown(response)
+                    # Mostrar respuesta en interfaz (completa, sustituye a la parcial)
+                    placeholder.markdown(response)
 
                     # Añadir respuesta al historial
                     st.session_state.messages.append({"role": "assistant", "content": response})
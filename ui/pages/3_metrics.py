@@ -5,15 +5,9 @@ from ui.utils.style import footer, page_config, title
 # Importamos las métricas de interés
 from ui.utils.metrics import (
     get_fields_to_include,
-    load_metrics_data,
-    calculate_total_experiments,
-    calculate_time_metrics,
-    calculate_token_metrics,
-    calculate_cost_metrics,
-    calculate_retriever_metrics,
-    create_time_boxplots,
-    create_token_boxplots,
-    create_cost_boxplots
+    get_output_dir,
+    get_metrics_loader,
+    build_dashboard,
 )
 from ui.auth.auth import logout
 from ui.auth.auth_decorators import require_auth
@@ -45,20 +39,22 @@ def app():
     title()
     
     try:
-        # Cargar los datos
-        df = load_metrics_data()
+        # Cargar los datos (incremental y compartido entre sesiones, ver MetricsLoader)
+        output_dir = str(get_output_dir())
+        version, df = get_metrics_loader(output_dir).snapshot()
         
         # Verificar si hay datos
         if df.empty:
             st.warning("No hay datos disponibles para mostrar. De momento no existen métricas que calcular.")
             return
         
-        # Calcular métricas principales
-        total_experiments = calculate_total_experiments(df)
-        time_metrics = calculate_time_metrics(df)
-        token_metrics = calculate_token_metrics(df)
-        cost_metrics = calculate_cost_metrics(df)
-        retriever_metrics = calculate_retriever_metrics(df)
+        # Calcular métricas principales y gráficos (memoizados por versión de los datos)
+        dashboard = build_dashboard(output_dir, version, df)
+        total_experiments = dashboard["total_experiments"]
+        time_metrics = dashboard["time_metrics"]
+        token_metrics = dashboard["token_metrics"]
+        cost_metrics = dashboard["cost_metrics"]
+        retriever_metrics = dashboard["retriever_metrics"]
         
         # Subtitulo
         st.markdown("## Métricas de AI Tool: Generación de Logs de Eventos")
@@ -96,17 +92,27 @@ def app():
         # Tiempos
         with tab1:
             st.subheader("Análisis de Tiempos")
-            fig_time_total, fig_time_components = create_time_boxplots(df)
+            fig_time_total, fig_time_components = dashboard["time_figures"]
             col1, col2 = st.columns([1, 2])
             with col1:
                 st.plotly_chart(fig_time_total, use_container_width=True)
             with col2:
                 st.plotly_chart(fig_time_components, use_container_width=True)
+
+            # Latencia percibida por el usuario (streaming del script SQL)
+            if dashboard["first_token_figure"] is not None:
+                col1, col2 = st.columns([1, 2])
+                with col1:
+                    st.metric(
+                        label="Promedio seg. hasta el primer token.",
+                        value=f"{time_metrics['first_token_time_avg']:.1f} seg")
+                with col2:
+                    st.plotly_chart(dashboard["first_token_figure"], use_container_width=True)
         
         # Tokens
         with tab2:
             st.subheader("Análisis de Tokens")
-            fig_token_total, fig_token_components = create_token_boxplots(df)
+            fig_token_total, fig_token_components = dashboard["token_figures"]
             col1, col2 = st.columns([1, 2])
             with col1:
                 st.plotly_chart(fig_token_total, use_container_width=True)
@@ -116,7 +122,7 @@ def app():
         # Costes
         with tab3:
             st.subheader("Análisis de Costes")
-            fig_cost_total, fig_cost_components = create_cost_boxplots(df)
+            fig_cost_total, fig_cost_components = dashboard["cost_figures"]
             col1, col2 = st.columns([1, 2])
             with col1:
                 st.plotly_chart(fig_cost_total, use_container_width=True)
@@ -3,7 +3,7 @@ import os
 from ui.utils.style import footer, page_config, title
 from ui.auth.auth import logout
 from ui.auth.auth_decorators import require_auth
-from ui.utils.logs_sql import load_generations, format_generation
+from ui.utils.logs_sql import query_generations, load_generation, format_generation, format_selector
 from dotenv import load_dotenv
 
 # Configuración básica
@@ -34,39 +34,59 @@ def app():
     
     # Cargar y formatear página de logs SQL
     try:
-        # Cargar y formatear generaciones
-        scripts_sql_list = [format_generation(gen) for gen in load_generations()]
-        
+        # Filtros y paginación sobre el índice de generaciones (no se cargan los scripts hasta seleccionar uno)
+        col1, col2, col3 = st.columns([3, 2, 1])
+        with col1:
+            search = st.text_input("Buscar en las necesidades del usuario (texto completo) o el ID", key="logs_sql_search")
+        with col2:
+            dates = st.date_input("Rango de fechas", value=(), key="logs_sql_dates")
+        with col3:
+            page_size = st.selectbox("Por página", options=[10, 25, 50, 100], index=1, key="logs_sql_page_size")
+
+        date_from = f"{dates[0]} 00:00:00" if len(dates) > 0 else None
+        date_to = f"{dates[-1]} 23:59:59" if len(dates) > 0 else None
+
+        # Al cambiar los filtros se vuelve a la primera página
+        filters = (search, date_from, date_to, page_size)
+        if st.session_state.get("logs_sql_filters") != filters:
+            st.session_state.logs_sql_filters = filters
+            st.session_state.logs_sql_page = 1
+
+        page = st.session_state.get("logs_sql_page", 1)
+        total, rows = query_generations(search, date_from, date_to, page=page, page_size=page_size)
+
         # Si no se encuentran experimentos, avisamos.
-        if not scripts_sql_list:
+        if total == 0:
             st.warning("No hay generaciones disponibles para mostrar.")
             return
-        
-        # Si no existe variable de estado, para la selección la creamos
-        if 'selected_sql_script' not in st.session_state:
-            st.session_state.selected_sql_script = scripts_sql_list[0]['selector']
 
-        # Selector de script SQL
-        selection_options = [script['selector'] for script in scripts_sql_list]
-        try:
-            # Captura el índice de la selección guardada en variables de estado
-            index_selected = selection_options.index(st.session_state.selected_sql_script)
-        except ValueError:
-            # Si no existe, siempre índice 0
-            index_selected = 0
-        
+        pages = (total + page_size - 1) // page_size
+        if page > pages:
+            page = st.session_state.logs_sql_page = pages
+            total, rows = query_generations(search, date_from, date_to, page=page, page_size=page_size)
+
+        # Cambiar de página relanza la página con la nueva en `logs_sql_page`
+        st.number_input(f"Página (de {pages}, {total} generaciones)", min_value=1, max_value=pages, step=1, key="logs_sql_page")
+
+        # Selector de script SQL: fecha, ID y comienzo de la necesidad del usuario
+        options = {row['id']: format_selector(row) for row in rows}
+        ids = list(options)
+        index_selected = ids.index(st.session_state.selected_sql_script) if st.session_state.get("selected_sql_script") in options else 0
 
         # Elemento de selección de script SQL
         st.session_state.selected_sql_script = st.selectbox(
             "Selecciona una generación de Scritp SQL",
-            options=selection_options,
-            index=index_selected
+            options=ids,
+            index=index_selected,
+            format_func=options.get,
         )
-        
-        # Mostrar generación seleccionada
-        for gen in scripts_sql_list:
-            if gen['selector'] == st.session_state.selected_sql_script:
-                selected_gen = gen
+
+        # Solo se carga el registro completo de la generación seleccionada
+        generation = load_generation(st.session_state.selected_sql_script)
+        if generation is None:
+            st.error("No se encontró la generación seleccionada")
+            return
+        selected_gen = format_generation(generation)
         
         # Mostrar resumen del prompt
         st.markdown("### Prompt")
@@ -1,8 +1,10 @@
 import streamlit as st
-import json
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Tuple
+
+from agent.experiment_files import iter_experiment_files, read_experiment_file
+from agent.experiment_store import PREVIEW_CHARS, get_experiment_store, is_store_enabled, store_path_for
 
 def get_output_dir() -> Path:
     """
@@ -15,6 +17,8 @@ def load_generations() -> List[Dict]:
     """
     Se extraen los logs de Scripts SQL generados en la carpeta `output`.
     Ene esta caso devolvemos lista de diccionarios.
+
+    Lee todos los ficheros: solo se usa sin almacén de experimentos (ver `query_generations`).
     """
     # Apuntamos al directorio `output`
     output_dir = get_output_dir()
@@ -27,16 +31,15 @@ def load_generations() -> List[Dict]:
     # Lista para guardar todas las generaciones
     scripts_sql_list = []
 
-    # Buscar todos los archivos que empiezan por TestToolAgent_
-    for file in output_dir.glob("TestToolAgent_*.json"):
+    # Buscar todos los archivos que empiezan por TestToolAgent_ (.json o .json.gz)
+    for file in iter_experiment_files(output_dir):
         try:
             # Leer el archivo JSON
-            with open(file, 'r') as f:
-                data = json.load(f)
-                
-                # Verificar que tiene los campos necesarios
-                if "datetime" in data and "prompt_user_needs" in data and "sql_script_enhanced" in data:
-                    scripts_sql_list.append(data)
+            data = read_experiment_file(file)
+
+            # Verificar que tiene los campos necesarios
+            if "datetime" in data and "prompt_user_needs" in data and "sql_script_enhanced" in data:
+                scripts_sql_list.append(data)
                     
         except Exception as e:
             st.error(f"Error en load_generations() al leer el archivo: {file}: {e}")
@@ -45,6 +48,67 @@ def load_generations() -> List[Dict]:
     # Devolvemos la lista de diccionarios.
     return scripts_sql_list
 
+def query_generations(
+    search: str = "",
+    date_from: str | None = None,
+    date_to: str | None = None,
+    page: int = 1,
+    page_size: int = 25,
+) -> Tuple[int, List[Dict]]:
+    """
+    Página de generaciones (más recientes primero) filtrada por texto y fechas ("YYYY-MM-DD HH:MM:SS").
+    Cada fila trae solo `id`, `datetime`, `user_needs_preview` y `path`; el registro completo
+    se carga con `load_generation` al seleccionarlo.
+
+    Con el almacén de experimentos (EXPERIMENT_STORE=YES) se consulta su índice de generaciones
+    (ver agent/experiment_store.py); sin almacén se filtra en memoria sobre `load_generations()`.
+
+    Devuelve (total de generaciones que cumplen el filtro, filas de la página).
+    """
+    output_dir = get_output_dir()
+    if not output_dir.exists():
+        return 0, []
+    offset = (max(page, 1) - 1) * page_size
+
+    if is_store_enabled():
+        store = get_experiment_store(store_path_for(output_dir))
+        store.sync_from_files(output_dir)
+        return store.list_generations(search or None, date_from, date_to, page_size, offset)
+
+    search = (search or "").lower()
+    rows = [
+        {"id": gen["id"], "datetime": gen["datetime"], "user_needs_preview": gen["prompt_user_needs"][:PREVIEW_CHARS], "path": None}
+        for gen in load_generations()
+        if (not search or search in gen["prompt_user_needs"].lower() or search in gen["id"].lower())
+        and (not date_from or gen["datetime"] >= date_from)
+        and (not date_to or gen["datetime"] <= date_to)
+    ]
+    rows.sort(key=lambda row: row["datetime"], reverse=True)
+    return len(rows), rows[offset:offset + page_size]
+
+def load_generation(experiment_id: str) -> Dict | None:
+    """
+    Carga una generación completa (necesidades del usuario y script SQL final) a partir de su id.
+    """
+    output_dir = get_output_dir()
+    if is_store_enabled():
+        return get_experiment_store(store_path_for(output_dir)).read_generation(experiment_id)
+
+    # Sin almacén, el fichero se llama como el experimento
+    for suffix in (".json", ".json.gz"):
+        file = output_dir / f"{experiment_id}{suffix}"
+        if file.exists():
+            return read_experiment_file(file)
+    return None
+
+def format_selector(row: Dict) -> str:
+    """
+    Texto del selector para una fila del índice: `YYYY-MM-DD HH:MM:SS - ID - comienzo de la necesidad`.
+    """
+    preview = " ".join((row.get('user_needs_preview') or "").split())
+    preview = preview[:80] + ("..." if len(preview) > 80 else "")
+    return f"{row['datetime']} - {row['id']} - {preview}"
+
 def format_generation(gen: Dict) -> Dict:
     """
     La lista de diccionarios devuelta por `load_generations()` debe ser formateada.
@@ -1,9 +1,17 @@
 import pandas as pd
-import json
 from pathlib import Path
+import logging
 import os
+import threading
+import time
 import plotly.express as px
-from typing import List, Dict, Tuple
+import streamlit as st
+from typing import Any, List, Dict, Tuple
+
+from agent.experiment_files import iter_experiment_files, read_experiment_file
+from agent.experiment_store import get_experiment_store, is_store_enabled, store_path_for
+
+logger = logging.getLogger(__name__)
 
 def get_fields_to_include() -> Tuple[List[str], List[str], Dict[str, str]]:
     """
@@ -31,6 +39,7 @@ def get_fields_to_include() -> Tuple[List[str], List[str], Dict[str, str]]:
             "time_in_seconds_retriever",
             "time_in_seconds_sql_generation",
             "time_in_seconds_sql_generation_enhanced",
+            "time_in_seconds_first_token",
             
             # Tokens
             "tokens_total_retriever_embedding",
@@ -64,6 +73,7 @@ def get_fields_to_include() -> Tuple[List[str], List[str], Dict[str, str]]:
             "time_in_seconds_retriever",
             "time_in_seconds_sql_generation",
             "time_in_seconds_sql_generation_enhanced",
+            "time_in_seconds_first_token",
             
             # Tokens
             "tokens_total_tool",
@@ -87,6 +97,7 @@ def get_fields_to_include() -> Tuple[List[str], List[str], Dict[str, str]]:
             "time_in_seconds_retriever": "Tiempo Retriever (s)",
             "time_in_seconds_sql_generation": "Tiempo SQL Generator (s)",
             "time_in_seconds_sql_generation_enhanced": "Tiempo SQL Generator Enhanced (s)",
+            "time_in_seconds_first_token": "Tiempo Primer Token (s)",
             "tokens_total_tool": "Tokens Totales",
             "tokens_total_retriever_embedding": "Tokens Retriever",
             "tokens_total_sql_generation": "Tokens SQL Generator",
@@ -112,6 +123,9 @@ def load_metrics_data() -> pd.DataFrame:
     Carga los datos de métricas desde los archivos JSON en el directorio output.
     Solo procesa archivos que empiecen por 'TestToolAgent_'.
     Incluye solo los campos específicos definidos en la lista FIELDS_TO_INCLUDE.
+
+    Con el almacén de experimentos activo (EXPERIMENT_STORE=YES) se leen solo esas columnas de la tabla
+    de métricas, tras importar los ficheros que todavía no estén en él (ver agent/experiment_store.py).
     
     çRetorna un DataFrame con los datos seleccionados.
     """
@@ -126,16 +140,20 @@ def load_metrics_data() -> pd.DataFrame:
     if not metrics_dir.exists():
         raise ValueError(f"El directorio de métricas no existe: {metrics_dir}")
     
-    # Procesar cada archivo JSON que empiece por TestToolAgent_
-    for file in metrics_dir.glob("TestToolAgent_*.json"):
-        try:
-            with open(file, 'r') as f:
-                data = json.load(f)
+    if is_store_enabled():
+        store = get_experiment_store(store_path_for(metrics_dir))
+        store.sync_from_files(metrics_dir)
+        all_data = store.read_metrics(get_fields_to_include()[0])
+    else:
+        # Procesar cada archivo JSON que empiece por TestToolAgent_ (.json o .json.gz)
+        for file in iter_experiment_files(metrics_dir):
+            try:
+                data = read_experiment_file(file)
                 # Crear un diccionario solo con las métricas que interesen
                 filtered_data = {k: data.get(k) for k in get_fields_to_include()[0]}
                 all_data.append(filtered_data)
-        except Exception as e:
-            print(f"Error procesando archivo {file}: {str(e)}")
+            except Exception as e:
+                print(f"Error procesando archivo {file}: {str(e)}")
     
     if not all_data:
         raise ValueError("No se encontraron archivos JSON de métricas de TestToolAgent para procesar")
@@ -145,6 +163,115 @@ def load_metrics_data() -> pd.DataFrame:
     
     return df
 
+class MetricsLoader:
+    """
+    Carga incremental de las métricas de los experimentos, compartida por todas las sesiones
+    (ver `get_metrics_loader`).
+
+    - Recuerda los ficheros ya ingeridos (nombre y mtime) y solo procesa los nuevos o modificados.
+    - Con el almacén de experimentos (EXPERIMENT_STORE=YES) lee de la tabla de métricas solo las filas
+      nuevas (por rowid); sin almacén, parsea solo los ficheros nuevos.
+    - `version` aumenta cada vez que cambian los datos, sirve de clave para memoizar los gráficos.
+    - El directorio se vuelve a listar como mucho cada METRICS_REFRESH_SECONDS segundos (por defecto 2).
+    """
+
+    def __init__(self, output_dir: Path, refresh_seconds: float | None = None) -> None:
+        self.output_dir = Path(output_dir)
+        self.fields = get_fields_to_include()[0]
+        self.refresh_seconds = float(os.getenv("METRICS_REFRESH_SECONDS", 2)) if refresh_seconds is None else refresh_seconds
+        self.version = 0
+        self._df = pd.DataFrame(columns=self.fields)
+        self._seen: Dict[str, float] = {}
+        self._rowid = 0
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def _changed_files(self) -> Tuple[List[Path], List[Path]]:
+        """
+        Ficheros nuevos y ficheros ya vistos con otro mtime (solo se listan, no se abren).
+        """
+        new, modified = [], []
+        for file in iter_experiment_files(self.output_dir):
+            try:
+                mtime = file.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            seen = self._seen.get(file.name)
+            if seen != mtime:
+                (new if seen is None else modified).append(file)
+                self._seen[file.name] = mtime
+        return new, modified
+
+    def _read_files(self, files: List[Path]) -> Tuple[List[Dict[str, Any]], List[Path]]:
+        """
+        Lee los ficheros; devuelve los experimentos y sus ficheros (sin los que no se han podido leer).
+        """
+        records, read = [], []
+        for file in files:
+            try:
+                records.append(read_experiment_file(file))
+                read.append(file)
+            except Exception as e:
+                logger.warning(f"Error procesando archivo {file}: {e}")
+        return records, read
+
+    def _new_rows(self) -> List[Dict[str, Any]]:
+        new, modified = self._changed_files()
+        if not is_store_enabled():
+            return [{k: data.get(k) for k in self.fields} for data in self._read_files(new + modified)[0]]
+
+        store = get_experiment_store(store_path_for(self.output_dir))
+        if new:
+            # Solo se parsean los ficheros cuyo id todavía no está en el almacén
+            store.sync_from_files(self.output_dir)
+        if modified:
+            # Con sus ficheros, como sync_from_files, para no perder la ruta en el índice de generaciones
+            store.append_many(*self._read_files(modified))
+        rows, self._rowid = store.read_new_metrics(self.fields, self._rowid)
+        return rows
+
+    def snapshot(self) -> Tuple[int, pd.DataFrame]:
+        """
+        Devuelve (versión de los datos, DataFrame con FIELDS_TO_INCLUDE), incorporando antes lo nuevo.
+        """
+        with self._lock:
+            if time.monotonic() - self._refreshed_at >= self.refresh_seconds and self.output_dir.exists():
+                rows = self._new_rows()
+                self._refreshed_at = time.monotonic()
+                if rows:
+                    new_df = pd.DataFrame(rows, columns=self.fields)
+                    df = new_df if self._df.empty else pd.concat([self._df, new_df], ignore_index=True)
+                    # Un experimento reescrito sustituye a su versión anterior
+                    self._df = df.drop_duplicates(subset="id", keep="last").reset_index(drop=True)
+                    self.version += 1
+            return self.version, self._df
+
+@st.cache_resource
+def get_metrics_loader(output_dir: str) -> MetricsLoader:
+    """
+    Cargador de métricas del directorio, uno por proceso (compartido por todas las sesiones de Streamlit).
+    """
+    return MetricsLoader(Path(output_dir))
+
+@st.cache_resource(max_entries=4)
+def build_dashboard(output_dir: str, version: int, _df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Métricas y gráficos del panel, memoizados por versión de los datos:
+    mientras no llegan experimentos nuevos, ninguna sesión los vuelve a calcular.
+    """
+    has_first_token = bool(_df['time_in_seconds_first_token'].notna().any())
+    return {
+        "total_experiments": calculate_total_experiments(_df),
+        "time_metrics": calculate_time_metrics(_df),
+        "token_metrics": calculate_token_metrics(_df),
+        "cost_metrics": calculate_cost_metrics(_df),
+        "retriever_metrics": calculate_retriever_metrics(_df),
+        "time_figures": create_time_boxplots(_df),
+        "first_token_figure": create_first_token_boxplot(_df) if has_first_token else None,
+        "token_figures": create_token_boxplots(_df),
+        "cost_figures": create_cost_boxplots(_df),
+    }
+
 ############################################################
 # Sección de métricas
 ###############################################
@@ -165,7 +292,9 @@ def calculate_time_metrics(df: pd.DataFrame) -> dict:
         'total_time_avg': df['time_in_seconds_total'].mean(),
         'retriever_time_avg': df['time_in_seconds_retriever'].mean(),
         'sql_generation_time_avg': df['time_in_seconds_sql_generation'].mean(),
-        'sql_generation_enhanced_time_avg': df['time_in_seconds_sql_generation_enhanced'].mean()
+        'sql_generation_enhanced_time_avg': df['time_in_seconds_sql_generation_enhanced'].mean(),
+        # Los experimentos anteriores a la medida no la tienen (NaN), mean() los ignora.
+        'first_token_time_avg': df['time_in_seconds_first_token'].mean()
     }
 
 def calculate_token_metrics(df: pd.DataFrame) -> dict:
@@ -256,6 +385,44 @@ def create_time_boxplots(df: pd.DataFrame) -> tuple:
 
     return fig_total, fig_components
 
+def create_first_token_boxplot(df: pd.DataFrame):
+    """
+    Crea el boxplot del tiempo hasta el primer token frente al tiempo total (latencia percibida por el usuario).
+    Solo incluye los experimentos que tienen la medida.
+    """
+    df_first_token = df.dropna(subset=['time_in_seconds_first_token']).melt(
+        value_vars=[
+            'time_in_seconds_first_token',
+            'time_in_seconds_total'
+        ],
+        var_name='Medida',
+        value_name='Tiempo'
+    )
+
+    # Mapeo de nombres de columnas a nombres amigables
+    measure_names = {
+        'time_in_seconds_first_token': 'Primer Token',
+        'time_in_seconds_total': 'Respuesta Completa'
+    }
+
+    df_first_token['Medida'] = df_first_token['Medida'].map(measure_names)
+
+    fig = px.box(
+        df_first_token,
+        x='Medida',
+        y='Tiempo',
+        title='Tiempo hasta el Primer Token',
+        color_discrete_sequence=['#FF4B4B']
+    )
+    fig.update_layout(
+        yaxis_title='Tiempo (segundos)',
+        xaxis_title='',
+        showlegend=False,
+        height=400
+    )
+
+    return fig
+
 def create_token_boxplots(df: pd.DataFrame) -> tuple:
     """
     Crea los boxplots para los tokens.